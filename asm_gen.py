@@ -1,179 +1,525 @@
 from node_parser import NodeKind, Node, NumNode, BinaryNode, LocalVarNode, Function, ReturnNode, IfNode, WhileNode, \
-	ForNode, BlockNode
-from token_parser import error_token
-from typing import List
+	ForNode, BlockNode, walk
+from diagnostics import Diagnostics
+from emitter import Emitter
+from options import CompileOptions
+from register_alloc import scratch_registers, variable_registers, label_expression
+from peephole import optimize
+from frame_layout import SLOT_SIZE, FrameLayout, layout_frame
+from isel import is_imm32, log2_exact, multiply_by_constant, divide_by_constant
+from functools import partial
+from typing import Callable, Dict, List, Optional, TextIO, Tuple, Union
+
+# 比較の条件コード (sete, je などの e)
+conditions: Dict[NodeKind, str] = {
+	NodeKind.EQ: "e",
+	NodeKind.NE: "ne",
+	NodeKind.LT: "l",
+	NodeKind.LE: "le",
+}
+# 左右を入れ替えて比べたときの条件コード (c < x は x > c)
+swapped_conditions: Dict[NodeKind, str] = {
+	NodeKind.EQ: "e",
+	NodeKind.NE: "ne",
+	NodeKind.LT: "g",
+	NodeKind.LE: "ge",
+}
+# 条件が成り立たないときの条件コード
+negated_conditions: Dict[str, str] = {"e": "ne", "ne": "e", "l": "ge", "le": "g", "g": "le", "ge": "l"}
+# 式の生成手順。(部分式, 使うレジスタ) か、そのまま出す命令
+RegisterStep = Union[str, Tuple[Node, List[str]]]
+# 文の生成手順。ノード、そのまま出す命令、呼び出す関数のどれか
+Step = Union[Node, str, Callable[[], None]]
 
 
 class AssemblyGenerator:
-	def __init__(self, source: str):
+	def __init__(self, source: str, diagnostics: Optional[Diagnostics] = None, emitter: Optional[Emitter] = None,
+				 options: Optional[CompileOptions] = None):
 		self.source = source
+		self.diagnostics: Diagnostics = diagnostics if diagnostics is not None else Diagnostics(source)
+		self.emitter: Emitter = emitter if emitter is not None else Emitter()
+		self.emit = self.emitter.emit
+		self.options: CompileOptions = options if options is not None else CompileOptions()
 		self.label_counter = 0
+		# 生成中の関数の名前。ラベルに含めて、他の関数とぶつからないようにする
+		self.function_name: str = "main"
+		self.frame: FrameLayout = FrameLayout({}, 0)
+		# 生成中の式の Sethi-Ullman 番号と、代入を含まないか
+		self.need: Dict[int, int] = {}
+		self.pure: Dict[int, bool] = {}
+		# ループの中の文の値は使われない (関数の最後に流れ落ちても、最後に実行されるのはループの条件)
+		self.loop_depth: int = 0
 
 	def create_label(self, name=""):
 		self.label_counter += 1
-		return f".{name}__{self.label_counter}"
+		return f".{name}.{self.function_name}__{self.label_counter}"
+
+	def slot(self, node: LocalVarNode) -> int:
+		# ローカル変数のフレーム上のオフセット
+		return self.frame.offset(node.offset)
 
-	def gen_lvar_addr(self, node: Node) -> str:
-		asm = ""
+	def gen_lvar_addr(self, node: Node) -> None:
 		if not isinstance(node, LocalVarNode):
-			error_token(node.token, self.source, "代入先が不正です。")
-		asm += f"  lea rax, [rbp - {node.offset}]\n"
-		return asm
+			self.diagnostics.error_token(node.token, "代入先が不正です。")
+			return
+		self.emit(f"  lea rax, [rbp - {self.slot(node)}]")
 
-	@staticmethod
-	def gen_opcode(kind: NodeKind) -> str:
-		asm = ""
+	def gen_opcode(self, kind: NodeKind) -> None:
 		if kind == NodeKind.ADD:
-			asm += "  add rax, rdi\n"
+			self.emit("  add rax, rdi")
 		elif kind == NodeKind.SUB:
-			asm += "  sub rax, rdi\n"
+			self.emit("  sub rax, rdi")
 		elif kind == NodeKind.MUL:
-			asm += "  imul rax, rdi\n"
+			self.emit("  imul rax, rdi")
 		elif kind == NodeKind.DIV:
-			asm += "  cqo\n"
-			asm += "  idiv rdi\n"
+			self.emit("  cqo")
+			self.emit("  idiv rdi")
 		elif kind == NodeKind.EQ:
-			asm += "  cmp rax, rdi\n"
-			asm += "  sete al\n"
-			asm += "  movzb rax, al\n"
+			self.emit("  cmp rax, rdi")
+			self.emit("  sete al")
+			self.emit("  movzb rax, al")
 		elif kind == NodeKind.NE:
-			asm += "  cmp rax, rdi\n"
-			asm += "  setne al\n"
-			asm += "  movzb rax, al\n"
+			self.emit("  cmp rax, rdi")
+			self.emit("  setne al")
+			self.emit("  movzb rax, al")
 		elif kind == NodeKind.LT:
-			asm += "  cmp rax, rdi\n"
-			asm += "  setl al\n"
-			asm += "  movzb rax, al\n"
+			self.emit("  cmp rax, rdi")
+			self.emit("  setl al")
+			self.emit("  movzb rax, al")
 		elif kind == NodeKind.LE:
-			asm += "  cmp rax, rdi\n"
-			asm += "  setle al\n"
-			asm += "  movzb rax, al\n"
-		return asm
+			self.emit("  cmp rax, rdi")
+			self.emit("  setle al")
+			self.emit("  movzb rax, al")
+
+	def gen_register_opcode(self, kind: NodeKind, dst: str, src: str, steps: List[RegisterStep]) -> None:
+		if kind == NodeKind.ADD:
+			steps.append(f"  add {dst}, {src}")
+		elif kind == NodeKind.SUB:
+			steps.append(f"  sub {dst}, {src}")
+		elif kind == NodeKind.MUL:
+			steps.append(f"  imul {dst}, {src}")
+		elif kind == NodeKind.DIV:
+			steps.append(f"  mov rax, {dst}")
+			steps.append("  cqo")
+			steps.append(f"  idiv {src}")
+			steps.append(f"  mov {dst}, rax")
+
+	def location(self, node: LocalVarNode) -> str:
+		# ローカル変数をオペランドとして使うときの表記。レジスタに置いた変数はそのレジスタ
+		if node.offset in self.frame.registers:
+			return self.frame.registers[node.offset]
+		return f"qword ptr [rbp - {self.slot(node)}]"
+
+	def operand(self, node: Node) -> Optional[str]:
+		# 命令にそのまま書ける即値やローカル変数の表記。書けなければ None
+		if isinstance(node, NumNode) and is_imm32(node.val):
+			return str(node.val)
+		if isinstance(node, LocalVarNode):
+			return self.location(node)
+		return None
+
+	def gen_register(self, node: Node, registers: List[str]) -> None:
+		# 式の値を registers[0] に求める。残りのレジスタは作業用に自由に使ってよい
+		# レジスタが足りないときだけスタックに退避する
+		self.gen_steps([(node, registers)])
+
+	def gen_steps(self, steps: List[RegisterStep]) -> None:
+		# 深い式でも再帰しないように、部分式の計算と命令を実行する順に積んで処理する
+		# 部分式は register_steps で、さらに細かい手順に展開する
+		work: List[RegisterStep] = list(reversed(steps))
+		while len(work) != 0:
+			step: RegisterStep = work.pop()
+			if isinstance(step, str):
+				self.emit(step)
+				continue
+			expanded: List[RegisterStep] = []
+			self.register_steps(step[0], step[1], expanded)
+			work.extend(reversed(expanded))
+
+	def value_step(self, node: Node, registers: List[str]) -> RegisterStep:
+		# 部分式の値を registers[0] に求める手順。定数や変数は展開せずにその場で mov にする
+		if isinstance(node, NumNode):
+			return f"  mov {registers[0]}, {node.val}"
+		if isinstance(node, LocalVarNode):
+			return f"  mov {registers[0]}, {self.location(node)}"
+		return node, registers
+
+	def register_steps(self, node: Node, registers: List[str], steps: List[RegisterStep]) -> None:
+		# node の値を registers[0] に求める手順を steps に加える
+		if isinstance(node, BinaryNode) and node.kind in conditions:
+			condition: str = self.gen_compare(node, registers, steps)
+			steps.append(f"  set{condition} al")
+			steps.append(f"  movzb {registers[0]}, al")
+			return
+		if isinstance(node, BinaryNode) and self.gen_constant_operation(node, registers, steps):
+			return
+		src: Optional[str] = self.gen_operands(node, registers, steps)
+		if src is not None:
+			self.gen_register_opcode(node.kind, registers[0], src, steps)
+
+	def gen_compare(self, node: BinaryNode, registers: List[str], steps: List[RegisterStep]) -> str:
+		# 比較の cmp を出す手順を steps に加え、条件コードを返す。定数やローカル変数はそのままオペランドにする
+		lhs: Node = node.lhs
+		rhs: Node = node.rhs
+		if isinstance(lhs, NumNode) and is_imm32(lhs.val) and not isinstance(rhs, NumNode):
+			if isinstance(rhs, LocalVarNode):
+				steps.append(f"  cmp {self.location(rhs)}, {lhs.val}")
+			else:
+				steps.append(self.value_step(rhs, registers))
+				steps.append(f"  cmp {registers[0]}, {lhs.val}")
+			return swapped_conditions[node.kind]
+		src: Optional[str] = self.operand(rhs)
+		if isinstance(lhs, LocalVarNode) and src is not None:
+			# メモリどうしは比べられないので、どちらかがレジスタか即値のときだけ
+			dst: str = self.location(lhs)
+			if not (dst.startswith("qword ptr") and src.startswith("qword ptr")):
+				steps.append(f"  cmp {dst}, {src}")
+				return conditions[node.kind]
+		src = self.gen_operands(node, registers, steps)
+		steps.append(f"  cmp {registers[0]}, {src}")
+		return conditions[node.kind]
+
+	def gen_constant_operation(self, node: BinaryNode, registers: List[str], steps: List[RegisterStep]) -> bool:
+		# 右辺が定数の演算を、即値やシフト、逆数の乗算で計算する
+		lhs: Node = node.lhs
+		rhs: Node = node.rhs
+		if node.kind in (NodeKind.ADD, NodeKind.MUL) and isinstance(lhs, NumNode) and not isinstance(rhs, NumNode):
+			# 定数を右辺にそろえる (定数の評価に副作用はないので順番を入れ替えてよい)
+			lhs, rhs = rhs, lhs
+		if not isinstance(rhs, NumNode):
+			return False
+		target: str = registers[0]
+		if node.kind == NodeKind.MUL and isinstance(lhs, LocalVarNode) and is_imm32(rhs.val) \
+				and log2_exact(rhs.val) is None:
+			steps.append(f"  imul {target}, {self.location(lhs)}, {rhs.val}")
+			return True
+		if node.kind == NodeKind.MUL:
+			lines: Optional[List[str]] = multiply_by_constant(target, rhs.val)
+		elif node.kind == NodeKind.DIV:
+			lines = divide_by_constant(target, rhs.val)
+		elif node.kind == NodeKind.ADD and is_imm32(rhs.val):
+			lines = [f"  add {target}, {rhs.val}"]
+		else:
+			return False
+		if lines is None:
+			return False
+		steps.append(self.value_step(lhs, registers))
+		steps.extend(lines)
+		return True
+
+	def gen_operands(self, node: Node, registers: List[str], steps: List[RegisterStep]) -> Optional[str]:
+		# 二項演算なら左辺を registers[0] に求め、右辺のオペランドを返す
+		# 右辺は即値やローカル変数ならそのまま、そうでなければ registers[1] に求める
+		# それ以外の式は値を registers[0] に求めて None を返す
+		target: str = registers[0]
+		if isinstance(node, NumNode):
+			steps.append(f"  mov {target}, {node.val}")
+			return None
+		if isinstance(node, LocalVarNode):
+			steps.append(f"  mov {target}, {self.location(node)}")
+			return None
+		if not isinstance(node, BinaryNode):
+			self.diagnostics.error_token(node.token, "未知のノードです。")
+			return None
+
+		if node.kind == NodeKind.ASSIGN:
+			if not isinstance(node.lhs, LocalVarNode):
+				self.diagnostics.error_token(node.lhs.token, "代入先が不正です。")
+				return None
+			if node.lhs.offset in self.frame.registers:
+				self.gen_register_assign(node.lhs, node.rhs, registers, steps)
+				return None
+			steps.append(self.value_step(node.rhs, registers))
+			steps.append(f"  mov {self.location(node.lhs)}, {target}")
+			return None
 
-	def gen(self, node: Node) -> str:
-		asm = ""
+		# idiv は即値を取れない
+		if isinstance(node.rhs, NumNode) and is_imm32(node.rhs.val) and node.kind != NodeKind.DIV:
+			steps.append(self.value_step(node.lhs, registers))
+			return str(node.rhs.val)
+		if isinstance(node.rhs, LocalVarNode):
+			steps.append(self.value_step(node.lhs, registers))
+			return self.location(node.rhs)
+
+		lhs_need: int = self.need[id(node.lhs)]
+		rhs_need: int = self.need[id(node.rhs)]
+		if rhs_need > lhs_need and lhs_need < len(registers) and self.pure[id(node)]:
+			# 必要なレジスタが多い右辺を先に計算する (代入を含まなければ順番は結果に影響しない)
+			steps.append(self.value_step(node.rhs, [registers[1], target] + registers[2:]))
+			steps.append(self.value_step(node.lhs, [target] + registers[2:]))
+		elif rhs_need < len(registers):
+			steps.append(self.value_step(node.lhs, registers))
+			steps.append(self.value_step(node.rhs, registers[1:]))
+		else:
+			steps.append(self.value_step(node.lhs, registers))
+			steps.append(f"  push {target}")
+			steps.append(self.value_step(node.rhs, registers))
+			steps.append(f"  mov {registers[1]}, {target}")
+			steps.append(f"  pop {target}")
+		return registers[1]
+
+	def gen_register_assign(self, var: LocalVarNode, value: Node, registers: List[str], steps: List[RegisterStep],
+							value_needed: bool = True) -> None:
+		# レジスタに置いた変数への代入。value_needed なら値を registers[0] にも求める
+		register: str = self.frame.registers[var.offset]
+
+		def reads_var(node: Node) -> bool:
+			# 変数自身や、同じレジスタを使い回す他の変数に触れるか
+			return any(isinstance(child, LocalVarNode) and self.location(child) == register for child in walk(node))
+
+		# i = i + x - y のように左端が変数自身の加減算は、変数のレジスタを直接書き換える
+		updates: List[BinaryNode] = []
+		left: Node = value
+		while isinstance(left, BinaryNode) and left.kind in (NodeKind.ADD, NodeKind.SUB) and not reads_var(left.rhs):
+			updates.append(left)
+			left = left.lhs
+
+		if not reads_var(value):
+			# 右辺が変数自身を読まなければ、変数のレジスタに直接求める
+			steps.append(self.value_step(value, [register] + registers[1:]))
+		elif len(updates) != 0 and isinstance(left, LocalVarNode) and left.offset == var.offset:
+			for update in reversed(updates):
+				src: Optional[str] = self.operand(update.rhs)
+				if src is None:
+					steps.append(self.value_step(update.rhs, registers))
+					src = registers[0]
+				steps.append(f"  {'add' if update.kind == NodeKind.ADD else 'sub'} {register}, {src}")
+		else:
+			steps.append(self.value_step(value, registers))
+			steps.append(f"  mov {register}, {registers[0]}")
+		if value_needed:
+			steps.append(f"  mov {registers[0]}, {register}")
+
+	def gen_expr(self, node: Node) -> None:
+		# 式の値をレジスタ割り当てを使って rax に求める
+		if isinstance(node, NumNode):
+			self.emit(f"  mov rax, {node.val}")
+			return
+		if isinstance(node, LocalVarNode):
+			self.emit(f"  mov rax, {self.location(node)}")
+			return
+		self.need, self.pure = label_expression(node)
+		self.gen_register(node, scratch_registers)
+		self.emit(f"  mov rax, {scratch_registers[0]}")
+
+	def statement(self, node: Node, in_loop: bool = False) -> Step:
+		# 文として生成する手順。ループの中のレジスタに置いた変数への代入文は、値を rax に求めない
+		# ループの外では最後の文の値が返り値になりうるので、値を求める
+		if not self.options.stack_machine and (in_loop or self.loop_depth != 0) and node.kind == NodeKind.ASSIGN \
+				and isinstance(node, BinaryNode) and isinstance(node.lhs, LocalVarNode) \
+				and node.lhs.offset in self.frame.registers:
+			return partial(self.gen_assign_statement, node)
+		return node
+
+	def gen_assign_statement(self, node: BinaryNode) -> None:
+		self.need, self.pure = label_expression(node)
+		steps: List[RegisterStep] = []
+		self.gen_register_assign(node.lhs, node.rhs, scratch_registers, steps, False)
+		self.gen_steps(steps)
+
+	def gen_branch(self, node: Node, label: str, when: bool) -> None:
+		# 条件式の真偽が when のとき label へ飛ぶ
+		# 比較ならフラグで直接分岐し、0/1 の値を作らない
+		if not self.options.stack_machine and isinstance(node, BinaryNode) and node.kind in conditions:
+			self.need, self.pure = label_expression(node)
+			steps: List[RegisterStep] = []
+			condition: str = self.gen_compare(node, scratch_registers, steps)
+			steps.append(f"  j{condition if when else negated_conditions[condition]} {label}")
+			self.gen_steps(steps)
+			return
+		self.gen(node)
+		self.emit("  cmp rax, 0")
+		self.emit(f"  {'jne' if when else 'je'} {label}")
+
+	def gen(self, root: Node) -> None:
+		# 入れ子の文や式でも再帰しないように、生成する順に並べた手順を積んで処理する
+		# 手順はノード (その文や式を生成する)、文字列 (そのまま出す命令)、関数 (呼び出す) のどれか
+		work: List[Step] = [root]
+		while len(work) != 0:
+			step: Step = work.pop()
+			if isinstance(step, str):
+				self.emit(step)
+			elif isinstance(step, Node):
+				steps: List[Step] = []
+				self.gen_node(step, steps)
+				work.extend(reversed(steps))
+			else:
+				step()
+
+	def gen_node(self, node: Node, steps: List[Step]) -> None:
+		# node を生成する。中の文や式は steps に積み、それより後に出す命令も steps に加える
+		if not self.options.stack_machine and isinstance(node, (NumNode, LocalVarNode, BinaryNode)):
+			self.gen_expr(node)
+			return
 
 		if isinstance(node, NumNode):
-			asm += f"  mov rax, {node.val}\n"
-			return asm
+			self.emit(f"  mov rax, {node.val}")
+			return
 
 		if node.kind == NodeKind.LVAR:
-			asm += self.gen_lvar_addr(node)
-			asm += "  mov rax, [rax]\n"
-			return asm
+			self.gen_lvar_addr(node)
+			self.emit("  mov rax, [rax]")
+			return
 
 		if node.kind == NodeKind.RETURN:
 			if not isinstance(node, ReturnNode):
-				error_token(node.token, self.source, "RETURNトークンがReturnNode型でありません。")
-			asm += self.gen(node.value)
-			asm += "  jmp .L.end\n"
-			return asm
+				self.diagnostics.error_token(node.token, "RETURNトークンがReturnNode型でありません。")
+				return
+			steps.append(node.value)
+			steps.append(f"  jmp .L.end.{self.function_name}")
+			return
 
 		if node.kind == NodeKind.IF:
 			if not isinstance(node, IfNode):
-				error_token(node.token, self.source, "IfトークンがIfNode型でありません。")
-			asm += self.gen(node.conditions)
-			asm += "  cmp rax, 0\n"
+				self.diagnostics.error_token(node.token, "IfトークンがIfNode型でありません。")
+				return
 			end_label = self.create_label("L.endif")
 			if node.else_node is None:
-				asm += f"  je {end_label}\n"
-				asm += self.gen(node.if_node)
-				asm += f"{end_label}:\n"
+				self.gen_branch(node.conditions, end_label, False)
+				steps.append(self.statement(node.if_node))
+				steps.append(f"{end_label}:")
 			else:
 				else_label = self.create_label("L.else")
-				asm += f"  je {else_label}\n"
-				asm += self.gen(node.if_node)
-				asm += f"  jmp {end_label}\n"
-				asm += f"{else_label}:\n"
-				asm += self.gen(node.else_node)
-				asm += f"{end_label}:\n"
-			return asm
+				self.gen_branch(node.conditions, else_label, False)
+				steps.append(self.statement(node.if_node))
+				steps.append(f"  jmp {end_label}")
+				steps.append(f"{else_label}:")
+				steps.append(self.statement(node.else_node))
+				steps.append(f"{end_label}:")
+			return
 
+		# ループは条件を末尾に置き、1周あたりの分岐を1つにする
 		if node.kind == NodeKind.WHILE:
 			if not isinstance(node, WhileNode):
-				error_token(node.token, self.source, "WhileトークンがWhileNode型でありません。")
+				self.diagnostics.error_token(node.token, "WhileトークンがWhileNode型でありません。")
+				return
 			begin_label = self.create_label("L.begin_while")
-			end_label = self.create_label("L.end_while")
-			asm += f"{begin_label}:\n"
-			asm += self.gen(node.conditions)
-			asm += f"  cmp rax, 0\n"
-			asm += f"  je {end_label}\n"
-			asm += self.gen(node.loop_node)
-			asm += f"  jmp {begin_label}\n"
-			asm += f"{end_label}:\n"
-			return asm
+			cond_label = self.create_label("L.cond_while")
+			steps.append(f"  jmp {cond_label}")
+			steps.append(f"{begin_label}:")
+			steps.append(self.enter_loop)
+			steps.append(self.statement(node.loop_node, True))
+			steps.append(partial(self.leave_loop, cond_label, node.conditions, begin_label))
+			return
 
 		if node.kind == NodeKind.FOR:
 			if not isinstance(node, ForNode):
-				error_token(node.token, self.source, "WhileトークンがWhileNode型でありません。")
+				self.diagnostics.error_token(node.token, "WhileトークンがWhileNode型でありません。")
+				return
 			begin_label = self.create_label("L.begin_for")
-			end_label = self.create_label("L.end_for")
+			cond_label = self.create_label("L.cond_for")
 			if node.init is not None:
-				asm += self.gen(node.init)
-			asm += f"{begin_label}:\n"
+				steps.append(self.statement(node.init))
 			if node.conditions is not None:
-				asm += self.gen(node.conditions)
-				asm += f"  cmp rax, 0\n"
-				asm += f"  je {end_label}\n"
-			asm += self.gen(node.loop_node)
+				steps.append(f"  jmp {cond_label}")
+			steps.append(f"{begin_label}:")
+			steps.append(self.enter_loop)
+			steps.append(self.statement(node.loop_node, True))
 			if node.inc is not None:
-				asm += self.gen(node.inc)
-			asm += f"  jmp {begin_label}\n"
-			asm += f"{end_label}:\n"
-			return asm
+				steps.append(self.statement(node.inc, True))
+			steps.append(partial(self.leave_loop, cond_label, node.conditions, begin_label))
+			return
 
 		if node.kind == NodeKind.BLOCK:
 			if not isinstance(node, BlockNode):
-				error_token(node.token, self.source, "BlockトークンがBlockNode型でありません。")
-			for node in node.nodes:
-				asm += self.gen(node)
-			return asm
+				self.diagnostics.error_token(node.token, "BlockトークンがBlockNode型でありません。")
+				return
+			steps.extend(self.statement(statement) for statement in node.nodes)
+			return
 
 		if not isinstance(node, BinaryNode):
-			error_token(node.token, self.source, "未知のノードです。")
+			self.diagnostics.error_token(node.token, "未知のノードです。")
+			return
 
 		if node.kind == NodeKind.ASSIGN:
-			asm += self.gen_lvar_addr(node.lhs)
-			asm += "  push rax\n"
-			asm += self.gen(node.rhs)
-			asm += "  push rax\n"
-			asm += "  pop rdi\n"
-			asm += "  pop rax\n"
-			asm += "  mov [rax], rdi\n"
-			return asm
-
-		asm += self.gen(node.lhs)
-		asm += "  push rax\n"
-		asm += self.gen(node.rhs)
-		asm += "  push rax\n"
-		asm += "  pop rdi\n"
-		asm += "  pop rax\n"
-		asm += self.gen_opcode(node.kind)
-		return asm
-
-	def function(self, function: Function) -> str:
-		asm = ""
-		asm += "{}:\n".format(function.name)
-		asm += "  push rbp\n"
-		asm += "  mov rbp, rsp\n"
-		offset: int = sum([function.lvar_offsets[name] for name in function.lvar_offsets])
-		asm += "  sub rsp, {}\n".format(offset)
+			self.gen_lvar_addr(node.lhs)
+			self.emit("  push rax")
+			steps.append(node.rhs)
+			steps.append("  push rax")
+			steps.append("  pop rdi")
+			steps.append("  pop rax")
+			steps.append("  mov [rax], rdi")
+			# 代入式の値は代入した値
+			steps.append("  mov rax, rdi")
+			return
+
+		steps.append(node.lhs)
+		steps.append("  push rax")
+		steps.append(node.rhs)
+		steps.append("  push rax")
+		steps.append("  pop rdi")
+		steps.append("  pop rax")
+		steps.append(partial(self.gen_opcode, node.kind))
+
+	def enter_loop(self) -> None:
+		self.loop_depth += 1
+
+	def leave_loop(self, cond_label: str, conditions: Optional[Node], begin_label: str) -> None:
+		# ループの本体を生成し終えたら、末尾に条件を置く。条件がなければ先頭に戻るだけ
+		self.loop_depth -= 1
+		if conditions is not None:
+			self.emitter.label(cond_label)
+			self.gen_branch(conditions, begin_label, True)
+		else:
+			self.emit(f"  jmp {begin_label}")
+
+	def function(self, function: Function) -> None:
+		self.function_name = function.name
+		self.emit(f".global {function.name}")
+		self.emitter.label(function.name)
+		self.emit("  push rbp")
+		self.emit("  mov rbp, rsp")
+		# スタックマシンは変数をアドレスで読み書きするので、レジスタには置かない
+		promote: bool = self.options.promote_locals and not self.options.stack_machine
+		self.frame = layout_frame(function, self.options.share_stack_slots, variable_registers if promote else ())
+		saved_size: int = len(self.frame.saved_registers) * SLOT_SIZE
+		for register in self.frame.saved_registers:
+			self.emit(f"  push {register}")
+		if self.frame.size != saved_size:
+			self.emit("  sub rsp, {}".format(self.frame.size - saved_size))
 		for node in function.nodes:
-			asm += self.gen(node)
-		asm += ".L.end:\n"
-		asm += "  mov rsp, rbp\n"
-		asm += "  pop rbp\n"
-		asm += "  ret\n"
-		return asm
-
-	def program(self, functions: List[Function]):
-		asm = ""
-		asm += ".intel_syntax noprefix\n"
-		asm += ".global main\n"
-		asm += "".join(map(self.function, functions))
-		return asm
-
-
-def asm_gen(functions: List[Function], source: str) -> str:
-	generator = AssemblyGenerator(source)
-	return generator.program(functions)
+			self.gen(node)
+		self.emitter.label(f".L.end.{function.name}")
+		if len(self.frame.saved_registers) != 0:
+			self.emit(f"  lea rsp, [rbp - {saved_size}]")
+			for register in reversed(self.frame.saved_registers):
+				self.emit(f"  pop {register}")
+		else:
+			self.emit("  mov rsp, rbp")
+		self.emit("  pop rbp")
+		self.emit("  ret")
+
+	def program(self, functions: List[Function]) -> None:
+		self.emit(".intel_syntax noprefix")
+		for function in functions:
+			self.function(function)
+
+
+def finish_assembly(emitter: Emitter, options: CompileOptions, sink: Optional[TextIO] = None,
+					stats: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+	# 貯めた命令にのぞき穴最適化をかけて書き出す
+	if options.peephole:
+		emitter.lines, peephole_stats = optimize(emitter.lines, options.disabled_peephole_rules)
+		if stats is not None:
+			stats["peephole"] = peephole_stats
+		if sink is not None:
+			emitter.write_to(sink)
+			return ""
+	return emitter.getvalue()
+
+
+def asm_gen(functions: List[Function], source: str, diagnostics: Optional[Diagnostics] = None,
+			sink: Optional[TextIO] = None, options: Optional[CompileOptions] = None,
+			stats: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+	# sinkを渡すとアセンブリをそのまま書き出し、空文字列を返す
+	# diagnosticsが渡されなければ、エラーがあった時点でCompileErrorを投げる
+	# statsを渡すと、のぞき穴最適化の規則ごとに取り除いた命令数を記録する
+	if options is None:
+		options = CompileOptions()
+	# のぞき穴最適化をする場合は、いったん命令を貯めてから書き出す
+	emitter = Emitter(None if options.peephole else sink)
+	generator = AssemblyGenerator(source, diagnostics, emitter, options)
+	generator.program(functions)
+	if diagnostics is None:
+		generator.diagnostics.check()
+	return finish_assembly(emitter, options, sink, stats)
@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from main import compile_source, add_option_arguments, options_from_args
+from diagnostics import CompileError
+from options import CompileOptions
+from compile_cache import CompileCache, DEFAULT_MAX_BYTES
+from typing import List, Optional, Tuple
+
+
+class BatchResult:
+	def __init__(self, source_path: str, output_path: str, seconds: float, error: Optional[str] = None) -> None:
+		self.source_path: str = source_path
+		self.output_path: str = output_path
+		self.seconds: float = seconds
+		# コンパイルエラーや読み書きの失敗、内部エラーの内容。成功したらNone
+		self.error: Optional[str] = error
+
+	def __repr__(self) -> str:
+		return f"<class BatchResult {self.source_path} {self.seconds:.6f}s error={self.error is not None}>"
+
+
+def read_manifest(path: str) -> List[str]:
+	# 1行に1つのソースファイル。空行と # で始まる行は読み飛ばす。相対パスはマニフェストの場所から見る
+	base: str = os.path.dirname(os.path.abspath(path))
+	sources: List[str] = []
+	with open(path) as f:
+		for line in f:
+			line = line.strip()
+			if line != "" and not line.startswith("#"):
+				sources.append(os.path.join(base, line))
+	return sources
+
+
+def output_paths(sources: List[str], output_dir: str) -> List[str]:
+	# 入力のディレクトリ構成を出力ディレクトリの下にそのまま写す (同じ名前のファイルがぶつからないように)
+	paths: List[str] = [os.path.abspath(source) for source in sources]
+	root: str = os.path.commonpath([os.path.dirname(path) for path in paths]) if len(paths) != 0 else ""
+	return [os.path.join(output_dir, os.path.splitext(os.path.relpath(path, root))[0] + ".s") for path in paths]
+
+
+def compile_file(job: Tuple[str, str, CompileOptions, Optional[str], int]) -> BatchResult:
+	# ワーカープロセスで1ファイルをコンパイルする。例外は投げずに結果に入れて返す
+	source_path, output_path, options, cache_dir, cache_size = job
+	start: float = time.perf_counter()
+	try:
+		with open(source_path) as f:
+			source: str = f.read()
+		cache: Optional[CompileCache] = CompileCache(cache_dir, cache_size) if cache_dir is not None else None
+		asm: str = compile_source(source, options, cache=cache)
+		os.makedirs(os.path.dirname(output_path), exist_ok=True)
+		with open(output_path, "w") as f:
+			f.write(asm)
+	except CompileError as e:
+		return BatchResult(source_path, output_path, time.perf_counter() - start, e.diagnostics.report())
+	except OSError as e:
+		return BatchResult(source_path, output_path, time.perf_counter() - start, str(e))
+	except UnicodeDecodeError as e:
+		return BatchResult(source_path, output_path, time.perf_counter() - start,
+						   f"{source_path}: テキストとして読めません ({e})")
+	except Exception:
+		# コンパイラの内部エラーでも、ほかのファイルのコンパイルは止めない
+		return BatchResult(source_path, output_path, time.perf_counter() - start,
+						   f"{source_path}: コンパイラの内部エラーです。\n{traceback.format_exc()}")
+	return BatchResult(source_path, output_path, time.perf_counter() - start)
+
+
+def compile_batch(sources: List[str], output_dir: str, options: Optional[CompileOptions] = None,
+				  jobs: Optional[int] = None, cache_dir: Optional[str] = None,
+				  cache_size: int = DEFAULT_MAX_BYTES) -> List[BatchResult]:
+	# ソースファイルをプロセスプールで並列にコンパイルし、入力と同じ順番で結果を返す
+	# jobs を省略するとCPUの数だけプロセスを使う。1なら同じプロセスで順にコンパイルする
+	if options is None:
+		options = CompileOptions()
+	if jobs is None:
+		jobs = os.cpu_count() or 1
+	work: List[Tuple[str, str, CompileOptions, Optional[str], int]] = [
+		(source, output, options, cache_dir, cache_size) for source, output in zip(sources, output_paths(sources, output_dir))
+	]
+	if jobs == 1 or len(work) <= 1:
+		return [compile_file(job) for job in work]
+	# 小さなファイルが多いときのやり取りの回数を減らすため、まとめてワーカーに渡す
+	chunksize: int = max(1, len(work) // (jobs * 4))
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		return list(executor.map(compile_file, work, chunksize=chunksize))
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="複数のソースファイルをまとめてコンパイルする")
+	parser.add_argument("sources", nargs="*")
+	parser.add_argument("--manifest", metavar="FILE", help="ソースファイルを1行に1つずつ書いたファイル")
+	parser.add_argument("-o", "--output-dir", required=True, metavar="DIR", help=".s ファイルを書き出すディレクトリ")
+	parser.add_argument("-j", "--jobs", type=int, metavar="N", help="並列に動かすプロセスの数 (既定はCPUの数)")
+	add_option_arguments(parser)
+	args = parser.parse_args()
+	sources: List[str] = list(args.sources)
+	if args.manifest is not None:
+		sources += read_manifest(args.manifest)
+	if len(sources) == 0:
+		parser.error("ソースファイルが指定されていません")
+
+	start: float = time.perf_counter()
+	results: List[BatchResult] = compile_batch(sources, args.output_dir, options_from_args(args), args.jobs,
+											   args.cache_dir, args.cache_size)
+	elapsed: float = time.perf_counter() - start
+	errors: int = 0
+	for result in results:
+		if result.error is None:
+			print(f"ok    {result.seconds * 1000:9.3f}ms  {result.source_path} -> {result.output_path}")
+		else:
+			errors += 1
+			print(f"error {result.seconds * 1000:9.3f}ms  {result.source_path}")
+			print(result.error, file=sys.stderr)
+	print(f"{len(results)} files, {errors} errors, {elapsed:.3f}s")
+	if errors != 0:
+		exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,292 @@
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from main import build_tree_passes, build_ir_passes, add_option_arguments, options_from_args
+from token_parser import tokenize
+from node_parser import node_parse
+from asm_gen import asm_gen
+from ir import lower_function
+from ir_asm_gen import ir_asm_gen
+from diagnostics import Diagnostics
+from options import CompileOptions
+from compile_cache import options_key
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PHASES: List[str] = ["tokenize", "parse", "optimize", "codegen"]
+DEFAULT_SIZES: List[int] = [1_000, 10_000, 100_000]
+# 時間が大きさのこの指数より速く伸びたら超線形とみなす
+# 1.15 乗は大きさを10倍にしたとき時間が約14倍。計測の揺れは 1.1 乗程度に収まる
+DEFAULT_MAX_EXPONENT: float = 1.15
+# これより短い時間の計測は誤差が大きいので、伸び方の判定に使わない
+MIN_SECONDS: float = 0.005
+# 超線形と判定された段階があれば、全部の大きさをこの回数まで測り直して確かめる
+CONFIRM_ROUNDS: int = 5
+UNITS: Dict[str, int] = {"K": 1_000, "M": 1_000_000}
+
+comparison_ops: List[str] = ["==", "!=", "<", "<=", ">", ">="]
+arithmetic_ops: List[str] = ["+", "-", "*"]
+
+
+class ProgramGenerator:
+	# 今の文法で書ける、終了するプログラムを作る
+	# ループの変数は入れ子の深さごとに専用のものを使い、本体では書き換えないので必ず終わる
+	# 除算は0や-1にならない定数でしか割らない
+	def __init__(self, depth: int = 3, nesting: int = 2, variables: int = 8, seed: int = 0) -> None:
+		self.depth: int = depth
+		self.nesting: int = nesting
+		self.names: List[str] = [f"v{i}" for i in range(variables)]
+		self.random: random.Random = random.Random(seed)
+		self.statements: int = 0
+
+	def expression(self, depth: int) -> str:
+		choice: float = self.random.random()
+		if depth == 0 or choice < 0.2:
+			if self.random.random() < 0.6:
+				return self.random.choice(self.names)
+			return str(self.random.randrange(100))
+		if choice < 0.3:
+			return f"({self.expression(depth - 1)} / {self.random.randrange(1, 10)})"
+		if choice < 0.4:
+			return f"({self.expression(depth - 1)} {self.random.choice(comparison_ops)} {self.expression(depth - 1)})"
+		if choice < 0.45:
+			return f"-{self.random.choice(self.names)}"
+		return f"({self.expression(depth - 1)} {self.random.choice(arithmetic_ops)} {self.expression(depth - 1)})"
+
+	def assignment(self) -> str:
+		self.statements += 1
+		return f"{self.random.choice(self.names)} = {self.expression(self.depth)};"
+
+	def statement(self, level: int) -> str:
+		choice: float = self.random.random()
+		if level >= self.nesting or choice < 0.6:
+			return self.assignment()
+		self.statements += 1
+		body: str = " ".join(self.statement(level + 1) for _ in range(self.random.randrange(1, 4)))
+		counter: str = f"l{level}"
+		if choice < 0.75:
+			condition: str = f"{self.expression(1)} {self.random.choice(comparison_ops)} {self.expression(1)}"
+			return f"if ({condition}) {{ {body} }} else {self.assignment()}"
+		if choice < 0.9:
+			return f"for ({counter} = 0; {counter} < {self.random.randrange(1, 4)}; {counter} = {counter} + 1) {{ {body} }}"
+		return f"{counter} = {self.random.randrange(1, 4)}; while ({counter} > 0) {{ {body} {counter} = {counter} - 1; }}"
+
+	def program(self, size: int) -> str:
+		# 大きさがおよそ size バイトになるまで文を並べる
+		parts: List[str] = [f"{name} = {i + 1};" for i, name in enumerate(self.names)]
+		length: int = sum(len(part) + 1 for part in parts)
+		while length < size:
+			part: str = self.statement(0)
+			parts.append(part)
+			length += len(part) + 1
+		parts.append(f"return {' + '.join(self.names)};")
+		return "\n".join(parts)
+
+
+def generate_program(size: int, depth: int = 3, nesting: int = 2, variables: int = 8, seed: int = 0) -> str:
+	return ProgramGenerator(depth, nesting, variables, seed).program(size)
+
+
+def run_phases(source: str, options: CompileOptions) -> List[Tuple[str, Callable[[Any], Any]]]:
+	# 各段階を前の段階の結果を受け取る関数として並べる。compile_source と同じ順にパスをかける
+	diagnostics = Diagnostics(source)
+
+	def optimize(function: Any) -> Any:
+		build_tree_passes(options).run(function)
+		return function
+
+	def codegen(function: Any) -> str:
+		if options.use_ir:
+			ir_function = lower_function(function, diagnostics, options.share_stack_slots)
+			build_ir_passes(options).run(ir_function)
+			asm: str = ir_asm_gen([ir_function], options=options)
+		else:
+			asm = asm_gen([function], source, diagnostics, options=options)
+		diagnostics.check()
+		return asm
+
+	return [
+		("tokenize", lambda _: tokenize(source, diagnostics)),
+		("parse", lambda tokens: node_parse(tokens, source, diagnostics)),
+		("optimize", optimize),
+		("codegen", codegen),
+	]
+
+
+def time_phases(source: str, options: CompileOptions) -> Dict[str, float]:
+	# 1回コンパイルしたときの段階ごとの時間 (秒)
+	seconds: Dict[str, float] = {}
+	value: Any = None
+	for phase, function in run_phases(source, options):
+		gc.collect()
+		start: float = time.perf_counter()
+		value = function(value)
+		seconds[phase] = time.perf_counter() - start
+	return seconds
+
+
+def memory_phases(source: str, options: CompileOptions) -> Dict[str, int]:
+	# 段階ごとのピークのメモリ使用量 (バイト)
+	# tracemalloc は実行を遅くするので、時間とは別にもう1回コンパイルして測る
+	peaks: Dict[str, int] = {}
+	value: Any = None
+	for phase, function in run_phases(source, options):
+		# 段階ごとに追跡をやり直し、その段階で新しく確保したメモリのピークを測る
+		gc.collect()
+		tracemalloc.start()
+		try:
+			value = function(value)
+			peaks[phase] = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	return peaks
+
+
+def growth_exponents(points: List[Tuple[int, float]]) -> List[float]:
+	# 隣り合う大きさの間で、時間が大きさの何乗で伸びたか。短すぎる計測は飛ばす
+	points = [(size, seconds) for size, seconds in sorted(points) if seconds >= MIN_SECONDS]
+	return [
+		math.log(seconds / previous_seconds) / math.log(size / previous_size)
+		for (previous_size, previous_seconds), (size, seconds) in zip(points, points[1:])
+	]
+
+
+def superlinear_phases(results: List[Dict[str, Any]], max_exponent: float = DEFAULT_MAX_EXPONENT) -> Dict[str, float]:
+	# 伸び方が max_exponent を超えた段階と、その最大の指数
+	flagged: Dict[str, float] = {}
+	for phase in PHASES + ["total"]:
+		points: List[Tuple[int, float]] = [
+			(result["bytes"], result["total_seconds"] if phase == "total" else result["phases"][phase]["seconds"])
+			for result in results
+		]
+		exponents: List[float] = growth_exponents(points)
+		if len(exponents) != 0 and max(exponents) > max_exponent:
+			flagged[phase] = max(exponents)
+	return flagged
+
+
+def git_revision() -> Optional[str]:
+	try:
+		proc = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	except OSError:
+		return None
+	return proc.stdout.decode().strip() if proc.returncode == 0 else None
+
+
+def run_benchmark(sizes: List[int], options: Optional[CompileOptions] = None, depth: int = 3, nesting: int = 2,
+				  variables: int = 8, seed: int = 0, repeat: int = 3,
+				  max_exponent: float = DEFAULT_MAX_EXPONENT) -> Dict[str, Any]:
+	if options is None:
+		options = CompileOptions()
+	results: List[Dict[str, Any]] = []
+	sources: List[str] = []
+	for size in sizes:
+		generator: ProgramGenerator = ProgramGenerator(depth, nesting, variables, seed)
+		source: str = generator.program(size)
+		sources.append(source)
+		results.append({
+			"size": size,
+			"bytes": len(source),
+			"statements": generator.statements,
+			"tokens": len(tokenize(source)),
+			"phases": {phase: {"seconds": math.inf} for phase in PHASES},
+		})
+
+	def time_round() -> None:
+		# 大きさを順に1回ずつ測り、最短の時間を残す
+		# 同じ大きさを続けて測ると、その間だけマシンが遅いときに伸び方の判定を誤るので、揺れを大きさの間にならす
+		for source, result in zip(sources, results):
+			for phase, seconds in time_phases(source, options).items():
+				result["phases"][phase]["seconds"] = min(result["phases"][phase]["seconds"], seconds)
+			result["total_seconds"] = sum(phase["seconds"] for phase in result["phases"].values())
+
+	for _ in range(repeat):
+		time_round()
+	# 揺れで超線形に見えただけなら、測り直すと最短の時間が下がって消える。本当に超線形なら残る
+	rounds: int = repeat
+	while len(superlinear_phases(results, max_exponent)) != 0 and rounds < repeat + CONFIRM_ROUNDS:
+		time_round()
+		rounds += 1
+	for source, result in zip(sources, results):
+		for phase, peak in memory_phases(source, options).items():
+			result["phases"][phase]["peak_bytes"] = peak
+	return {
+		"revision": git_revision(),
+		"python": platform.python_version(),
+		"options": json.loads(options_key(options)),
+		"shape": {"depth": depth, "nesting": nesting, "variables": variables, "seed": seed, "repeat": repeat},
+		"rounds": rounds,
+		"results": results,
+		"max_exponent": max_exponent,
+		"superlinear": superlinear_phases(results, max_exponent),
+	}
+
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any]) -> List[str]:
+	# 同じ大きさの結果どうしで、時間が何倍になったか
+	lines: List[str] = []
+	previous: Dict[int, Dict[str, Any]] = {result["size"]: result for result in baseline["results"]}
+	for result in report["results"]:
+		old: Optional[Dict[str, Any]] = previous.get(result["size"])
+		if old is None:
+			continue
+		ratios: str = " ".join(
+			f"{phase}={result['phases'][phase]['seconds'] / old['phases'][phase]['seconds']:.2f}x"
+			for phase in PHASES if old["phases"][phase]["seconds"] > 0
+		)
+		lines.append(f"{result['size']:>10} {ratios}")
+	return lines
+
+
+def parse_size(text: str) -> int:
+	# 1K, 10M のような大きさ
+	unit: int = UNITS.get(text[-1:].upper(), 1)
+	return int(float(text[:-1] if unit != 1 else text) * unit)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="生成したプログラムで、コンパイルの段階ごとの時間とメモリを測る")
+	parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), metavar="LIST",
+						help="プログラムの大きさ (バイト) のカンマ区切り。1K や 10M とも書ける")
+	parser.add_argument("--depth", type=int, default=3, help="式の深さ")
+	parser.add_argument("--nesting", type=int, default=2, help="分岐やループの入れ子の深さ")
+	parser.add_argument("--variables", type=int, default=8, help="変数の数")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--repeat", type=int, default=3, help="時間を測る回数 (最短のものを使う)")
+	parser.add_argument("--max-exponent", type=float, default=DEFAULT_MAX_EXPONENT,
+						help="これより速く時間が伸びる段階があれば失敗にする")
+	parser.add_argument("--output", metavar="FILE", help="結果を書き出す JSON ファイル")
+	parser.add_argument("--compare", metavar="FILE", help="前に書き出した結果と比べる")
+	add_option_arguments(parser)
+	args = parser.parse_args()
+	sizes: List[int] = [parse_size(size) for size in args.sizes.split(",")]
+
+	report: Dict[str, Any] = run_benchmark(sizes, options_from_args(args), args.depth, args.nesting, args.variables,
+										   args.seed, args.repeat, args.max_exponent)
+	for result in report["results"]:
+		phases: str = " ".join(
+			f"{phase}={values['seconds'] * 1000:.1f}ms/{values['peak_bytes'] / 1024:.0f}KiB"
+			for phase, values in result["phases"].items()
+		)
+		print(f"{result['bytes']:>10}B {result['tokens']:>9} tokens  {phases}")
+	if args.compare is not None:
+		with open(args.compare) as f:
+			for line in compare(json.load(f), report):
+				print(line)
+	if args.output is not None:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	for phase, exponent in report["superlinear"].items():
+		print(f"超線形: {phase} の時間が大きさの {exponent:.2f} 乗で伸びています", file=sys.stderr)
+	if len(report["superlinear"]) != 0:
+		exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from options import CompileOptions
+from typing import Dict, List, Optional, Tuple
+
+# キャッシュの大きさの既定値 (バイト)
+DEFAULT_MAX_BYTES: int = 64 * 1024 * 1024
+CACHE_SUFFIX: str = ".s"
+
+
+# 生成するアセンブリに関わるモジュール。batch.py や compile_server.py などの道具を書き換えてもキャッシュは消えない
+compiler_modules: List[str] = [
+	"token_parser", "node_parser", "diagnostics", "options", "main", "pass_manager",
+	"const_fold", "dce", "loop_opt", "value_numbering", "ir",
+	"asm_gen", "emitter", "frame_layout", "register_alloc", "isel", "ir_asm_gen", "peephole",
+]
+
+
+@lru_cache(maxsize=None)
+def compiler_version() -> str:
+	# コンパイラのソースのハッシュ。どれかを書き換えると、それまでのキャッシュは使われなくなる
+	directory: str = os.path.dirname(os.path.abspath(__file__))
+	digest = hashlib.sha256()
+	for name in sorted(compiler_modules):
+		with open(os.path.join(directory, name + ".py"), "rb") as f:
+			digest.update(name.encode() + b"\0" + f.read() + b"\0")
+	return digest.hexdigest()
+
+
+def options_key(options: CompileOptions) -> str:
+	# 集合は実行ごとに並び順が変わるので、並べ替えてから文字列にする
+	fields: Dict[str, object] = {
+		name: sorted(value) if isinstance(value, frozenset) else value for name, value in options.__dict__.items()
+	}
+	return json.dumps(fields, sort_keys=True)
+
+
+def cache_key(source: str, options: CompileOptions) -> str:
+	digest = hashlib.sha256()
+	for part in (compiler_version(), options_key(options), source):
+		digest.update(part.encode() + b"\0")
+	return digest.hexdigest()
+
+
+class CompileCache:
+	# 生成したアセンブリを、ソースとオプションのハッシュをファイル名にしてディレクトリに保存する
+	# compile_source に渡すと、保存したものがあればコンパイルせずにそれを返す
+	# 大きさが max_bytes を超えたら、最後に使った時刻 (mtime) の古いものから消す
+	def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+		self.directory: str = directory
+		self.max_bytes: int = max_bytes
+		self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+		os.makedirs(directory, exist_ok=True)
+
+	def path(self, key: str) -> str:
+		return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+	def get(self, key: str) -> Optional[str]:
+		path: str = self.path(key)
+		try:
+			with open(path) as f:
+				asm: str = f.read()
+			# 使った時刻を更新して、追い出される順番を後ろにする
+			os.utime(path)
+		except FileNotFoundError:
+			# 他のプロセスが追い出した直後でも、見つからなかったものとして扱う
+			self.stats["misses"] += 1
+			return None
+		self.stats["hits"] += 1
+		return asm
+
+	def put(self, key: str, asm: str) -> None:
+		# max_bytes より大きいものは、書いてもすぐに追い出されるので保存しない
+		if len(asm.encode()) > self.max_bytes:
+			return
+		# 一時ファイルに書いてから置き換えるので、読む側が書きかけのファイルを見ることはない
+		fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		try:
+			with os.fdopen(fd, "w") as f:
+				f.write(asm)
+			os.replace(temp_path, self.path(key))
+		except BaseException:
+			os.remove(temp_path)
+			raise
+		self.evict()
+
+	def entries(self) -> List[Tuple[float, int, str]]:
+		# (最後に使った時刻, 大きさ, パス)
+		result: List[Tuple[float, int, str]] = []
+		for entry in os.scandir(self.directory):
+			if not entry.name.endswith(CACHE_SUFFIX):
+				continue
+			try:
+				stat = entry.stat()
+			except FileNotFoundError:
+				continue
+			result.append((stat.st_mtime, stat.st_size, entry.path))
+		return result
+
+	def evict(self) -> None:
+		entries: List[Tuple[float, int, str]] = sorted(self.entries())
+		total: int = sum(size for _, size, _ in entries)
+		for _, size, path in entries:
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(path)
+				self.stats["evictions"] += 1
+			except FileNotFoundError:
+				pass
+			total -= size
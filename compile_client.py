@@ -0,0 +1,62 @@
+import os
+import socket
+import sys
+from compile_protocol import HEADER, default_socket_path, encode, decode_length, decode
+from typing import List, Optional, Tuple
+
+# main.py と同じ引数を受け取り、コンパイルサーバーに送って結果を表示する
+# サーバーが動いていなければ、このプロセスでコンパイルする
+# 起動を速くするため、コンパイラのモジュールはサーバーにつながらなかったときだけ読み込む
+SOCKET_ENVIRONMENT: str = "PYTHON_C_COMPILER_SOCKET"
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+	data: bytes = b""
+	while len(data) < size:
+		chunk: bytes = connection.recv(size - len(data))
+		if chunk == b"":
+			raise ConnectionError("サーバーが接続を閉じました。")
+		data += chunk
+	return data
+
+
+class CompileClient:
+	# 1つの接続で続けて要求を送る
+	def __init__(self, socket_path: Optional[str] = None) -> None:
+		self.connection: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self.connection.connect(socket_path if socket_path is not None else default_socket_path())
+		except OSError:
+			self.connection.close()
+			raise
+
+	def request(self, argv: List[str]) -> Tuple[int, str, str]:
+		self.connection.sendall(encode({"argv": argv}))
+		response = decode(receive_exactly(self.connection, decode_length(receive_exactly(self.connection, HEADER.size))))
+		return response["status"], response["stdout"], response["stderr"]
+
+	def close(self) -> None:
+		self.connection.close()
+
+
+def run(argv: List[str], socket_path: Optional[str] = None) -> Tuple[int, str, str]:
+	try:
+		client: CompileClient = CompileClient(socket_path)
+	except OSError:
+		from main import run as run_locally
+		return run_locally(argv)
+	try:
+		return client.request(argv)
+	finally:
+		client.close()
+
+
+def main() -> None:
+	status, output, errors = run(sys.argv[1:], os.environ.get(SOCKET_ENVIRONMENT))
+	sys.stdout.write(output)
+	sys.stderr.write(errors)
+	exit(status)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,33 @@
+import json
+import os
+import struct
+import tempfile
+from typing import Any
+
+# コンパイルサーバーとのやり取り。メッセージは4バイトのビッグエンディアンの長さに続く UTF-8 の JSON
+#   要求: {"argv": [main.py に渡す引数...]}
+#   応答: {"status": 終了コード, "stdout": 標準出力, "stderr": 標準エラー出力}
+# 1つの接続で続けて何度でも要求を送れる
+HEADER = struct.Struct(">I")
+# これより長いメッセージは壊れているとみなして接続を切る
+MAX_MESSAGE_BYTES: int = 64 * 1024 * 1024
+
+
+def default_socket_path() -> str:
+	return os.path.join(tempfile.gettempdir(), f"python_c_compiler-{os.getuid()}.sock")
+
+
+def encode(message: Any) -> bytes:
+	body: bytes = json.dumps(message).encode()
+	return HEADER.pack(len(body)) + body
+
+
+def decode_length(header: bytes) -> int:
+	length: int = HEADER.unpack(header)[0]
+	if length > MAX_MESSAGE_BYTES:
+		raise ValueError(f"メッセージが長すぎます: {length}バイト")
+	return length
+
+
+def decode(body: bytes) -> Any:
+	return json.loads(body.decode())
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import errno
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from main import run
+from compile_protocol import HEADER, default_socket_path, encode, decode_length, decode
+from typing import Any, Dict, List, Optional
+
+
+def server_running(socket_path: str) -> bool:
+	# socket_path で要求を受け付けているサーバーがあるか
+	probe: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(socket_path)
+	except OSError:
+		return False
+	finally:
+		probe.close()
+	return True
+
+
+class CompileServer:
+	# コンパイラを読み込んだままにしておき、Unixソケットで受けた要求をコンパイルする
+	# workers が0なら、このプロセスで1つずつコンパイルする。プロセス間のやり取りがない分、1回の待ち時間は短い
+	# 1以上なら、その数のワーカープロセスで並列にコンパイルする
+	# 同時に受け付ける要求は max_pending 個までにし、それ以上は前の要求が終わるまで待たせる
+	def __init__(self, socket_path: str, workers: int = 0, max_pending: Optional[int] = None) -> None:
+		self.socket_path: str = socket_path
+		self.workers: int = workers
+		self.max_pending: int = max_pending if max_pending is not None else max(workers, 1) * 4
+		# ワーカーとセマフォは start で作り、close で捨てる
+		# セマフォは作ったときに動いているイベントループに結び付くので、ここでは作らない
+		self.executor: Optional[ProcessPoolExecutor] = None
+		self.pending: Optional[asyncio.Semaphore] = None
+		self.stats: Dict[str, int] = {"connections": 0, "requests": 0, "errors": 0}
+
+	async def compile(self, argv: List[str]) -> Dict[str, Any]:
+		assert self.pending is not None, "start を呼んでいません。"
+		async with self.pending:
+			if self.executor is None:
+				status, output, errors = run(argv)
+			else:
+				status, output, errors = await asyncio.get_running_loop().run_in_executor(self.executor, run, argv)
+		return {"status": status, "stdout": output, "stderr": errors}
+
+	async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		self.stats["connections"] += 1
+		try:
+			while True:
+				try:
+					header: bytes = await reader.readexactly(HEADER.size)
+				except asyncio.IncompleteReadError:
+					# 相手が接続を閉じた
+					break
+				request: Any = decode(await reader.readexactly(decode_length(header)))
+				self.stats["requests"] += 1
+				argv: Any = request.get("argv") if isinstance(request, dict) else None
+				if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+					self.stats["errors"] += 1
+					response: Dict[str, Any] = {"status": 2, "stdout": "", "stderr": "要求の形式が不正です。\n"}
+				else:
+					response = await self.compile(argv)
+				writer.write(encode(response))
+				await writer.drain()
+		except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+			# 壊れたメッセージや途中で切れた接続は、その接続だけ閉じる
+			self.stats["errors"] += 1
+		finally:
+			writer.close()
+
+	async def start(self) -> asyncio.AbstractServer:
+		if os.path.exists(self.socket_path):
+			# 動いているサーバーのソケットは奪わない。つながらなければ前に落ちたサーバーの残りなので消す
+			if server_running(self.socket_path):
+				raise OSError(errno.EADDRINUSE, "既にサーバーが動いています", self.socket_path)
+			os.remove(self.socket_path)
+		listener: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		# 作った瞬間から他のユーザーがつなげないように、所有者だけが読み書きできる権限でソケットを作る
+		umask: int = os.umask(0o177)
+		try:
+			listener.bind(self.socket_path)
+		except OSError:
+			listener.close()
+			raise
+		finally:
+			os.umask(umask)
+		self.pending = asyncio.Semaphore(self.max_pending)
+		if self.workers != 0:
+			self.executor = ProcessPoolExecutor(max_workers=self.workers)
+		server: asyncio.AbstractServer = await asyncio.start_unix_server(self.handle, sock=listener)
+		# ワーカープロセスを先に起動し、最初の要求でコンパイラを読み込む時間を待たせない
+		if self.executor is not None:
+			loop = asyncio.get_running_loop()
+			await asyncio.gather(*[loop.run_in_executor(self.executor, run, ["return 0;"]) for _ in range(self.workers)])
+		return server
+
+	async def close(self, server: asyncio.AbstractServer) -> None:
+		server.close()
+		await server.wait_closed()
+		if self.executor is not None:
+			self.executor.shutdown()
+			self.executor = None
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+
+	async def serve(self) -> None:
+		# SIGINT か SIGTERM を受けるまで要求を受け付ける
+		server: asyncio.AbstractServer = await self.start()
+		stop: asyncio.Event = asyncio.Event()
+		for signal_number in (signal.SIGINT, signal.SIGTERM):
+			asyncio.get_running_loop().add_signal_handler(signal_number, stop.set)
+		try:
+			await stop.wait()
+		finally:
+			await self.close(server)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="コンパイラを常駐させ、Unixソケットでコンパイルの要求を受け付ける")
+	parser.add_argument("--socket", default=default_socket_path(), metavar="PATH", help="待ち受けるソケットのパス")
+	parser.add_argument("-j", "--workers", type=int, default=0, metavar="N",
+						help="並列にコンパイルするワーカープロセスの数 (0ならサーバーのプロセスでコンパイルする)")
+	parser.add_argument("--max-pending", type=int, metavar="N", help="同時に受け付ける要求の数")
+	args = parser.parse_args()
+	try:
+		asyncio.run(CompileServer(args.socket, args.workers, args.max_pending).serve())
+	except OSError as e:
+		print(e, file=sys.stderr)
+		exit(1)
+
+
+if __name__ == '__main__':
+	main()
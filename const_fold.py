@@ -0,0 +1,110 @@
+from node_parser import NodeKind, Node, NumNode, BinaryNode, LocalVarNode, Function, transform, walk
+from typing import Dict, Optional
+
+INT64_MIN: int = -(1 << 63)
+
+
+def wrap_int64(value: int) -> int:
+	# 64bitレジスタと同じく、2の補数で桁あふれさせる
+	return (value + (1 << 63)) % (1 << 64) - (1 << 63)
+
+
+def eval_binary(kind: NodeKind, lhs: int, rhs: int) -> Optional[int]:
+	# 定数同士の演算結果。実行時に例外になる除算は畳み込まない
+	if kind == NodeKind.ADD:
+		return wrap_int64(lhs + rhs)
+	if kind == NodeKind.SUB:
+		return wrap_int64(lhs - rhs)
+	if kind == NodeKind.MUL:
+		return wrap_int64(lhs * rhs)
+	if kind == NodeKind.DIV:
+		if rhs == 0 or (lhs == INT64_MIN and rhs == -1):
+			return None
+		# idivと同じく0方向に切り捨てる
+		quotient: int = abs(lhs) // abs(rhs)
+		return wrap_int64(quotient if (lhs < 0) == (rhs < 0) else -quotient)
+	if kind == NodeKind.EQ:
+		return int(lhs == rhs)
+	if kind == NodeKind.NE:
+		return int(lhs != rhs)
+	if kind == NodeKind.LT:
+		return int(lhs < rhs)
+	if kind == NodeKind.LE:
+		return int(lhs <= rhs)
+	return None
+
+
+def is_num(node: Node, value: int) -> bool:
+	return isinstance(node, NumNode) and node.val == value
+
+
+def is_pure(node: Node) -> bool:
+	# 代入を含まず、取り除いても結果が変わらない式か
+	return all(child.kind != NodeKind.ASSIGN for child in walk(node))
+
+
+def is_same_var(lhs: Node, rhs: Node) -> bool:
+	return isinstance(lhs, LocalVarNode) and isinstance(rhs, LocalVarNode) and lhs.offset == rhs.offset
+
+
+class ConstantFolder:
+	def __init__(self) -> None:
+		self.stats: Dict[str, int] = {"folded": 0, "simplified": 0}
+
+	def simplified(self, node: Node) -> Node:
+		self.stats["simplified"] += 1
+		return node
+
+	def fold(self, node: Node) -> Node:
+		if not isinstance(node, BinaryNode) or node.kind == NodeKind.ASSIGN:
+			return node
+		lhs: Node = node.lhs
+		rhs: Node = node.rhs
+
+		if isinstance(lhs, NumNode) and isinstance(rhs, NumNode):
+			value: Optional[int] = eval_binary(node.kind, lhs.val, rhs.val)
+			if value is not None:
+				self.stats["folded"] += 1
+				return NumNode(value, node.token)
+			return node
+
+		if node.kind == NodeKind.ADD:
+			# x + 0, 0 + x
+			if is_num(rhs, 0):
+				return self.simplified(lhs)
+			if is_num(lhs, 0):
+				return self.simplified(rhs)
+		elif node.kind == NodeKind.SUB:
+			# x - 0, x - x
+			if is_num(rhs, 0):
+				return self.simplified(lhs)
+			if is_same_var(lhs, rhs):
+				return self.simplified(NumNode(0, node.token))
+		elif node.kind == NodeKind.MUL:
+			# x * 1, 1 * x, x * 0, 0 * x
+			if is_num(rhs, 1):
+				return self.simplified(lhs)
+			if is_num(lhs, 1):
+				return self.simplified(rhs)
+			if (is_num(rhs, 0) and is_pure(lhs)) or (is_num(lhs, 0) and is_pure(rhs)):
+				return self.simplified(NumNode(0, node.token))
+		elif node.kind == NodeKind.DIV:
+			# x / 1
+			if is_num(rhs, 1):
+				return self.simplified(lhs)
+		elif node.kind in (NodeKind.EQ, NodeKind.LE):
+			# x == x, x <= x
+			if is_same_var(lhs, rhs):
+				return self.simplified(NumNode(1, node.token))
+		elif node.kind in (NodeKind.NE, NodeKind.LT):
+			# x != x, x < x
+			if is_same_var(lhs, rhs):
+				return self.simplified(NumNode(0, node.token))
+		return node
+
+
+def fold_constants(function: Function) -> Dict[str, int]:
+	# 定数の部分式を畳み込み、恒等式を簡約する。木はその場で書き換える
+	folder: ConstantFolder = ConstantFolder()
+	function.nodes = [transform(node, folder.fold) for node in function.nodes]
+	return folder.stats
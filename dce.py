@@ -0,0 +1,77 @@
+from node_parser import Node, NumNode, ReturnNode, IfNode, WhileNode, ForNode, BlockNode, Function, transform, walk
+from typing import Dict, List, Optional
+
+
+def count_nodes(nodes: List[Node]) -> int:
+	return sum(1 for node in nodes for _ in walk(node))
+
+
+class DeadCodeEliminator:
+	def __init__(self) -> None:
+		self.stats: Dict[str, int] = {"unreachable_statements": 0, "resolved_branches": 0}
+		# 後ろへ処理が進まない文 (return や、break のない無限ループ)。id -> ノード
+		# 取り除いたノードの id は後で作るノードに使い回されうるので、ノード自体も持って同じものか確かめる
+		self.terminators: Dict[int, Node] = {}
+
+	def terminates(self, node: Optional[Node]) -> bool:
+		return node is not None and self.terminators.get(id(node)) is node
+
+	def terminate(self, node: Node) -> None:
+		self.terminators[id(node)] = node
+
+	def statements(self, nodes: List[Node]) -> List[Node]:
+		# 後ろへ進まない文より後ろの文を取り除く
+		for i, node in enumerate(nodes):
+			if self.terminates(node):
+				self.stats["unreachable_statements"] += len(nodes) - i - 1
+				return nodes[:i + 1]
+		return nodes
+
+	def resolved(self, node: Optional[Node]) -> Optional[Node]:
+		self.stats["resolved_branches"] += 1
+		return node
+
+	def eliminate(self, node: Node) -> Optional[Node]:
+		# 子から順に呼ばれる。None を返した文は取り除かれる
+		if isinstance(node, ReturnNode):
+			self.terminate(node)
+		elif isinstance(node, BlockNode):
+			node.nodes = self.statements(node.nodes)
+			if any(self.terminates(child) for child in node.nodes):
+				self.terminate(node)
+		elif isinstance(node, IfNode):
+			if node.if_node is None:
+				node.if_node = BlockNode(node.token, [])
+			if isinstance(node.conditions, NumNode):
+				return self.resolved(node.if_node if node.conditions.val != 0 else node.else_node)
+			if self.terminates(node.if_node) and self.terminates(node.else_node):
+				self.terminate(node)
+		elif isinstance(node, WhileNode):
+			if node.loop_node is None:
+				node.loop_node = BlockNode(node.token, [])
+			if isinstance(node.conditions, NumNode):
+				if node.conditions.val == 0:
+					return self.resolved(None)
+				# 条件のない for にすれば比較と分岐がなくなる
+				node = self.resolved(ForNode(node.token, None, None, None, node.loop_node))
+				self.terminate(node)
+		elif isinstance(node, ForNode):
+			if node.loop_node is None:
+				node.loop_node = BlockNode(node.token, [])
+			if isinstance(node.conditions, NumNode):
+				if node.conditions.val == 0:
+					return self.resolved(node.init)
+				node.conditions = self.resolved(None)
+			if node.conditions is None:
+				self.terminate(node)
+		return node
+
+
+def eliminate_dead_code(function: Function) -> Dict[str, int]:
+	# 到達しない文と、条件が定数の分岐を取り除く。木はその場で書き換える
+	eliminator: DeadCodeEliminator = DeadCodeEliminator()
+	before: int = count_nodes(function.nodes)
+	nodes: List[Optional[Node]] = [transform(node, eliminator.eliminate) for node in function.nodes]
+	function.nodes = eliminator.statements([node for node in nodes if node is not None])
+	eliminator.stats["removed_nodes"] = before - count_nodes(function.nodes)
+	return eliminator.stats
@@ -0,0 +1,85 @@
+import bisect
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from token_parser import Token
+
+
+class LineIndex:
+	# 各行の先頭位置を一度だけ求めておき、位置から行と列を二分探索で引く
+	def __init__(self, source: str) -> None:
+		self.source: str = source
+		self.line_starts: List[int] = [0]
+		i: int = source.find("\n")
+		while i != -1:
+			self.line_starts.append(i + 1)
+			i = source.find("\n", i + 1)
+
+	def position(self, index: int) -> Tuple[int, int]:
+		# (行, 列) をどちらも0始まりで返す
+		line: int = bisect.bisect_right(self.line_starts, index) - 1
+		return line, index - self.line_starts[line]
+
+	def line(self, line: int) -> str:
+		start: int = self.line_starts[line]
+		if line + 1 < len(self.line_starts):
+			return self.source[start:self.line_starts[line + 1] - 1]
+		return self.source[start:]
+
+
+class Diagnostic:
+	def __init__(self, index: int, length: int, message: str) -> None:
+		self.index: int = index
+		self.length: int = length
+		self.message: str = message
+
+	def __repr__(self) -> str:
+		return f"<class Diagnostic {self.index} {self.length} \"{self.message}\">"
+
+
+class Diagnostics:
+	# 字句解析・構文解析・コード生成のエラーを止めずに集めておく
+	def __init__(self, source: str) -> None:
+		self.source: str = source
+		self.errors: List[Diagnostic] = []
+		self._line_index: Optional[LineIndex] = None
+
+	@property
+	def line_index(self) -> LineIndex:
+		# エラーが出るまで行の索引は作らない
+		if self._line_index is None:
+			self._line_index = LineIndex(self.source)
+		return self._line_index
+
+	def error(self, index: int, length: int, message: str) -> None:
+		self.errors.append(Diagnostic(index, length, message))
+
+	def error_token(self, token: "Token", message: str) -> None:
+		self.error(token.index, len(token.string), message)
+
+	def has_errors(self) -> bool:
+		return len(self.errors) != 0
+
+	def format(self, diagnostic: Diagnostic) -> str:
+		line, column = self.line_index.position(diagnostic.index)
+		info: str = f"line {line + 1} | "
+		padding_length: int = len(info) + column
+		return "\n".join([
+			info + self.line_index.line(line),
+			" " * padding_length + "^" + "~" * (diagnostic.length - 1),
+			f"Error: {diagnostic.message}",
+		])
+
+	def report(self) -> str:
+		# フェーズに関係なく、ソース上の位置の順に並べる
+		return "\n".join(map(self.format, sorted(self.errors, key=lambda diagnostic: diagnostic.index)))
+
+	def check(self) -> None:
+		if self.has_errors():
+			raise CompileError(self)
+
+
+class CompileError(Exception):
+	def __init__(self, diagnostics: Diagnostics) -> None:
+		super().__init__(diagnostics.report())
+		self.diagnostics: Diagnostics = diagnostics
@@ -0,0 +1,57 @@
+import argparse
+import subprocess
+import sys
+from main import compile_source, add_option_arguments, options_from_args, cache_from_args
+from diagnostics import CompileError
+from options import CompileOptions
+from compile_cache import CompileCache
+from typing import List, Optional
+
+# アセンブルとリンクに使うコンパイラドライバ
+DEFAULT_CC: str = "gcc"
+
+
+class ToolchainError(Exception):
+	# アセンブラやリンカが失敗した
+	def __init__(self, command: List[str], status: int, output: str) -> None:
+		super().__init__(f"{' '.join(command)} が終了コード {status} で失敗しました。\n{output}")
+		self.command: List[str] = command
+		self.status: int = status
+		self.output: str = output
+
+
+def assemble(asm: str, output: str, cc: str = DEFAULT_CC) -> None:
+	# アセンブリを標準入力からアセンブラに流し込み、実行ファイル output にリンクする
+	# .s ファイルを書かないので、同じディレクトリで並列にビルドしてもぶつからない
+	command: List[str] = [cc, "-x", "assembler", "-", "-o", output, "-Wa,--noexecstack"]
+	proc = subprocess.run(command, input=asm.encode(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	if proc.returncode != 0:
+		raise ToolchainError(command, proc.returncode, proc.stdout.decode(errors="replace"))
+
+
+def compile_to_executable(source: str, output: str, options: Optional[CompileOptions] = None,
+						  cache: Optional[CompileCache] = None, cc: str = DEFAULT_CC) -> None:
+	# ソースをコンパイルして実行ファイル output を作る
+	# コンパイルエラーは CompileError、アセンブルやリンクの失敗は ToolchainError として投げる
+	assemble(compile_source(source, options, cache=cache), output, cc)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="ソースをコンパイルし、アセンブルとリンクまで行う")
+	parser.add_argument("source")
+	parser.add_argument("-o", "--output", default="a.out", metavar="FILE", help="作る実行ファイル")
+	parser.add_argument("--cc", default=DEFAULT_CC, help="アセンブルとリンクに使うコマンド")
+	add_option_arguments(parser)
+	args = parser.parse_args()
+	try:
+		compile_to_executable(args.source, args.output, options_from_args(args), cache_from_args(args), args.cc)
+	except CompileError as e:
+		print(e.diagnostics.report())
+		exit(1)
+	except (ToolchainError, OSError) as e:
+		print(e, file=sys.stderr)
+		exit(1)
+
+
+if __name__ == '__main__':
+	main()
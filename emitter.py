@@ -0,0 +1,27 @@
+from typing import List, Optional, TextIO
+
+
+class Emitter:
+	# 生成した命令を1行ずつ貯めておき、最後にまとめて文字列にする
+	# sinkを渡した場合は貯めずにそのまま書き出す
+	def __init__(self, sink: Optional[TextIO] = None) -> None:
+		self.sink: Optional[TextIO] = sink
+		self.lines: List[str] = []
+
+	def emit(self, line: str) -> None:
+		if self.sink is None:
+			self.lines.append(line)
+		else:
+			self.sink.write(line + "\n")
+
+	def label(self, name: str) -> None:
+		self.emit(f"{name}:")
+
+	def getvalue(self) -> str:
+		if len(self.lines) == 0:
+			return ""
+		return "\n".join(self.lines) + "\n"
+
+	def write_to(self, file: TextIO) -> None:
+		for line in self.lines:
+			file.write(line + "\n")
@@ -0,0 +1,133 @@
+import heapq
+from node_parser import NodeKind, Node, LocalVarNode, Function, children
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# スタックフレームは16バイト境界にそろえる
+FRAME_ALIGNMENT: int = 16
+SLOT_SIZE: int = 8
+
+
+def align(size: int, alignment: int = FRAME_ALIGNMENT) -> int:
+	return (size + alignment - 1) // alignment * alignment
+
+
+class FrameLayout:
+	def __init__(self, offsets: Dict[int, int], size: int, registers: Optional[Dict[int, str]] = None,
+				 saved_registers: Sequence[str] = ()) -> None:
+		# 構文解析で振ったオフセット -> フレーム上のオフセット
+		self.offsets: Dict[int, int] = offsets
+		# フレームの大きさ。退避したレジスタの分も含む
+		self.size: int = size
+		# 構文解析で振ったオフセット -> 変数を置くレジスタ
+		self.registers: Dict[int, str] = registers if registers is not None else {}
+		# 関数の入口で rbp の直下に push し、出口で元に戻すレジスタ
+		self.saved_registers: List[str] = list(saved_registers)
+
+	def offset(self, offset: int) -> int:
+		return self.offsets[offset]
+
+	def __repr__(self) -> str:
+		return f"<class FrameLayout size={self.size} {self.offsets} {self.registers}>"
+
+
+def live_ranges(function: Function) -> Dict[int, Tuple[int, int]]:
+	# ローカル変数ごとに、最初と最後に現れる位置 (前順の番号) を求める
+	# ループ内に現れる変数は次の周回でも使われるので、一番外側のループ全体に広げる
+	ranges: Dict[int, Tuple[int, int]] = {}
+	loop_spans: Dict[int, Tuple[int, int]] = {}
+	var_loops: Dict[int, List[int]] = {}
+	position: int = 0
+	outermost_loop: Optional[int] = None
+	# (ノード, 抜けるときの処理か)
+	stack: List[Tuple[Optional[Node], bool]] = [(node, False) for node in reversed(function.nodes)]
+	while len(stack) != 0:
+		node, leaving = stack.pop()
+		if node is None:
+			continue
+		if leaving:
+			loop_spans[id(node)] = (loop_spans[id(node)][0], position)
+			if outermost_loop == id(node):
+				outermost_loop = None
+			continue
+		position += 1
+		if node.kind in (NodeKind.WHILE, NodeKind.FOR):
+			loop_spans[id(node)] = (position, position)
+			if outermost_loop is None:
+				outermost_loop = id(node)
+			stack.append((node, True))
+		if isinstance(node, LocalVarNode):
+			start, end = ranges.get(node.offset, (position, position))
+			ranges[node.offset] = (min(start, position), max(end, position))
+			if outermost_loop is not None:
+				var_loops.setdefault(node.offset, []).append(outermost_loop)
+		nodes: List[Optional[Node]] = children(node)
+		if node.kind == NodeKind.ASSIGN:
+			# 代入先に書き込むのは右辺を計算した後なので、右辺より後ろの位置とする
+			nodes.reverse()
+		stack.extend((child, False) for child in reversed(nodes))
+
+	for offset, loops in var_loops.items():
+		start, end = ranges[offset]
+		for loop in loops:
+			loop_start, loop_end = loop_spans[loop]
+			start, end = min(start, loop_start), max(end, loop_end)
+		ranges[offset] = (start, end)
+	return ranges
+
+
+def allocate_registers(ranges: Dict[int, Tuple[int, int]], registers: Sequence[str]) -> Dict[int, str]:
+	# 生存区間の線形走査で、ローカル変数をレジスタに割り当てる
+	# 同時に生きている変数がレジスタより多ければ、一番遠くまで生きる変数をスタックに残す
+	assigned: Dict[int, str] = {}
+	free: List[str] = list(reversed(registers))
+	active: List[Tuple[int, int]] = []  # (終了位置, 変数) のヒープ
+	for offset in sorted(ranges, key=lambda offset: ranges[offset]):
+		start, end = ranges[offset]
+		while len(active) != 0 and active[0][0] < start:
+			free.append(assigned[heapq.heappop(active)[1]])
+		if len(free) != 0:
+			assigned[offset] = free.pop()
+			heapq.heappush(active, (end, offset))
+			continue
+		victim_end, victim = max(active) if len(active) != 0 else (-1, -1)
+		if victim_end > end:
+			assigned[offset] = assigned.pop(victim)
+			active.remove((victim_end, victim))
+			heapq.heapify(active)
+			heapq.heappush(active, (end, offset))
+	return assigned
+
+
+def layout_frame(function: Function, share_slots: bool = True, registers: Sequence[str] = ()) -> FrameLayout:
+	# registers を渡すと、ローカル変数をできるだけそのレジスタに置く
+	# アドレスを取る演算子はまだないので、どの変数もレジスタに置ける
+	# スタックに置く変数は、生存区間が重ならないものどうしで同じスロットを使い回す
+	ranges: Dict[int, Tuple[int, int]] = live_ranges(function)
+	assigned: Dict[int, str] = allocate_registers(ranges, registers)
+	saved_registers: List[str] = [register for register in registers if register in assigned.values()]
+	# 退避したレジスタは rbp の直下に置き、スロットはその下から並べる
+	base: int = len(saved_registers) * SLOT_SIZE
+	offsets: Dict[int, int] = {}
+	if not share_slots:
+		for offset in sorted(set(function.lvar_offsets.values()) - set(assigned)):
+			offsets[offset] = base + len(offsets) * SLOT_SIZE + SLOT_SIZE
+		return FrameLayout(offsets, align(base + len(offsets) * SLOT_SIZE), assigned, saved_registers)
+
+	free_slots: List[int] = []
+	active: List[Tuple[int, int]] = []  # (終了位置, スロット) のヒープ
+	slot_count: int = 0
+	for offset in sorted(ranges, key=lambda offset: ranges[offset]):
+		if offset in assigned:
+			continue
+		start, end = ranges[offset]
+		while len(active) != 0 and active[0][0] < start:
+			heapq.heappush(free_slots, heapq.heappop(active)[1])
+		if len(free_slots) != 0:
+			slot: int = heapq.heappop(free_slots)
+		else:
+			slot_count += 1
+			slot = base + slot_count * SLOT_SIZE
+		offsets[offset] = slot
+		heapq.heappush(active, (end, slot))
+	# 最適化で参照がなくなった変数にはスロットを割り当てない
+	return FrameLayout(offsets, align(base + slot_count * SLOT_SIZE), assigned, saved_registers)
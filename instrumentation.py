@@ -0,0 +1,115 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from node_parser import Function, walk
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+
+class PhaseStats:
+	def __init__(self, name: str, depth: int, start: float) -> None:
+		self.name: str = name
+		# 入れ子の深さ。0 はコンパイルの段階、1 以上はその中のパス
+		self.depth: int = depth
+		# 計測を始めてからの経過時間 (秒)
+		self.start: float = start
+		self.wall: float = 0.0
+		self.cpu: float = 0.0
+		# その段階で新しく確保したメモリのピーク (バイト)。メモリを測らないときはNone
+		self.peak_bytes: Optional[int] = None
+
+	def __repr__(self) -> str:
+		return f"<class PhaseStats {self.name} wall={self.wall * 1000:.3f}ms cpu={self.cpu * 1000:.3f}ms>"
+
+
+class CompileStats:
+	# compile_source に渡すと、段階ごとの時間と、トークン・ノード・命令の数を記録する
+	# 渡さなければ何も測らない
+	# memory を真にすると段階ごとのメモリのピークを tracemalloc で測る (コンパイルがかなり遅くなる)
+	def __init__(self, memory: bool = False) -> None:
+		self.memory: bool = memory
+		self.phases: List[PhaseStats] = []
+		self.tokens: int = 0
+		# NodeKind の名前 -> 構文解析した直後の木に含まれる数
+		self.nodes: Dict[str, int] = {}
+		self.instructions: int = 0
+		self.labels: int = 0
+		self.depth: int = 0
+		self.origin: float = time.perf_counter()
+		self.thread_id: int = threading.get_ident()
+
+	@contextlib.contextmanager
+	def phase(self, name: str) -> Iterator[PhaseStats]:
+		stats: PhaseStats = PhaseStats(name, self.depth, time.perf_counter() - self.origin)
+		self.phases.append(stats)
+		# メモリは一番外側の段階だけで測る (tracemalloc のピークは入れ子にできない)
+		tracing: bool = self.memory and self.depth == 0 and not tracemalloc.is_tracing()
+		if tracing:
+			tracemalloc.start()
+		self.depth += 1
+		wall: float = time.perf_counter()
+		cpu: float = time.thread_time()
+		try:
+			yield stats
+		finally:
+			stats.cpu = time.thread_time() - cpu
+			stats.wall = time.perf_counter() - wall
+			self.depth -= 1
+			if tracing:
+				stats.peak_bytes = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+
+	def count_nodes(self, function: Function) -> None:
+		for root in function.nodes:
+			for node in walk(root):
+				self.nodes[node.kind.name] = self.nodes.get(node.kind.name, 0) + 1
+
+	def count_assembly(self, asm: str) -> None:
+		for line in asm.splitlines():
+			if line.startswith("  "):
+				self.instructions += 1
+			elif line.endswith(":"):
+				self.labels += 1
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {
+			"phases": [
+				{"name": phase.name, "depth": phase.depth, "start": phase.start, "wall": phase.wall, "cpu": phase.cpu,
+				 "peak_bytes": phase.peak_bytes}
+				for phase in self.phases
+			],
+			"tokens": self.tokens,
+			"nodes": dict(sorted(self.nodes.items())),
+			"instructions": self.instructions,
+			"labels": self.labels,
+		}
+
+	def chrome_trace(self) -> Dict[str, Any]:
+		# chrome://tracing や Perfetto で読める Trace Event Format。時間はマイクロ秒
+		events: List[Dict[str, Any]] = []
+		for phase in self.phases:
+			args: Dict[str, Any] = {"cpu_ms": phase.cpu * 1000}
+			if phase.peak_bytes is not None:
+				args["peak_bytes"] = phase.peak_bytes
+			events.append({
+				"name": phase.name, "cat": "compile", "ph": "X", "ts": phase.start * 1e6, "dur": phase.wall * 1e6,
+				"pid": os.getpid(), "tid": self.thread_id, "args": args,
+			})
+		counts: Dict[str, int] = {"tokens": self.tokens, "instructions": self.instructions, "labels": self.labels}
+		events.append({"name": "counts", "ph": "C", "ts": 0, "pid": os.getpid(), "tid": self.thread_id, "args": counts})
+		events.append({"name": "nodes", "ph": "C", "ts": 0, "pid": os.getpid(), "tid": self.thread_id,
+					   "args": dict(sorted(self.nodes.items()))})
+		return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+	def write_chrome_trace(self, path: str) -> None:
+		with open(path, "w") as f:
+			json.dump(self.chrome_trace(), f)
+
+
+def phase(instrumentation: Optional[CompileStats], name: str) -> ContextManager[Any]:
+	# 計測しないときは何もしない文脈を返すので、呼び出し側は分岐しなくてよい
+	if instrumentation is None:
+		return contextlib.nullcontext()
+	return instrumentation.phase(name)
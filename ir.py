@@ -0,0 +1,271 @@
+from functools import partial
+from node_parser import NodeKind, Node, NumNode, BinaryNode, LocalVarNode, Function, ReturnNode, IfNode, WhileNode, \
+	ForNode, BlockNode
+from diagnostics import Diagnostics
+from frame_layout import FrameLayout, layout_frame
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# 二項演算のノード -> 中間表現の命令
+binary_ops: Dict[NodeKind, str] = {
+	NodeKind.ADD: "add",
+	NodeKind.SUB: "sub",
+	NodeKind.MUL: "mul",
+	NodeKind.DIV: "div",
+	NodeKind.EQ: "eq",
+	NodeKind.NE: "ne",
+	NodeKind.LT: "lt",
+	NodeKind.LE: "le",
+}
+# ブロックの最後に置く命令
+terminators = {"jmp", "br", "ret"}
+
+
+class IRInstruction:
+	# 三番地コードの命令。仮想レジスタ (vN) は整数で表し、一度だけ代入される
+	#   const: dst = args[0] (即値)
+	#   load:  dst = ローカル変数 args[0]
+	#   store: ローカル変数 args[0] = args[1]
+	#   add, sub, mul, div, eq, ne, lt, le: dst = args[0] op args[1]
+	#   jmp:   args[0] へ飛ぶ
+	#   br:    args[0] が0でなければ args[1] へ、0なら args[2] へ飛ぶ
+	#   ret:   args[0] (省略時は0) を返す
+	# ローカル変数は構文解析で振ったオフセットで表す
+	__slots__ = ("op", "dst", "args")
+
+	def __init__(self, op: str, dst: Optional[int], args: List[Union[int, str]]) -> None:
+		self.op: str = op
+		self.dst: Optional[int] = dst
+		self.args: List[Union[int, str]] = args
+
+	def uses(self) -> List[int]:
+		# 読む仮想レジスタ
+		if self.op in binary_ops.values():
+			return self.args
+		if self.op == "store":
+			return self.args[1:]
+		if self.op in ("br", "ret"):
+			return self.args[:1]
+		return []
+
+	def renamed(self, names: Dict[int, int]) -> "IRInstruction":
+		# 読む仮想レジスタを names に従って付け替えた命令
+		start: int = 1 if self.op == "store" else 0
+		args: List[Union[int, str]] = list(self.args)
+		for i in range(start, start + len(self.uses())):
+			args[i] = names.get(args[i], args[i])
+		return IRInstruction(self.op, self.dst, args)
+
+	def __eq__(self, other: "IRInstruction") -> bool:
+		return (self.op, self.dst, self.args) == (other.op, other.dst, other.args)
+
+	def __repr__(self) -> str:
+		if self.op == "const":
+			operands: List[str] = [str(self.args[0])]
+		elif self.op in ("load", "store"):
+			operands = [f"[{self.args[0]}]"] + [f"v{arg}" for arg in self.args[1:]]
+		elif self.op in ("jmp", "br"):
+			operands = [f"v{arg}" if isinstance(arg, int) else arg for arg in self.args]
+		else:
+			operands = [f"v{arg}" for arg in self.args]
+		text: str = f"{self.op} {', '.join(operands)}".rstrip()
+		return text if self.dst is None else f"v{self.dst} = {text}"
+
+
+class BasicBlock:
+	def __init__(self, label: str) -> None:
+		self.label: str = label
+		self.instructions: List[IRInstruction] = []
+
+	def terminated(self) -> bool:
+		return len(self.instructions) != 0 and self.instructions[-1].op in terminators
+
+	def successors(self) -> List[str]:
+		if not self.terminated():
+			return []
+		last: IRInstruction = self.instructions[-1]
+		if last.op == "jmp":
+			return [last.args[0]]
+		if last.op == "br":
+			return last.args[1:]
+		return []
+
+	def __repr__(self) -> str:
+		return f"{self.label}:\n" + "".join(f"  {instruction}\n" for instruction in self.instructions)
+
+
+class IRFunction:
+	def __init__(self, name: str, frame: FrameLayout) -> None:
+		self.name: str = name
+		# 先頭が入口のブロック。並び順はそのままアセンブリの順になる
+		self.blocks: List[BasicBlock] = []
+		self.frame: FrameLayout = frame
+		self.vreg_count: int = 0
+
+	def __repr__(self) -> str:
+		return f"{self.name}:\n" + "".join(repr(block) for block in self.blocks)
+
+
+class IRBuilder:
+	# 構文木を中間表現に変換する。文は作業スタックで処理するので、深い入れ子でも再帰しない
+	def __init__(self, function: Function, diagnostics: Diagnostics, share_stack_slots: bool = True) -> None:
+		self.diagnostics: Diagnostics = diagnostics
+		self.function: IRFunction = IRFunction(function.name, layout_frame(function, share_stack_slots))
+		self.label_counter: int = 0
+		self.block: BasicBlock = self.new_block()
+		self.function.blocks.append(self.block)
+		self.tasks: List[Callable[[], None]] = []
+
+	def new_block(self) -> BasicBlock:
+		self.label_counter += 1
+		return BasicBlock(f".L.{self.function.name}.{self.label_counter}")
+
+	def new_vreg(self) -> int:
+		self.function.vreg_count += 1
+		return self.function.vreg_count - 1
+
+	def start_block(self, block: BasicBlock) -> None:
+		# 直前のブロックが終わっていなければ、新しいブロックへそのまま進む
+		if not self.block.terminated():
+			self.block.instructions.append(IRInstruction("jmp", None, [block.label]))
+		self.function.blocks.append(block)
+		self.block = block
+
+	def add(self, op: str, args: List[Union[int, str]], has_dst: bool = True) -> Optional[int]:
+		# return の後ろなど、到達しない位置の命令は新しいブロックに置く
+		if self.block.terminated():
+			self.start_block(self.new_block())
+		dst: Optional[int] = self.new_vreg() if has_dst else None
+		self.block.instructions.append(IRInstruction(op, dst, args))
+		return dst
+
+	def jump(self, block: BasicBlock) -> None:
+		if not self.block.terminated():
+			self.add("jmp", [block.label], False)
+
+	def branch(self, conditions: Node, true_block: BasicBlock, false_block: BasicBlock) -> None:
+		value: int = self.lower_expr(conditions)
+		self.add("br", [value, true_block.label, false_block.label], False)
+
+	def schedule(self, *tasks: Callable[[], None]) -> None:
+		# 渡した順に実行されるように積む
+		self.tasks.extend(reversed(tasks))
+
+	def lower_expr(self, root: Node) -> int:
+		# 後順に辿って値を仮想レジスタに求める
+		values: List[int] = []
+		stack: List[Tuple[Node, bool]] = [(root, False)]
+		while len(stack) != 0:
+			node, visited = stack.pop()
+			if isinstance(node, NumNode):
+				values.append(self.add("const", [node.val]))
+			elif isinstance(node, LocalVarNode):
+				values.append(self.add("load", [node.offset]))
+			elif not isinstance(node, BinaryNode):
+				self.diagnostics.error_token(node.token, "未知のノードです。")
+				values.append(self.add("const", [0]))
+			elif not visited:
+				stack.append((node, True))
+				stack.append((node.rhs, False))
+				if node.kind != NodeKind.ASSIGN:
+					stack.append((node.lhs, False))
+			elif node.kind == NodeKind.ASSIGN:
+				if isinstance(node.lhs, LocalVarNode):
+					self.add("store", [node.lhs.offset, values[-1]], False)
+				else:
+					self.diagnostics.error_token(node.lhs.token, "代入先が不正です。")
+			else:
+				rhs: int = values.pop()
+				lhs: int = values.pop()
+				values.append(self.add(binary_ops[node.kind], [lhs, rhs]))
+		return values[-1]
+
+	def lower_statement(self, node: Optional[Node]) -> None:
+		if node is None:
+			return
+		if isinstance(node, (NumNode, LocalVarNode, BinaryNode)):
+			self.lower_expr(node)
+		elif isinstance(node, ReturnNode):
+			self.add("ret", [self.lower_expr(node.value)], False)
+		elif isinstance(node, IfNode):
+			then_block: BasicBlock = self.new_block()
+			end_block: BasicBlock = self.new_block()
+			if node.else_node is None:
+				self.branch(node.conditions, then_block, end_block)
+				self.schedule(
+					partial(self.start_block, then_block), partial(self.lower_statement, node.if_node),
+					partial(self.start_block, end_block),
+				)
+			else:
+				else_block: BasicBlock = self.new_block()
+				self.branch(node.conditions, then_block, else_block)
+				self.schedule(
+					partial(self.start_block, then_block), partial(self.lower_statement, node.if_node),
+					partial(self.jump, end_block),
+					partial(self.start_block, else_block), partial(self.lower_statement, node.else_node),
+					partial(self.start_block, end_block),
+				)
+		elif isinstance(node, WhileNode):
+			# 条件を末尾に置き、1周あたりの分岐を1つにする
+			body_block: BasicBlock = self.new_block()
+			cond_block: BasicBlock = self.new_block()
+			end_block = self.new_block()
+			self.schedule(
+				partial(self.jump, cond_block),
+				partial(self.start_block, body_block), partial(self.lower_statement, node.loop_node),
+				partial(self.start_block, cond_block),
+				partial(self.branch, node.conditions, body_block, end_block),
+				partial(self.start_block, end_block),
+			)
+		elif isinstance(node, ForNode):
+			body_block = self.new_block()
+			cond_block = self.new_block()
+			end_block = self.new_block()
+			tasks: List[Callable[[], None]] = [partial(self.lower_statement, node.init)]
+			if node.conditions is not None:
+				tasks.append(partial(self.jump, cond_block))
+			tasks += [
+				partial(self.start_block, body_block), partial(self.lower_statement, node.loop_node),
+				partial(self.lower_statement, node.inc),
+			]
+			if node.conditions is not None:
+				tasks += [
+					partial(self.start_block, cond_block),
+					partial(self.branch, node.conditions, body_block, end_block),
+				]
+			else:
+				tasks.append(partial(self.jump, body_block))
+			tasks.append(partial(self.start_block, end_block))
+			self.schedule(*tasks)
+		elif isinstance(node, BlockNode):
+			self.schedule(*[partial(self.lower_statement, child) for child in node.nodes])
+		else:
+			self.diagnostics.error_token(node.token, "未知のノードです。")
+
+	def lower(self, nodes: List[Node]) -> IRFunction:
+		self.schedule(*[partial(self.lower_statement, node) for node in nodes])
+		while len(self.tasks) != 0:
+			self.tasks.pop()()
+		# 最後まで return しなければ0を返す
+		if not self.block.terminated():
+			self.add("ret", [self.add("const", [0])], False)
+		return self.function
+
+
+def lower_function(function: Function, diagnostics: Diagnostics, share_stack_slots: bool = True) -> IRFunction:
+	return IRBuilder(function, diagnostics, share_stack_slots).lower(function.nodes)
+
+
+def remove_unreachable_blocks(function: IRFunction) -> Dict[str, int]:
+	# 入口から辿れないブロック (return の後ろの文など) を取り除く
+	blocks: Dict[str, BasicBlock] = {block.label: block for block in function.blocks}
+	reachable = set()
+	stack: List[str] = [function.blocks[0].label]
+	while len(stack) != 0:
+		label: str = stack.pop()
+		if label in reachable:
+			continue
+		reachable.add(label)
+		stack.extend(blocks[label].successors())
+	count: int = len(function.blocks)
+	function.blocks = [block for block in function.blocks if block.label in reachable]
+	return {"removed_blocks": count - len(function.blocks)}
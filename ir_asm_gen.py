@@ -0,0 +1,311 @@
+import heapq
+from ir import IRFunction, BasicBlock, IRInstruction, binary_ops
+from emitter import Emitter
+from options import CompileOptions
+from register_alloc import scratch_registers
+from frame_layout import SLOT_SIZE, align
+from asm_gen import finish_assembly
+from isel import is_imm32, log2_exact, multiply_by_constant, divide_by_constant
+from peephole import is_register
+from typing import Dict, List, Optional, TextIO, Tuple
+
+# 中間表現の比較 -> 条件コード
+conditions: Dict[str, str] = {
+	"eq": "e",
+	"ne": "ne",
+	"lt": "l",
+	"le": "le",
+}
+# 左右を入れ替えて比べたときの条件コード
+swapped_conditions: Dict[str, str] = {
+	"eq": "e",
+	"ne": "ne",
+	"lt": "g",
+	"le": "ge",
+}
+negated_conditions: Dict[str, str] = {"e": "ne", "ne": "e", "l": "ge", "le": "g", "g": "le", "ge": "l"}
+# 2オペランドの算術命令
+arithmetic_instructions: Dict[str, str] = {
+	"add": "add",
+	"sub": "sub",
+	"mul": "imul",
+}
+commutative_ops = {"add", "mul"}
+
+
+def is_memory(location: str) -> bool:
+	return location.startswith("qword ptr")
+
+
+def accepts_constant(user: IRInstruction, position: int, value: int) -> bool:
+	# 命令 user の position 番目のオペランドに定数 value を直接書けるか
+	if user.op == "div" and position == 1:
+		# 0 と -1 で割るときは idiv で例外を起こすのでレジスタに置く
+		return value not in (0, -1)
+	if user.op == "mul" and position == 1 and log2_exact(value) is not None:
+		return True
+	if user.op == "ret":
+		return True
+	return is_imm32(value) and (user.op in binary_ops.values() or user.op == "store")
+
+
+class IRAssemblyGenerator:
+	# 中間表現を x86-64 のアセンブリにする
+	# 仮想レジスタはブロックごとに線形走査で物理レジスタへ割り当て、足りなければスタックに置く
+	# 定数と一度しか使わない load は、使う命令に即値やメモリオペランドとして直接書く
+	# rax と rdx は除算や比較、メモリ同士の転送の作業用に空けておく
+	def __init__(self, emitter: Emitter) -> None:
+		self.emitter: Emitter = emitter
+		self.emit = self.emitter.emit
+		self.locations: Dict[int, str] = {}
+		# オペランドに直接書く仮想レジスタと、そのうち定数のものの値
+		self.inlined: Dict[int, str] = {}
+		self.constants: Dict[int, int] = {}
+		self.frame_offsets: Dict[int, int] = {}
+		self.spill_base: int = 0
+		self.spill_count: int = 0
+		# return で飛ぶ、生成中の関数の終わりのラベル
+		self.end_label: str = ".L.end.main"
+
+	def spill_slot(self) -> str:
+		self.spill_count += 1
+		return f"qword ptr [rbp - {self.spill_base + self.spill_count * SLOT_SIZE}]"
+
+	def select_operands(self, block: BasicBlock) -> None:
+		# 即値やメモリオペランドとして使う仮想レジスタを決める
+		users: Dict[int, List[Tuple[int, IRInstruction, int]]] = {}
+		for i, instruction in enumerate(block.instructions):
+			for position, vreg in enumerate(instruction.uses()):
+				users.setdefault(vreg, []).append((i, instruction, position))
+		for i, instruction in enumerate(block.instructions):
+			uses: List[Tuple[int, IRInstruction, int]] = users.get(instruction.dst, [])
+			if len(uses) == 0:
+				continue
+			if instruction.op == "const":
+				value: int = instruction.args[0]
+				if all(accepts_constant(user, position, value) for _, user, position in uses):
+					self.inlined[instruction.dst] = str(value)
+					self.constants[instruction.dst] = value
+			elif instruction.op == "load" and len(uses) == 1 and uses[0][1].op in binary_ops.values():
+				# 使うまでの間に store があると値が変わりうるので、その場で読む
+				if all(between.op != "store" for between in block.instructions[i + 1:uses[0][0]]):
+					self.inlined[instruction.dst] = f"qword ptr {self.local(instruction.args[0])}"
+
+	def allocate_block(self, block: BasicBlock) -> None:
+		# 仮想レジスタの生存区間 (定義した位置, 最後に使う位置)。区間はブロックの中で閉じている
+		self.select_operands(block)
+		self.locations.update(self.inlined)
+		intervals: Dict[int, Tuple[int, int]] = {}
+		for i, instruction in enumerate(block.instructions):
+			if instruction.dst is not None and instruction.dst not in self.inlined:
+				intervals[instruction.dst] = (i, i)
+			for vreg in instruction.uses():
+				if vreg not in self.inlined:
+					intervals[vreg] = (intervals[vreg][0], i)
+
+		free: List[str] = list(reversed(scratch_registers))
+		active: List[Tuple[int, int]] = []  # (終了位置, 仮想レジスタ) のヒープ
+		for vreg, (start, end) in sorted(intervals.items(), key=lambda item: item[1]):
+			# この命令で使い終わるオペランドのレジスタは結果に使い回してよい
+			while len(active) != 0 and active[0][0] <= start:
+				free.append(self.locations[heapq.heappop(active)[1]])
+			if len(free) != 0:
+				# 左辺のレジスタが空いていれば、結果もそこに置いて転送を省く
+				uses: List[int] = block.instructions[start].uses()
+				preferred: Optional[str] = self.locations.get(uses[0]) if len(uses) != 0 else None
+				self.locations[vreg] = free.pop(free.index(preferred)) if preferred in free else free.pop()
+				heapq.heappush(active, (end, vreg))
+				continue
+			# 一番遠くまで使われる区間をスタックに追い出す
+			victim_end, victim = max(active)
+			if victim_end > end:
+				self.locations[vreg] = self.locations[victim]
+				self.locations[victim] = self.spill_slot()
+				active.remove((victim_end, victim))
+				heapq.heapify(active)
+				heapq.heappush(active, (end, vreg))
+			else:
+				self.locations[vreg] = self.spill_slot()
+
+	def local(self, offset: int) -> str:
+		return f"[rbp - {self.frame_offsets[offset]}]"
+
+	def move(self, dst: str, src: str) -> None:
+		# メモリ同士は直接転送できないので rax を経由する
+		if is_memory(dst) and (is_memory(src) or src.startswith("[")):
+			self.emit(f"  mov rax, {src}")
+			src = "rax"
+		if dst != src:
+			self.emit(f"  mov {dst}, {src}")
+
+	def compare(self, instruction: IRInstruction) -> str:
+		# cmp を出し、条件コードを返す
+		lhs: str = self.locations[instruction.args[0]]
+		rhs: str = self.locations[instruction.args[1]]
+		if instruction.args[0] in self.constants and instruction.args[1] not in self.constants:
+			# 定数を右辺にして比べる
+			self.emit(f"  cmp {rhs}, {lhs}")
+			return swapped_conditions[instruction.op]
+		if not is_register(lhs):
+			self.emit(f"  mov rax, {lhs}")
+			lhs = "rax"
+		self.emit(f"  cmp {lhs}, {rhs}")
+		return conditions[instruction.op]
+
+	def divide_by_constant(self, dst: str, lhs: str, divisor: int) -> None:
+		# 定数での除算を、シフトや逆数の乗算で計算する
+		if not is_register(dst):
+			# 結果をメモリに置くときは、作業用のレジスタを一時的に借りる
+			self.emit("  push rdi")
+			self.divide_by_constant("rdi", lhs, divisor)
+			self.emit("  mov rax, rdi")
+			self.emit("  pop rdi")
+			self.emit(f"  mov {dst}, rax")
+			return
+		self.move(dst, lhs)
+		for line in divide_by_constant(dst, divisor):
+			self.emit(line)
+
+	def multiply_by_constant(self, dst: str, lhs: str, lhs_constant: bool, value: int) -> None:
+		register: str = dst if is_register(dst) else "rax"
+		if log2_exact(value) is None and not lhs_constant:
+			# imul は左辺をレジスタに移さずに掛けられる
+			self.emit(f"  imul {register}, {lhs}, {value}")
+		else:
+			self.move(register, lhs)
+			for line in multiply_by_constant(register, value):
+				self.emit(line)
+		self.move(dst, register)
+
+	def binary(self, instruction: IRInstruction) -> None:
+		dst: str = self.locations[instruction.dst]
+		lhs: str = self.locations[instruction.args[0]]
+		rhs: str = self.locations[instruction.args[1]]
+		op: str = instruction.op
+		constant: Optional[int] = self.constants.get(instruction.args[1])
+		if op == "div" and constant is not None:
+			self.divide_by_constant(dst, lhs, constant)
+		elif op == "div":
+			self.emit(f"  mov rax, {lhs}")
+			self.emit("  cqo")
+			self.emit(f"  idiv {rhs}")
+			self.move(dst, "rax")
+		elif op in conditions:
+			condition: str = self.compare(instruction)
+			self.emit(f"  set{condition} al")
+			if is_memory(dst):
+				self.emit("  movzb rax, al")
+				self.emit(f"  mov {dst}, rax")
+			else:
+				self.emit(f"  movzb {dst}, al")
+		elif op == "mul" and constant is not None:
+			self.multiply_by_constant(dst, lhs, instruction.args[0] in self.constants, constant)
+		elif is_register(dst) and dst != rhs:
+			self.move(dst, lhs)
+			self.emit(f"  {arithmetic_instructions[op]} {dst}, {rhs}")
+		elif is_register(dst) and op in commutative_ops:
+			# 結果のレジスタが右辺と同じなら、左右を入れ替えて計算する
+			self.emit(f"  {arithmetic_instructions[op]} {dst}, {lhs}")
+		else:
+			self.emit(f"  mov rax, {lhs}")
+			self.emit(f"  {arithmetic_instructions[op]} rax, {rhs}")
+			self.move(dst, "rax")
+
+	def branch(self, condition: str, instruction: IRInstruction, next_label: str) -> None:
+		# 直後のブロックへは飛ばずに流れ込む
+		true_label, false_label = instruction.args[1:]
+		if true_label == next_label:
+			self.emit(f"  j{negated_conditions[condition]} {false_label}")
+		else:
+			self.emit(f"  j{condition} {true_label}")
+			if false_label != next_label:
+				self.emit(f"  jmp {false_label}")
+
+	def block(self, block: BasicBlock, next_label: str) -> None:
+		instructions: List[IRInstruction] = block.instructions
+		# 分岐の直前の比較は、結果を 0/1 にせずフラグで直接分岐する
+		fused: bool = len(instructions) >= 2 and instructions[-1].op == "br" \
+			and instructions[-2].op in conditions and instructions[-2].dst == instructions[-1].args[0] \
+			and sum(instruction.uses().count(instructions[-2].dst) for instruction in instructions) == 1
+		self.emitter.label(block.label)
+		for instruction in instructions[:-2] if fused else instructions:
+			self.instruction(instruction, next_label)
+		if fused:
+			self.branch(self.compare(instructions[-2]), instructions[-1], next_label)
+
+	def instruction(self, instruction: IRInstruction, next_label: str) -> None:
+		op: str = instruction.op
+		if instruction.dst in self.inlined:
+			return
+		if op == "const":
+			dst: str = self.locations[instruction.dst]
+			value: int = instruction.args[0]
+			if is_memory(dst) and not is_imm32(value):
+				self.emit(f"  mov rax, {value}")
+				self.emit(f"  mov {dst}, rax")
+			else:
+				self.emit(f"  mov {dst}, {value}")
+		elif op == "load":
+			self.move(self.locations[instruction.dst], self.local(instruction.args[0]))
+		elif op == "store":
+			src: str = self.locations[instruction.args[1]]
+			if is_memory(src):
+				self.emit(f"  mov rax, {src}")
+				src = "rax"
+			self.emit(f"  mov qword ptr {self.local(instruction.args[0])}, {src}")
+		elif op == "jmp":
+			if instruction.args[0] != next_label:
+				self.emit(f"  jmp {instruction.args[0]}")
+		elif op == "br":
+			self.emit(f"  cmp {self.locations[instruction.args[0]]}, 0")
+			self.branch("ne", instruction, next_label)
+		elif op == "ret":
+			if len(instruction.args) != 0:
+				self.move("rax", self.locations[instruction.args[0]])
+			else:
+				self.emit("  mov rax, 0")
+			if next_label != self.end_label:
+				self.emit(f"  jmp {self.end_label}")
+		else:
+			self.binary(instruction)
+
+	def function(self, function: IRFunction) -> None:
+		self.locations = {}
+		self.inlined = {}
+		self.constants = {}
+		self.frame_offsets = function.frame.offsets
+		self.spill_base = function.frame.size
+		self.spill_count = 0
+		self.end_label = f".L.end.{function.name}"
+		for block in function.blocks:
+			self.allocate_block(block)
+
+		self.emit(f".global {function.name}")
+		self.emitter.label(function.name)
+		self.emit("  push rbp")
+		self.emit("  mov rbp, rsp")
+		size: int = align(self.spill_base + self.spill_count * SLOT_SIZE)
+		if size != 0:
+			self.emit(f"  sub rsp, {size}")
+		for i, block in enumerate(function.blocks):
+			next_label: str = function.blocks[i + 1].label if i + 1 < len(function.blocks) else self.end_label
+			self.block(block, next_label)
+		self.emitter.label(self.end_label)
+		self.emit("  mov rsp, rbp")
+		self.emit("  pop rbp")
+		self.emit("  ret")
+
+	def program(self, functions: List[IRFunction]) -> None:
+		self.emit(".intel_syntax noprefix")
+		for function in functions:
+			self.function(function)
+
+
+def ir_asm_gen(functions: List[IRFunction], sink: Optional[TextIO] = None, options: Optional[CompileOptions] = None,
+			   stats: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+	# asm_gen と同じく、sinkを渡すとアセンブリをそのまま書き出し、空文字列を返す
+	if options is None:
+		options = CompileOptions()
+	emitter = Emitter(None if options.peephole else sink)
+	IRAssemblyGenerator(emitter).program(functions)
+	return finish_assembly(emitter, options, sink, stats)
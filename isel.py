@@ -0,0 +1,92 @@
+from const_fold import wrap_int64
+from typing import List, Optional, Tuple
+
+INT32_MIN: int = -(1 << 31)
+INT32_MAX: int = (1 << 31) - 1
+
+
+def is_imm32(value: int) -> bool:
+	# 命令に直接書ける即値 (64bitに符号拡張される32bit)
+	return INT32_MIN <= value <= INT32_MAX
+
+
+def log2_exact(value: int) -> Optional[int]:
+	# 2のべき乗なら指数、そうでなければNone
+	if value > 0 and value & (value - 1) == 0:
+		return value.bit_length() - 1
+	return None
+
+
+def magic_signed(divisor: int) -> Tuple[int, int]:
+	# 符号付き除算を乗算とシフトに置き換えるための (乗数, シフト量) を求める
+	# Hacker's Delight 10-1 の方法。2 <= |divisor| で、2のべき乗でないこと
+	two63: int = 1 << 63
+	ad: int = abs(divisor)
+	t: int = two63 + (1 if divisor < 0 else 0)
+	anc: int = t - 1 - t % ad
+	p: int = 63
+	q1, r1 = divmod(two63, anc)
+	q2, r2 = divmod(two63, ad)
+	while True:
+		p += 1
+		q1, r1 = 2 * q1, 2 * r1
+		if r1 >= anc:
+			q1, r1 = q1 + 1, r1 - anc
+		q2, r2 = 2 * q2, 2 * r2
+		if r2 >= ad:
+			q2, r2 = q2 + 1, r2 - ad
+		delta: int = ad - r2
+		if not (q1 < delta or (q1 == delta and r1 == 0)):
+			break
+	magic: int = wrap_int64(q2 + 1)
+	return (wrap_int64(-magic) if divisor < 0 else magic), p - 64
+
+
+def multiply_by_constant(register: str, value: int) -> Optional[List[str]]:
+	# register *= value。即値で書けなければNone
+	shift: Optional[int] = log2_exact(value)
+	if shift is not None:
+		return [f"  shl {register}, {shift}"] if shift != 0 else []
+	if is_imm32(value):
+		return [f"  imul {register}, {register}, {value}"]
+	return None
+
+
+def divide_by_constant(register: str, divisor: int) -> Optional[List[str]]:
+	# register /= divisor (0方向への切り捨て)。rax と rdx を作業用に使う
+	# 0除算と -1 (INT64_MIN / -1) は idiv と同じく例外にするため、None を返して idiv に任せる
+	if divisor in (0, -1):
+		return None
+	if divisor == 1:
+		return []
+	shift: Optional[int] = log2_exact(abs(divisor))
+	if shift is not None:
+		# 負の数は 2^shift - 1 を足してから算術シフトすると0方向に丸められる
+		lines: List[str] = [f"  mov rax, {register}"]
+		if shift != 1:
+			lines.append("  sar rax, 63")
+		lines += [
+			f"  shr rax, {64 - shift}",
+			f"  add rax, {register}",
+			f"  sar rax, {shift}",
+			f"  mov {register}, rax",
+		]
+		if divisor < 0:
+			lines.append(f"  neg {register}")
+		return lines
+	magic, shift = magic_signed(divisor)
+	lines = [f"  mov rax, {magic}", f"  imul {register}"]
+	if divisor > 0 and magic < 0:
+		lines.append(f"  add rdx, {register}")
+	elif divisor < 0 and magic > 0:
+		lines.append(f"  sub rdx, {register}")
+	if shift != 0:
+		lines.append(f"  sar rdx, {shift}")
+	# 商が負なら1を足して0方向に丸める
+	lines += [
+		"  mov rax, rdx",
+		"  shr rax, 63",
+		"  add rdx, rax",
+		f"  mov {register}, rdx",
+	]
+	return lines
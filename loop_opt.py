@@ -0,0 +1,207 @@
+from node_parser import NodeKind, Node, NumNode, BinaryNode, LocalVarNode, WhileNode, ForNode, BlockNode, Function, \
+	transform, children
+from const_fold import wrap_int64
+from typing import Callable, Container, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+Loop = Union[WhileNode, ForNode]
+
+
+def loop_parts(loop: Loop) -> List[Node]:
+	# 周回ごとに実行される部分。for の初期化式は一度しか実行されないので含めない
+	if isinstance(loop, ForNode):
+		parts: List[Optional[Node]] = [loop.conditions, loop.inc, loop.loop_node]
+	else:
+		parts = [loop.conditions, loop.loop_node]
+	return [part for part in parts if part is not None]
+
+
+def loop_nodes(roots: List[Node], optimized: Container[int]) -> Iterator[Node]:
+	# roots 以下のノードを前順に返す
+	# 最適化し終えた内側のループ (optimized に id があるもの) は、初期化式にだけ入る
+	stack: List[Optional[Node]] = list(reversed(roots))
+	while len(stack) != 0:
+		node: Optional[Node] = stack.pop()
+		if node is None:
+			continue
+		yield node
+		if id(node) not in optimized:
+			stack.extend(reversed(children(node)))
+		elif isinstance(node, ForNode):
+			stack.append(node.init)
+
+
+def replace_expressions(loop: Loop, replace: Callable[[Node], Optional[Node]], optimized: Container[int]) -> None:
+	# ループの各部分を上から辿り、replace が返したノードで部分式を置き換える
+	# 置き換えた式の中と、最適化し終えた内側のループの周回ごとの部分には入らない
+	# 内側のループで値の変わらない式はそのループの前に移動済みなので、外側のループで置き換えるものは残っていない
+	stack: List[Node] = [loop]
+	while len(stack) != 0:
+		node: Node = stack.pop()
+		inner: bool = node is not loop and id(node) in optimized
+		for field in node.fields:
+			if (node is loop and field == "init") or (inner and field != "init"):
+				continue
+			value = getattr(node, field)
+			nodes: List[Optional[Node]] = value if isinstance(value, list) else [value]
+			for i, child in enumerate(nodes):
+				if child is None:
+					continue
+				replacement: Optional[Node] = replace(child)
+				if replacement is None:
+					stack.append(child)
+				elif isinstance(value, list):
+					value[i] = replacement
+				else:
+					setattr(node, field, replacement)
+
+
+def assign(offset: int, value: Node, token) -> BinaryNode:
+	return BinaryNode(NodeKind.ASSIGN, token, LocalVarNode(offset, token), value)
+
+
+class LoopOptimizer:
+	def __init__(self, function: Function) -> None:
+		self.function: Function = function
+		self.stats: Dict[str, int] = {"loops": 0, "hoisted": 0, "strength_reduced": 0}
+		# 最適化し終えたループ (id) -> 周回ごとの部分で代入される変数
+		# 外側のループはこれを使い、内側のループを辿り直さない
+		self.assigned: Dict[int, Set[int]] = {}
+
+	def assigned_vars(self, nodes: List[Node]) -> Set[int]:
+		assigned: Set[int] = set()
+		for node in loop_nodes(nodes, self.assigned):
+			if id(node) in self.assigned:
+				assigned |= self.assigned[id(node)]
+			elif node.kind == NodeKind.ASSIGN and isinstance(node.lhs, LocalVarNode):
+				assigned.add(node.lhs.offset)
+		return assigned
+
+	def invariants(self, loop: Loop, assigned: Set[int]) -> Tuple[Dict[int, bool], Dict[int, tuple]]:
+		# 部分式ごとに、ループ内で値が変わらないかと、同じ式を見分けるためのキーを求める
+		invariant: Dict[int, bool] = {}
+		keys: Dict[int, tuple] = {}
+		nodes: List[Node] = list(loop_nodes(loop_parts(loop), self.assigned))
+		for node in reversed(nodes):
+			if isinstance(node, NumNode):
+				invariant[id(node)] = True
+				keys[id(node)] = (NodeKind.NUM, node.val)
+			elif isinstance(node, LocalVarNode):
+				invariant[id(node)] = node.offset not in assigned
+				keys[id(node)] = (NodeKind.LVAR, node.offset)
+			elif isinstance(node, BinaryNode):
+				keys[id(node)] = (node.kind, keys[id(node.lhs)], keys[id(node.rhs)])
+				# 0除算などで例外になりうる除算は、実行されない位置から移動させない
+				safe: bool = node.kind != NodeKind.DIV or (isinstance(node.rhs, NumNode) and node.rhs.val not in (0, -1))
+				invariant[id(node)] = node.kind != NodeKind.ASSIGN and safe \
+					and invariant[id(node.lhs)] and invariant[id(node.rhs)]
+			else:
+				invariant[id(node)] = False
+		return invariant, keys
+
+	def hoist(self, loop: Loop, preheader: List[Node]) -> Set[int]:
+		# ループ内で値の変わらない式を、ループの前で一時変数に求めておく。ループ内で代入される変数を返す
+		assigned: Set[int] = self.assigned_vars(loop_parts(loop))
+		invariant, keys = self.invariants(loop, assigned)
+		temps: Dict[tuple, int] = {}
+
+		def replace(node: Node) -> Optional[Node]:
+			if not isinstance(node, BinaryNode) or not invariant.get(id(node), False):
+				return None
+			key: tuple = keys[id(node)]
+			if key not in temps:
+				temps[key] = self.function.add_local("licm")
+				preheader.append(assign(temps[key], node, node.token))
+			self.stats["hoisted"] += 1
+			return LocalVarNode(temps[key], node.token)
+
+		replace_expressions(loop, replace, self.assigned)
+		return assigned
+
+	def induction_variable(self, loop: ForNode) -> Optional[Tuple[int, int]]:
+		# i = i + c, i = c + i, i = i - c の形で更新され、他では代入されない変数と、1周あたりの増分
+		inc: Optional[Node] = loop.inc
+		if not isinstance(inc, BinaryNode) or inc.kind != NodeKind.ASSIGN or not isinstance(inc.lhs, LocalVarNode):
+			return None
+		offset: int = inc.lhs.offset
+		value: Node = inc.rhs
+		if not isinstance(value, BinaryNode) or value.kind not in (NodeKind.ADD, NodeKind.SUB):
+			return None
+		if isinstance(value.lhs, LocalVarNode) and value.lhs.offset == offset and isinstance(value.rhs, NumNode):
+			step: int = value.rhs.val if value.kind == NodeKind.ADD else -value.rhs.val
+		elif value.kind == NodeKind.ADD and isinstance(value.rhs, LocalVarNode) and value.rhs.offset == offset \
+				and isinstance(value.lhs, NumNode):
+			step = value.lhs.val
+		else:
+			return None
+		others: List[Node] = [part for part in (loop.conditions, loop.loop_node) if part is not None]
+		if offset in self.assigned_vars(others):
+			return None
+		return offset, step
+
+	def reduce_strength(self, loop: ForNode, preheader: List[Node]) -> None:
+		# i * k (k はループ内で変わらない) を、i の更新に合わせて k * 増分ずつ足していく変数に置き換える
+		induction: Optional[Tuple[int, int]] = self.induction_variable(loop)
+		if induction is None:
+			return
+		offset, step = induction
+		assigned: Set[int] = self.assigned_vars(loop_parts(loop))
+		temps: Dict[tuple, int] = {}
+		updates: List[Node] = []
+
+		def factor(node: Node) -> Optional[Node]:
+			# i * k の k
+			if not isinstance(node, BinaryNode) or node.kind != NodeKind.MUL:
+				return None
+			for index, other in ((node.lhs, node.rhs), (node.rhs, node.lhs)):
+				if isinstance(index, LocalVarNode) and index.offset == offset:
+					if isinstance(other, NumNode):
+						return other
+					if isinstance(other, LocalVarNode) and other.offset not in assigned:
+						return other
+			return None
+
+		def replace(node: Node) -> Optional[Node]:
+			k: Optional[Node] = factor(node)
+			if k is None:
+				return None
+			key: tuple = (NodeKind.NUM, k.val) if isinstance(k, NumNode) else (NodeKind.LVAR, k.offset)
+			if key not in temps:
+				temps[key] = self.function.add_local("iv")
+				token = node.token
+				preheader.append(assign(temps[key], BinaryNode(NodeKind.MUL, token, LocalVarNode(offset, token), k), token))
+				if isinstance(k, NumNode):
+					increment: Node = NumNode(wrap_int64(k.val * step), token)
+				else:
+					increment = BinaryNode(NodeKind.MUL, token, LocalVarNode(k.offset, token), NumNode(step, token))
+				updates.append(assign(temps[key], BinaryNode(
+					NodeKind.ADD, token, LocalVarNode(temps[key], token), increment), token))
+			self.stats["strength_reduced"] += 1
+			return LocalVarNode(temps[key], node.token)
+
+		replace_expressions(loop, replace, self.assigned)
+		if len(updates) != 0:
+			loop.inc = BlockNode(loop.inc.token, [loop.inc] + updates)
+
+	def optimize(self, node: Node) -> Node:
+		# 内側のループから順に呼ばれる。移動した式はループの直前 (for の初期化式の後) に置く
+		if not isinstance(node, (WhileNode, ForNode)):
+			return node
+		self.stats["loops"] += 1
+		preheader: List[Node] = []
+		if isinstance(node, ForNode):
+			self.reduce_strength(node, preheader)
+		# 移動した式を置き換えても、代入される変数は変わらない
+		self.assigned[id(node)] = self.hoist(node, preheader)
+		if len(preheader) == 0:
+			return node
+		if isinstance(node, ForNode) and node.init is not None:
+			preheader.insert(0, node.init)
+			node.init = None
+		return BlockNode(node.token, preheader + [node])
+
+
+def optimize_loops(function: Function) -> Dict[str, int]:
+	# ループ不変式の移動と、誘導変数の乗算の強さの軽減を行う。木はその場で書き換える
+	optimizer: LoopOptimizer = LoopOptimizer(function)
+	function.nodes = [transform(node, optimizer.optimize) for node in function.nodes]
+	return optimizer.stats
@@ -1,18 +1,187 @@
+import argparse
+import contextlib
+import io
 import sys
-from token_parser import tokenize
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from token_parser import Token, iter_tokens, tokenize
 from node_parser import node_parse
 from asm_gen import asm_gen
+from diagnostics import Diagnostics, CompileError
+from options import CompileOptions
+from const_fold import fold_constants
+from dce import eliminate_dead_code
+from loop_opt import optimize_loops
+from value_numbering import number_values, number_ir_values
+from ir import lower_function, remove_unreachable_blocks
+from ir_asm_gen import ir_asm_gen
+from pass_manager import PassManager
+from compile_cache import CompileCache, DEFAULT_MAX_BYTES, cache_key
+from instrumentation import CompileStats, phase
 
 
-def compile_source(source: str) -> str:
-	tokens = tokenize(source)
-	function = node_parse(tokens, source)
-	return asm_gen([function], source)
+def build_tree_passes(options: CompileOptions) -> PassManager:
+	# 構文木にかける最適化。benchmark.py からも使う
+	passes = PassManager()
+	if options.fold_constants:
+		passes.add("fold_constants", fold_constants)
+	if options.eliminate_dead_code:
+		passes.add("eliminate_dead_code", eliminate_dead_code)
+	if options.optimize_loops:
+		passes.add("optimize_loops", optimize_loops)
+	if options.number_values:
+		passes.add("number_values", number_values)
+	return passes
+
+
+def build_ir_passes(options: CompileOptions) -> PassManager:
+	# 中間表現にかける最適化
+	passes = PassManager()
+	passes.add("remove_unreachable_blocks", remove_unreachable_blocks)
+	if options.number_values:
+		passes.add("number_ir_values", number_ir_values)
+	return passes
+
+
+def compile_source(source: str, options: Optional[CompileOptions] = None,
+				   stats: Optional[Dict[str, Dict[str, float]]] = None, cache: Optional[CompileCache] = None,
+				   instrumentation: Optional[CompileStats] = None) -> str:
+	# エラーがあっても最後まで処理して、まとめてCompileErrorとして報告する
+	# statsを渡すと、最適化ごとの統計と、パスごとの実行時間 (秒) を "timings" に記録する
+	# cacheを渡すと、同じソースとオプションを前にコンパイルしていればその結果を返す (統計は記録されない)
+	# instrumentationを渡すと、段階ごとの時間やメモリ、トークン・ノード・命令の数を記録する
+	if options is None:
+		options = CompileOptions()
+	if cache is not None:
+		key: str = cache_key(source, options)
+		with phase(instrumentation, "cache_lookup"):
+			asm: Optional[str] = cache.get(key)
+		if asm is None:
+			asm = compile_source(source, options, stats, instrumentation=instrumentation)
+			cache.put(key, asm)
+		if stats is not None:
+			stats["cache"] = dict(cache.stats)
+		return asm
+	diagnostics = Diagnostics(source)
+	if instrumentation is None:
+		# 計測しないときは、トークン列を作らずに構文解析しながら切り出す
+		function = node_parse(iter_tokens(source, diagnostics), source, diagnostics, options.function_name)
+	else:
+		with instrumentation.phase("tokenize"):
+			tokens: List[Token] = tokenize(source, diagnostics)
+		instrumentation.tokens = len(tokens)
+		with instrumentation.phase("parse"):
+			function = node_parse(tokens, source, diagnostics, options.function_name)
+		instrumentation.count_nodes(function)
+
+	tree_passes: PassManager = build_tree_passes(options)
+	with phase(instrumentation, "optimize"):
+		tree_passes.run(function, instrumentation)
+	ir_passes: PassManager = build_ir_passes(options)
+	if options.use_ir:
+		with phase(instrumentation, "lower"):
+			ir_function = lower_function(function, diagnostics, options.share_stack_slots)
+		with phase(instrumentation, "optimize_ir"):
+			ir_passes.run(ir_function, instrumentation)
+		with phase(instrumentation, "codegen"):
+			asm = ir_asm_gen([ir_function], options=options, stats=stats)
+	else:
+		with phase(instrumentation, "codegen"):
+			asm = asm_gen([function], source, diagnostics, options=options, stats=stats)
+	diagnostics.check()
+	if stats is not None:
+		for passes in (tree_passes, ir_passes):
+			stats.update(passes.stats)
+			stats.setdefault("timings", {}).update(passes.timings)
+	if instrumentation is not None:
+		instrumentation.count_assembly(asm)
+	return asm
+
+
+def add_option_arguments(parser: argparse.ArgumentParser) -> None:
+	# コンパイルのオプションとキャッシュの引数。batch.py と共通
+	parser.add_argument("--stack-machine", action="store_true", help="レジスタ割り当てを使わずに式を生成する")
+	parser.add_argument("--no-fold-constants", action="store_true", help="定数の畳み込みを行わない")
+	parser.add_argument("--no-eliminate-dead-code", action="store_true", help="到達しない文を取り除かない")
+	parser.add_argument("--no-optimize-loops", action="store_true", help="ループの最適化を行わない")
+	parser.add_argument("--no-number-values", action="store_true", help="同じ式の再計算を取り除かない")
+	parser.add_argument("--no-peephole", action="store_true", help="のぞき穴最適化を行わない")
+	parser.add_argument("--disable-peephole-rule", action="append", default=[], metavar="RULE",
+						help="のぞき穴最適化の規則を無効にする")
+	parser.add_argument("--no-promote-locals", action="store_true", help="ローカル変数をレジスタに置かない")
+	parser.add_argument("--no-share-stack-slots", action="store_true", help="ローカル変数のスロットを共有しない")
+	parser.add_argument("--ir", action="store_true", help="三番地コードの中間表現を経由して生成する")
+	parser.add_argument("--cache-dir", metavar="DIR", help="生成したアセンブリをキャッシュするディレクトリ")
+	parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES, metavar="BYTES",
+						help="キャッシュの大きさの上限 (バイト)")
+
+
+def options_from_args(args: argparse.Namespace) -> CompileOptions:
+	return CompileOptions(
+		stack_machine=args.stack_machine,
+		fold_constants=not args.no_fold_constants,
+		peephole=not args.no_peephole,
+		disabled_peephole_rules=args.disable_peephole_rule,
+		share_stack_slots=not args.no_share_stack_slots,
+		use_ir=args.ir,
+		eliminate_dead_code=not args.no_eliminate_dead_code,
+		optimize_loops=not args.no_optimize_loops,
+		promote_locals=not args.no_promote_locals,
+		number_values=not args.no_number_values,
+	)
+
+
+def cache_from_args(args: argparse.Namespace) -> Optional[CompileCache]:
+	return CompileCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+
+
+@lru_cache(maxsize=None)
+def build_parser() -> argparse.ArgumentParser:
+	# 作るのに時間がかかるので、コンパイルサーバーでは要求ごとに作り直さず使い回す
+	parser = argparse.ArgumentParser()
+	parser.add_argument("source")
+	add_option_arguments(parser)
+	parser.add_argument("--stats", action="store_true", help="最適化の統計を標準エラー出力に表示する")
+	parser.add_argument("--trace", metavar="FILE", help="段階ごとの時間を Chrome のトレース形式で書き出す")
+	parser.add_argument("--trace-memory", action="store_true", help="トレースに段階ごとのメモリのピークも記録する")
+	return parser
+
+
+def run(argv: List[str]) -> Tuple[int, str, str]:
+	# コマンドラインから実行したときの処理。(終了コード, 標準出力, 標準エラー出力) を返す
+	# compile_server からも同じ引数で呼ばれる
+	# 引数の誤りや --help では argparse が出力して SystemExit を投げるので、出力を受け取って返す
+	output = io.StringIO()
+	errors = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+			args = build_parser().parse_args(argv)
+	except SystemExit as e:
+		return (e.code if isinstance(e.code, int) else 1), output.getvalue(), errors.getvalue()
+	stats: Dict[str, Dict[str, float]] = {}
+	instrumentation: Optional[CompileStats] = CompileStats(args.trace_memory) if args.trace is not None else None
+	try:
+		asm: str = compile_source(args.source, options_from_args(args), stats, cache_from_args(args), instrumentation)
+	except CompileError as e:
+		return 1, e.diagnostics.report() + "\n", ""
+	if instrumentation is not None:
+		try:
+			instrumentation.write_chrome_trace(args.trace)
+		except OSError as e:
+			return 1, "", f"{e}\n"
+	if args.stats:
+		for name, values in stats.items():
+			if name == "timings":
+				values = {key: f"{value * 1000:.3f}ms" for key, value in values.items()}
+			errors.write(f"{name}: " + " ".join(f"{key}={value}" for key, value in values.items()) + "\n")
+	return 0, asm + "\n", errors.getvalue()
 
 
 def main() -> None:
-	source = sys.argv[1]
-	print(compile_source(source))
+	status, output, errors = run(sys.argv[1:])
+	sys.stdout.write(output)
+	sys.stderr.write(errors)
+	exit(status)
 
 
 if __name__ == '__main__':
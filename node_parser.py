@@ -1,6 +1,7 @@
 import enum
-from token_parser import Token, TokenKind, error_token
-from typing import List, Dict, Optional
+from token_parser import Token, TokenKind, OperatorCode, reserved_operator_codes
+from diagnostics import Diagnostics
+from typing import Callable, List, Dict, Iterable, Iterator, NoReturn, Optional, Tuple
 from collections import deque
 
 
@@ -24,12 +25,17 @@ class NodeKind(enum.Enum):
 
 
 class Node:
+	# 子ノードを持つ属性の名前。木を辿るときに使う
+	fields: Tuple[str, ...] = ()
+
 	def __init__(self, kind: NodeKind, token: Token) -> None:
 		self.kind: NodeKind = kind
 		self.token: Token = token
 
 
 class BinaryNode(Node):
+	fields = ("lhs", "rhs")
+
 	def __init__(self, kind: NodeKind, token: Token, lhs: "Node", rhs: "Node") -> None:
 		super().__init__(kind, token)
 		self.lhs: Node = lhs
@@ -72,6 +78,8 @@ class LocalVarNode(Node):
 
 
 class ReturnNode(Node):
+	fields = ("value",)
+
 	def __init__(self, token: Token, value: Node):
 		super().__init__(NodeKind.RETURN, token)
 		self.value = value
@@ -86,6 +94,8 @@ class ReturnNode(Node):
 
 
 class IfNode(Node):
+	fields = ("conditions", "if_node", "else_node")
+
 	def __init__(self, token: Token, conditions: Node, if_node: Node, else_node: Optional[Node]) -> None:
 		super().__init__(NodeKind.IF, token)
 		self.conditions = conditions
@@ -113,6 +123,8 @@ class IfNode(Node):
 
 
 class WhileNode(Node):
+	fields = ("conditions", "loop_node")
+
 	def __init__(self, token: Token, conditions: Node, loop_node: Node) -> None:
 		super().__init__(NodeKind.WHILE, token)
 		self.conditions: Node = conditions
@@ -135,6 +147,8 @@ class WhileNode(Node):
 
 
 class ForNode(Node):
+	fields = ("init", "conditions", "inc", "loop_node")
+
 	def __init__(self, token: Token, init: Optional[Node], condition: Optional[Node], inc: Optional[Node],
 				 loop_node: Node) -> None:
 		super().__init__(NodeKind.FOR, token)
@@ -163,6 +177,8 @@ class ForNode(Node):
 
 
 class BlockNode(Node):
+	fields = ("nodes",)
+
 	def __init__(self, token: Token, nodes: List[Node]):
 		super().__init__(NodeKind.BLOCK, token)
 		self.nodes: List[Node] = nodes
@@ -180,6 +196,59 @@ class BlockNode(Node):
 		return tree
 
 
+def children(node: Node) -> List[Optional[Node]]:
+	# 子ノードを順番に返す。省略された子 (else節など) はNoneになる
+	nodes: List[Optional[Node]] = []
+	for field in node.fields:
+		child = getattr(node, field)
+		if isinstance(child, list):
+			nodes.extend(child)
+		else:
+			nodes.append(child)
+	return nodes
+
+
+def walk(root: Node) -> Iterator[Node]:
+	# 前順に全ノードを返す。深い木でも再帰しない
+	stack: List[Optional[Node]] = [root]
+	while len(stack) != 0:
+		node: Optional[Node] = stack.pop()
+		if node is None:
+			continue
+		yield node
+		stack.extend(reversed(children(node)))
+
+
+def transform(root: Node, function: Callable[[Node], Optional[Node]]) -> Optional[Node]:
+	# 子から順に function を適用し、戻り値でノードを置き換えた木を返す
+	# ブロック内の文は None が返されると取り除かれる
+	results: List[Optional[Node]] = []
+	stack: List[Tuple[Optional[Node], bool]] = [(root, False)]
+	while len(stack) != 0:
+		node, visited = stack.pop()
+		if node is None:
+			results.append(None)
+			continue
+		if not visited:
+			stack.append((node, True))
+			stack.extend((child, False) for child in reversed(children(node)))
+			continue
+		nodes: List[Optional[Node]] = children(node)
+		if len(nodes) != 0:
+			replaced: List[Optional[Node]] = results[-len(nodes):]
+			del results[-len(nodes):]
+			for field in node.fields:
+				child = getattr(node, field)
+				if isinstance(child, list):
+					setattr(node, field, [new for new in replaced[:len(child)] if new is not None])
+					replaced = replaced[len(child):]
+				else:
+					setattr(node, field, replaced[0])
+					replaced = replaced[1:]
+		results.append(function(node))
+	return results[0]
+
+
 def op_to_kind(op: str) -> NodeKind:
 	if op == "+":
 		return NodeKind.ADD
@@ -197,31 +266,122 @@ def op_to_kind(op: str) -> NodeKind:
 		return NodeKind.LT
 	elif op == ">=":
 		return NodeKind.LE
+	elif op == "<":
+		return NodeKind.LT
+	elif op == "<=":
+		return NodeKind.LE
+	elif op == "=":
+		return NodeKind.ASSIGN
+
+
+class BindingPower:
+	# 二項演算子の結合の強さ。left が今の最低の強さ以上なら、その演算子で左の式と結合する
+	# 右の式は right 以上の強さの演算子だけを取り込む (left と同じなら右結合、1大きければ左結合)
+	def __init__(self, kind: NodeKind, left: int, right: int, swapped: bool = False) -> None:
+		self.kind: NodeKind = kind
+		self.left: int = left
+		self.right: int = right
+		# a > b は b < a として扱う
+		self.swapped: bool = swapped
+
+
+# 優先順位の低い順に並べた演算子と、右結合かどうか
+precedence_levels: List[Tuple[Tuple[str, ...], bool]] = [
+	(("=",), True),
+	(("==", "!="), False),
+	(("<", "<=", ">", ">="), False),
+	(("+", "-"), False),
+	(("*", "/"), False),
+]
+swapped_operators = (">", ">=")
+
+
+def build_binding_powers() -> Dict[int, BindingPower]:
+	# 記号のコード -> 結合の強さ。演算子を増やすときは precedence_levels と op_to_kind に加える
+	powers: Dict[int, BindingPower] = {}
+	for level, (ops, right_associative) in enumerate(precedence_levels):
+		left: int = (level + 1) * 2
+		for op in ops:
+			powers[reserved_operator_codes[op]] = BindingPower(
+				op_to_kind(op), left, left if right_associative else left + 1, op in swapped_operators)
+	return powers
+
+
+binding_powers: Dict[int, BindingPower] = build_binding_powers()
+
+
+# 式を読むときに積む要素の種類
+BINARY = 0
+PAREN = 1
+NEGATE = 2
+
+
+class OpenStatement:
+	# 中の文を読み終えるのを待っている複合文
+	def __init__(self, token: Token, parts: List[Optional[Node]]) -> None:
+		self.token: Token = token
+		# if と while は [条件]、for は [初期化, 条件, 更新] で、読み終えた中の文を後ろに加える
+		# ブロックは読み終えた文
+		self.parts: List[Optional[Node]] = parts
+
+
+class ParseError(Exception):
+	# エラーを記録したあと、文の区切りまで戻るための例外
+	pass
 
 
 class NodeParser:
-	def __init__(self, tokens: List[Token], source: str):
+	def __init__(self, tokens: Iterable[Token], source: str, diagnostics: Optional[Diagnostics] = None):
 		self.source: str = source
-		self.tokens: deque[Token] = deque(tokens)
+		self.diagnostics: Diagnostics = diagnostics if diagnostics is not None else Diagnostics(source)
+		# トークンは必要になった分だけ取り出し、先読み分だけを保持する
+		self.tokens: Iterator[Token] = iter(tokens)
+		self.lookahead: deque[Token] = deque()
+		self.last_token: Optional[Token] = None
 		self.code: List[Node] = []
 		self.lvar_offsets: Dict[str, int] = {}
 		self.max_local_var_offset: int = 0
 
+	def peek(self, offset: int = 0) -> Token:
+		while len(self.lookahead) <= offset:
+			token: Optional[Token] = next(self.tokens, None)
+			if token is None:
+				# EOFより先はEOFを返し続ける
+				token = self.last_token
+			self.last_token = token
+			self.lookahead.append(token)
+		return self.lookahead[offset]
+
 	def next(self) -> None:
-		self.tokens.popleft()
+		self.peek()
+		self.lookahead.popleft()
 
 	def current(self) -> Token:
-		return self.tokens[0]
+		# 先読み済みなら peek を呼ばずに返す (構文解析で一番よく呼ばれる)
+		if len(self.lookahead) != 0:
+			return self.lookahead[0]
+		return self.peek()
 
-	def is_current(self, string: str) -> bool:
-		return self.current().string == string
+	def is_current(self, op: int) -> bool:
+		return self.current().op == op
 
-	def check_syntax(self, string: str, message: str) -> None:
-		if not self.is_current(string):
+	def check_syntax(self, op: int, message: str) -> None:
+		if not self.is_current(op):
 			self.error(message)
 
-	def error(self, message: str) -> None:
-		error_token(self.current(), self.source, message)
+	def error(self, message: str) -> NoReturn:
+		self.diagnostics.error_token(self.current(), message)
+		raise ParseError()
+
+	def synchronize(self) -> None:
+		# 次の文の先頭まで読み飛ばしてエラーから復帰する
+		while True:
+			token: Token = self.current()
+			if token.kind == TokenKind.EOF or token.op == OperatorCode.RBRACE:
+				return
+			self.next()
+			if token.op == OperatorCode.SEMICOLON:
+				return
 
 	# program = stmt*
 	# stmt = expr ";"
@@ -229,231 +389,208 @@ class NodeParser:
 	#        | "if" "(" expr ")" stmt ("else" stmt)?
 	#        | "while" "(" expr ")" stmt
 	#        | "for" "(" expr? ";" expr? ";" expr? ")" stmt
-	# expr = assign
-	# assign = equality ("=" assign)?
-	# equality = relational (("==" | "!=") relational)*
-	# relational = add (("<" | "<=" | ">" | ">=") add)*
-	# add = mul (("+" | "-") mul)*
-	# mul = unary (("*" | "/") unary)*
+	# expr = unary (binop unary)*  (binop の優先順位と結合性は precedence_levels による)
 	# unary = ("+" | "-")? primary
 	# primary = num | ident | ("(" expr ")")
 
 	def program(self) -> List[Node]:
 		while self.current().kind != TokenKind.EOF:
-			self.code.append(self.stmt())
+			try:
+				self.code.append(self.stmt())
+			except ParseError:
+				self.synchronize()
+				if self.is_current(OperatorCode.RBRACE):
+					# 対応する "{" のない "}" は読み捨てる
+					self.next()
 		return self.code
 
 	def stmt(self) -> Node:
-		if self.current().kind == TokenKind.RETURN:
-			token: Token = self.current()
+		# 入れ子の文は再帰で読まずに、中の文を待っている複合文を open_statements に積む
+		# 入れ子の深さはメモリの許す限りいくらでもよい
+		open_statements: List[OpenStatement] = []
+		node: Optional[Node] = None
+		while True:
+			try:
+				if node is None:
+					if len(open_statements) != 0 and open_statements[-1].token.op == OperatorCode.LBRACE:
+						node = self.close_block(open_statements)
+						if node is not None:
+							continue
+					node = self.open_statement(open_statements)
+					continue
+				if len(open_statements) == 0:
+					return node
+				node = self.add_statement(open_statements, node)
+			except ParseError:
+				# 一番内側のブロックで文の区切りまで読み飛ばし、次の文から読み直す
+				# ブロックの中でなければ呼び出し元に任せる
+				while len(open_statements) != 0 and open_statements[-1].token.op != OperatorCode.LBRACE:
+					open_statements.pop()
+				if len(open_statements) == 0:
+					raise
+				self.synchronize()
+				node = None
+
+	def open_statement(self, open_statements: List["OpenStatement"]) -> Optional[Node]:
+		# 文を読み始める。中に文を含む文なら頭の部分だけ読んで積み、Noneを返す
+		token: Token = self.current()
+		if token.kind == TokenKind.RETURN:
 			self.next()
 
 			node: Node = ReturnNode(token, self.expr())
 
-			self.check_syntax(";", ";が行末にありません")
-			self.next()
-
-			return node
-
-		if self.current().kind == TokenKind.IF:
-			token: Token = self.current()
-			self.next()
-
-			self.check_syntax("(", "不正な条件式です。")
+			self.check_syntax(OperatorCode.SEMICOLON, ";が行末にありません")
 			self.next()
 
-			conditions: Node = self.expr()
-
-			self.check_syntax(")", "不正な条件式です。")
-			self.next()
-
-			if_node: Node = self.stmt()
-
-			else_node: Optional[Node] = None
-			if self.current().kind == TokenKind.ELSE:
-				self.next()
-				else_node = self.stmt()
-
-			node: Node = IfNode(token, conditions, if_node, else_node)
 			return node
 
-		if self.current().kind == TokenKind.WHILE:
-			token: Token = self.current()
+		if token.kind == TokenKind.IF or token.kind == TokenKind.WHILE:
 			self.next()
 
-			self.check_syntax("(", "不正な条件式です。")
+			self.check_syntax(OperatorCode.LPAREN, "不正な条件式です。")
 			self.next()
 
 			conditions: Node = self.expr()
 
-			self.check_syntax(")", "不正な条件式です。")
+			self.check_syntax(OperatorCode.RPAREN, "不正な条件式です。")
 			self.next()
 
-			loop_node: Node = self.stmt()
-
-			node: Node = WhileNode(token, conditions, loop_node)
-			return node
+			open_statements.append(OpenStatement(token, [conditions]))
+			return None
 
-		if self.current().kind == TokenKind.FOR:
-			token: Token = self.current()
+		if token.kind == TokenKind.FOR:
 			self.next()
 
-			self.check_syntax("(", "不正な条件式です。")
+			self.check_syntax(OperatorCode.LPAREN, "不正な条件式です。")
 			self.next()
 
 			init: Optional[Node] = None
-			if not self.is_current(";"):
+			if not self.is_current(OperatorCode.SEMICOLON):
 				init = self.expr()
 
-			self.check_syntax(";", "不正な文です。")
+			self.check_syntax(OperatorCode.SEMICOLON, "不正な文です。")
 			self.next()
 
 			conditions: Optional[Node] = None
-			if not self.is_current(";"):
+			if not self.is_current(OperatorCode.SEMICOLON):
 				conditions = self.expr()
 
-			self.check_syntax(";", "不正な文です。")
+			self.check_syntax(OperatorCode.SEMICOLON, "不正な文です。")
 			self.next()
 
 			inc: Optional[Node] = None
-			if not self.is_current(")"):
+			if not self.is_current(OperatorCode.RPAREN):
 				inc = self.expr()
 
-			self.check_syntax(")", "不正な条件式です。")
+			self.check_syntax(OperatorCode.RPAREN, "不正な条件式です。")
 			self.next()
 
-			loop_node: Node = self.stmt()
-
-			node: Node = ForNode(token, init, conditions, inc, loop_node)
-			return node
+			open_statements.append(OpenStatement(token, [init, conditions, inc]))
+			return None
 
-		if self.is_current("{"):
-			token: Token = self.current()
-			self.next()
-			nodes: List[Node] = []
-			while not self.is_current("}"):
-				nodes.append(self.stmt())
+		if token.op == OperatorCode.LBRACE:
 			self.next()
-			node: Node = BlockNode(token, nodes)
-			return node
+			open_statements.append(OpenStatement(token, []))
+			return None
 
 		node: Node = self.expr()
 
-		self.check_syntax(";", ";が行末にありません")
+		self.check_syntax(OperatorCode.SEMICOLON, ";が行末にありません")
 		self.next()
 
 		return node
 
-	def expr(self) -> Node:
-		return self.assign()
-
-	def assign(self) -> Node:
-		node: Node = self.equality()
-		if self.is_current("="):
-			token: Token = self.current()
-			self.next()
-			kind: NodeKind = NodeKind.ASSIGN
-			node = BinaryNode(kind, token, node, self.assign())
-		return node
-
-	def equality(self) -> Node:
-		node: Node = self.relational()
-		for _ in range(len(self.tokens)):
-			if self.current().string in ["==", "!="]:
-				token: Token = self.current()
+	def add_statement(self, open_statements: List["OpenStatement"], node: Node) -> Optional[Node]:
+		# 読み終えた文を一番内側の複合文に加える。複合文も読み終えたらそれを返す
+		statement: OpenStatement = open_statements[-1]
+		token: Token = statement.token
+		if token.op == OperatorCode.LBRACE:
+			statement.parts.append(node)
+			return None
+		if token.kind == TokenKind.IF and len(statement.parts) == 1:
+			statement.parts.append(node)
+			if self.current().kind == TokenKind.ELSE:
 				self.next()
-				op: str = token.string
-				kind: NodeKind = op_to_kind(op)
-				node = BinaryNode(kind, token, node, self.relational())
-			else:
-				return node
-		return node
+				return None
+			node = None
+		open_statements.pop()
+		if token.kind == TokenKind.IF:
+			return IfNode(token, statement.parts[0], statement.parts[1], node)
+		if token.kind == TokenKind.WHILE:
+			return WhileNode(token, statement.parts[0], node)
+		return ForNode(token, statement.parts[0], statement.parts[1], statement.parts[2], node)
+
+	def close_block(self, open_statements: List["OpenStatement"]) -> Optional[Node]:
+		# ブロックが "}" で終わっていれば BlockNode を返す。続きがあればNone
+		if self.is_current(OperatorCode.RBRACE):
+			self.next()
+			statement: OpenStatement = open_statements.pop()
+			return BlockNode(statement.token, statement.parts)
+		if self.current().kind == TokenKind.EOF:
+			# 閉じられていないブロック自身ではなく、その外側でエラーから復帰する
+			open_statements.pop()
+			self.error("ブロックが閉じられていません。")
+		return None
 
-	def relational(self) -> Node:
-		node: Node = self.add()
-		for _ in range(len(self.tokens)):
-			if self.current().string in [">", ">="]:
-				token: Token = self.current()
-				self.next()
-				op = token.string
-				kind: NodeKind = op_to_kind(op)
-				node = BinaryNode(kind, token, self.add(), node)
-			elif self.current().string in ["<", "<="]:
-				token: Token = self.current()
+	def expr(self) -> Node:
+		# 演算子順位法 (Pratt) を再帰せずに行う
+		# stack には読みかけの二項演算 (演算子と左の式)、開き括弧、単項マイナスを積む
+		stack: List[Tuple[int, Token, Optional[BindingPower], Optional[Node]]] = []
+		while True:
+			token: Token = self.current()
+			if token.op == OperatorCode.SUB:
 				self.next()
-				op: str = token.string.replace("<", ">")
-				kind: NodeKind = op_to_kind(op)
-				node = BinaryNode(kind, token, node, self.add())
-			else:
-				return node
-		return node
-
-	def add(self) -> Node:
-		node: Node = self.mul()
-		for _ in range(len(self.tokens)):
-			if self.current().string in ["+", "-"]:
-				token: Token = self.current()
+				stack.append((NEGATE, token, None, None))
+				token = self.current()
+			elif token.op == OperatorCode.ADD:
 				self.next()
-				op: str = token.string
-				kind: NodeKind = op_to_kind(op)
-				node = BinaryNode(kind, token, node, self.mul())
-			else:
-				return node
-		return node
-
-	def mul(self) -> Node:
-		node: Node = self.unary()
-		for _ in range(len(self.tokens)):
-			if self.current().string in ["*", "/"]:
-				token: Token = self.current()
+				token = self.current()
+			if token.op == OperatorCode.LPAREN:
 				self.next()
-				op: str = token.string
-				kind: NodeKind = op_to_kind(op)
-				node = BinaryNode(kind, token, node, self.unary())
-			else:
-				return node
-		return node
-
-	def unary(self) -> Node:
-		if self.is_current("-"):
-			token: Token = self.current()
-			self.next()
-			kind = NodeKind.SUB
-			node = BinaryNode(kind, token, NumNode(0, token), self.primary())
-			return node
-		if self.is_current("+"):
+				stack.append((PAREN, token, None, None))
+				continue
+			node: Node = self.primary(token)
+			while True:
+				if len(stack) != 0 and stack[-1][0] == NEGATE:
+					negate: Token = stack.pop()[1]
+					node = BinaryNode(NodeKind.SUB, negate, NumNode(0, negate), node)
+				token = self.current()
+				power: Optional[BindingPower] = binding_powers.get(token.op)
+				top: Optional[Tuple[int, Token, Optional[BindingPower], Optional[Node]]] = \
+					stack[-1] if len(stack) != 0 else None
+				# 読みかけの二項演算の右辺では、その演算子の right 以上の強さの演算子だけを取り込む
+				min_power: int = top[2].right if top is not None and top[0] == BINARY else 0
+				if power is not None and power.left >= min_power:
+					self.next()
+					stack.append((BINARY, token, power, node))
+					break
+				if top is None:
+					return node
+				stack.pop()
+				if top[0] == BINARY:
+					if top[2].swapped:
+						node = BinaryNode(top[2].kind, top[1], node, top[3])
+					else:
+						node = BinaryNode(top[2].kind, top[1], top[3], node)
+				else:
+					self.check_syntax(OperatorCode.RPAREN, "括弧が閉じられていません。")
+					self.next()
+
+	def primary(self, token: Token) -> Node:
+		# 括弧の中の式は expr が読むので、ここでは数と変数だけを扱う
+		if token.kind == TokenKind.NUM:
 			self.next()
-		node: Node = self.primary()
-		return node
-
-	def primary(self) -> Node:
-		if self.is_current("("):
-			self.next()
-			node: Node = self.expr()
-			self.check_syntax(")", "括弧が閉じられていません。")
-			self.next()
-			return node
-		if self.current().kind == TokenKind.NUM:
-			token: Token = self.current()
-			self.next()
-			num: int = int(token.string)
-			node = NumNode(num, token)
-			return node
-		if self.current().kind == TokenKind.IDENT:
-			token: Token = self.current()
+			return NumNode(int(token.string), token)
+		if token.kind == TokenKind.IDENT:
 			self.next()
 			name: str = token.string
-			if name in self.lvar_offsets:
-				offset: int = self.lvar_offsets[name]
-			else:
+			offset: Optional[int] = self.lvar_offsets.get(name)
+			if offset is None:
 				self.max_local_var_offset += 8
-				offset: int = self.max_local_var_offset
+				offset = self.max_local_var_offset
 				self.lvar_offsets[name] = offset
-			node = LocalVarNode(offset, token)
-			return node
+			return LocalVarNode(offset, token)
 		self.error("不正な文です。")
-		# 前の関数で例外が投げられるはずだが、IDEが反応してくれないのでここでも投げる
-		raise Exception()
 
 
 class Function:
@@ -462,9 +599,19 @@ class Function:
 		self.nodes: List[Node] = nodes
 		self.lvar_offsets: Dict[str, int] = local_vars
 
+	def add_local(self, prefix: str) -> int:
+		# 最適化で使う一時変数を追加する。名前は識別子と重ならないように "." で始める
+		offset: int = max(self.lvar_offsets.values(), default=0) + 8
+		self.lvar_offsets[f".{prefix}{len(self.lvar_offsets)}"] = offset
+		return offset
+
 
-def node_parse(tokens: List[Token], source: str) -> Function:
-	parser: NodeParser = NodeParser(tokens, source)
+def node_parse(tokens: Iterable[Token], source: str, diagnostics: Optional[Diagnostics] = None,
+			   name: str = "main") -> Function:
+	# diagnosticsが渡されなければ、構文エラーがあった時点でCompileErrorを投げる
+	parser: NodeParser = NodeParser(tokens, source, diagnostics)
 	nodes: List[Node] = parser.program()
-	function = Function("main", nodes, parser.lvar_offsets)
+	if diagnostics is None:
+		parser.diagnostics.check()
+	function = Function(name, nodes, parser.lvar_offsets)
 	return function
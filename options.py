@@ -0,0 +1,35 @@
+from typing import FrozenSet, Iterable
+
+
+class CompileOptions:
+	def __init__(self, stack_machine: bool = False, fold_constants: bool = True, peephole: bool = True,
+				 disabled_peephole_rules: Iterable[str] = (), share_stack_slots: bool = True,
+				 use_ir: bool = False, eliminate_dead_code: bool = True, optimize_loops: bool = True,
+				 promote_locals: bool = True, number_values: bool = True,
+				 function_name: str = "main") -> None:
+		# 式をレジスタ割り当てを使わずに、従来のスタックマシンで生成する
+		self.stack_machine: bool = stack_machine
+		# 定数の畳み込みと恒等式の簡約を行う
+		self.fold_constants: bool = fold_constants
+		# 生成した命令列にのぞき穴最適化をかける
+		self.peephole: bool = peephole
+		# のぞき穴最適化で使わない規則の名前
+		self.disabled_peephole_rules: FrozenSet[str] = frozenset(disabled_peephole_rules)
+		# 生存区間が重ならないローカル変数どうしでスタック上のスロットを共有する
+		self.share_stack_slots: bool = share_stack_slots
+		# 三番地コードの中間表現を経由して生成する (stack_machine より優先する)
+		self.use_ir: bool = use_ir
+		# 到達しない文と、条件が定数の分岐を取り除く
+		self.eliminate_dead_code: bool = eliminate_dead_code
+		# ループ不変式をループの前に移し、誘導変数の乗算を加算に置き換える
+		self.optimize_loops: bool = optimize_loops
+		# ローカル変数を呼び出し先保存のレジスタに置く (レジスタ割り当てを使うときのみ)
+		self.promote_locals: bool = promote_locals
+		# 基本ブロックの中で同じ式の再計算を取り除く (局所的な値番号付け)
+		self.number_values: bool = number_values
+		# 生成する関数の名前。名前を変えると、複数のプログラムを1つの実行ファイルにまとめられる
+		self.function_name: str = function_name
+
+	def __repr__(self) -> str:
+		fields: str = ", ".join(f"{name}={value!r}" for name, value in sorted(self.__dict__.items()))
+		return f"CompileOptions({fields})"
@@ -0,0 +1,28 @@
+import time
+from instrumentation import CompileStats, phase
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# パスは最適化の対象をその場で書き換え、統計 (名前 -> 数) を返す
+Pass = Callable[[Any], Optional[Dict[str, int]]]
+
+
+class PassManager:
+	# 登録した順にパスを実行し、パスごとの実行時間と統計を記録する
+	def __init__(self) -> None:
+		self.passes: List[Tuple[str, Pass]] = []
+		self.timings: Dict[str, float] = {}
+		self.stats: Dict[str, Dict[str, int]] = {}
+
+	def add(self, name: str, function: Pass) -> None:
+		self.passes.append((name, function))
+
+	def run(self, unit: Any, instrumentation: Optional[CompileStats] = None) -> None:
+		for name, function in self.passes:
+			start: float = time.perf_counter()
+			with phase(instrumentation, name):
+				stats: Optional[Dict[str, int]] = function(unit)
+			self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+			if stats is not None:
+				merged: Dict[str, int] = self.stats.setdefault(name, {})
+				for key, value in stats.items():
+					merged[key] = merged.get(key, 0) + value
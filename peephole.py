@@ -0,0 +1,256 @@
+import re
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# レジスタの部分名を64bitの名前にそろえる
+register_aliases: Dict[str, str] = {}
+for _base, _names in {
+	"rax": ["eax", "ax", "al", "ah"],
+	"rbx": ["ebx", "bx", "bl", "bh"],
+	"rcx": ["ecx", "cx", "cl", "ch"],
+	"rdx": ["edx", "dx", "dl", "dh"],
+	"rsi": ["esi", "si", "sil"],
+	"rdi": ["edi", "di", "dil"],
+	"rbp": ["ebp", "bp", "bpl"],
+	"rsp": ["esp", "sp", "spl"],
+}.items():
+	register_aliases[_base] = _base
+	for _name in _names:
+		register_aliases[_name] = _base
+for _i in range(8, 16):
+	for _suffix in ["", "d", "w", "b"]:
+		register_aliases[f"r{_i}{_suffix}"] = f"r{_i}"
+
+# 2つのオペランドを読み、1つ目に書き込む命令
+read_modify_write = {"add", "sub", "imul", "and", "or", "xor", "shl", "shr", "sar"}
+# (読むレジスタ, 書き換えるレジスタ)。None はラベルやジャンプなど、全てのレジスタを使うとみなすもの
+Effects = Optional[Tuple[Set[str], Set[str]]]
+
+
+Instruction = Tuple[str, List[str]]
+
+
+def parse(line: str) -> Instruction:
+	# "  mov rax, rdi" -> ("mov", ["rax", "rdi"])
+	parts: List[str] = line.strip().split(" ", 1)
+	operands: List[str] = parts[1].split(", ") if len(parts) == 2 else []
+	return parts[0], operands
+
+
+@lru_cache(maxsize=None)
+def registers(operand: str) -> FrozenSet[str]:
+	return frozenset(register_aliases[word] for word in re.findall(r"[a-z0-9]+", operand) if word in register_aliases)
+
+
+def is_register(operand: str) -> bool:
+	return operand in register_aliases and register_aliases[operand] == operand
+
+
+def effects(instruction: Instruction) -> Effects:
+	# (読むレジスタ, 値を完全に書き換えるレジスタ)。ラベルや分からない命令は None
+	op, operands = instruction
+	if op in ("mov", "movzb", "lea") and len(operands) == 2:
+		dst, src = operands
+		if is_register(dst):
+			return registers(src), {dst}
+		return registers(dst) | registers(src), set()
+	if op in read_modify_write and len(operands) == 2:
+		dst, src = operands
+		return registers(dst) | registers(src), {dst} if is_register(dst) else set()
+	if op == "imul" and len(operands) == 3:
+		return registers(operands[1]), {operands[0]} if is_register(operands[0]) else set()
+	if op == "cmp":
+		return registers(operands[0]) | registers(operands[1]), set()
+	if op == "cqo":
+		return {"rax"}, {"rdx"}
+	if op == "idiv":
+		return {"rax", "rdx"} | registers(operands[0]), {"rax", "rdx"}
+	if op.startswith("set") and len(operands) == 1:
+		# 下位8bitだけを書き換えるので、読むとみなす
+		return registers(operands[0]), set()
+	if op == "push":
+		return registers(operands[0]) | {"rsp"}, set()
+	if op == "pop" and is_register(operands[0]):
+		return {"rsp"}, {operands[0]}
+	return None
+
+
+def is_dead(code: List[Instruction], start: int, register: str, window: int) -> bool:
+	# start以降で、読まれる前に上書きされるか
+	for instruction in code[start:start + window]:
+		effect: Effects = effects(instruction)
+		if effect is None:
+			return False
+		reads, writes = effect
+		if register in reads:
+			return False
+		if register in writes:
+			return True
+	return False
+
+
+# 規則は (命令列, 位置) を受け取り、(置き換える命令数, 置き換え後の行) を返す
+Match = Optional[Tuple[int, List[str]]]
+
+
+def push_pop(code: List[Instruction], i: int) -> Match:
+	# push X; pop X -> (なし)
+	if i + 1 < len(code) and code[i + 1][0] == "pop" and code[i + 1][1] == code[i][1]:
+		return 2, []
+	return None
+
+
+def push_pop_move(code: List[Instruction], i: int) -> Match:
+	# push X; pop Y -> mov Y, X
+	if i + 1 < len(code) and code[i + 1][0] == "pop" and is_register(code[i + 1][1][0]):
+		return 2, [f"  mov {code[i + 1][1][0]}, {code[i][1][0]}"]
+	return None
+
+
+def lea_load(code: List[Instruction], i: int) -> Match:
+	# lea R, [M]; mov R, [R] -> mov R, [M]
+	if i + 1 < len(code):
+		register, address = code[i][1]
+		if code[i + 1] == ("mov", [register, f"[{register}]"]):
+			return 2, [f"  mov {register}, {address}"]
+	return None
+
+
+def self_move(code: List[Instruction], i: int) -> Match:
+	# mov X, X -> (なし)
+	operands: List[str] = code[i][1]
+	if len(operands) == 2 and operands[0] == operands[1] and is_register(operands[0]):
+		return 1, []
+	return None
+
+
+def store_load(code: List[Instruction], i: int) -> Match:
+	# mov [M], R; mov R, [M] -> mov [M], R
+	if i + 1 < len(code):
+		operands: List[str] = code[i][1]
+		if code[i + 1][0] == "mov" and operands[0].startswith("[") and code[i + 1][1] == operands[::-1] \
+				and is_register(operands[1]):
+			return 2, [f"  mov {operands[0]}, {operands[1]}"]
+	return None
+
+
+def forward_move(code: List[Instruction], i: int) -> Match:
+	# mov R, X; mov S, R -> mov S, X (Rがその直後に上書きされるとき)
+	if i + 2 < len(code) and code[i + 1][0] == "mov":
+		register, value = code[i][1]
+		destination, source = code[i + 1][1]
+		if is_register(register) and source == register and is_register(destination) \
+				and destination not in registers(value) and is_dead(code, i + 2, register, 1):
+			return 2, [f"  mov {destination}, {value}"]
+	return None
+
+
+def dead_move(code: List[Instruction], i: int) -> Match:
+	# mov R, X -> (なし) (Rが読まれる前に上書きされるとき)
+	register: str = code[i][1][0]
+	if is_register(register) and register not in ("rsp", "rbp") and is_dead(code, i + 1, register, 8):
+		return 1, []
+	return None
+
+
+def jump_to_next(code: List[Instruction], i: int) -> Match:
+	# jmp L; L: -> L:
+	if i + 1 < len(code) and code[i + 1][0] == f"{code[i][1][0]}:":
+		return 1, []
+	return None
+
+
+# 規則の名前: (先頭の命令, 規則)
+peephole_rules: Dict[str, Tuple[str, Callable[[List[Instruction], int], Match]]] = {
+	"push_pop": ("push", push_pop),
+	"push_pop_move": ("push", push_pop_move),
+	"lea_load": ("lea", lea_load),
+	"self_move": ("mov", self_move),
+	"store_load": ("mov", store_load),
+	"forward_move": ("mov", forward_move),
+	"dead_move": ("mov", dead_move),
+	"jump_to_next": ("jmp", jump_to_next),
+}
+
+
+def unused_label(lines: List[str]) -> Tuple[List[str], int]:
+	# どこからも飛んでこないローカルラベルを取り除く。前後の命令がつながり、他の規則が効くようになる
+	referenced: Set[str] = set()
+	for line in lines:
+		if not line.endswith(":"):
+			referenced.update(parse(line)[1])
+	result: List[str] = [line for line in lines if not (line.startswith(".L") and line.endswith(":")
+														 and line[:-1] not in referenced)]
+	return result, len(lines) - len(result)
+
+
+# 命令列全体を見て書き換える規則
+whole_rules: Dict[str, Callable[[List[str]], Tuple[List[str], int]]] = {
+	"unused_label": unused_label,
+}
+
+
+# 規則が見る命令の数 (dead_move は先の8命令まで見る)
+# 書き換えると、その位置より最大 rule_window - 1 命令前から始まる規則の結果が変わりうる
+rule_window: int = 9
+
+
+class ParsedLines(dict):
+	# 行 -> 分解した命令。同じ行は何度も現れるので、分解した結果を使い回す
+	def __missing__(self, line: str) -> Instruction:
+		instruction: Instruction = parse(line)
+		self[line] = instruction
+		return instruction
+
+
+def apply_rules(lines: List[str], rules: Dict[str, List[Tuple[str, Callable[[List[Instruction], int], Match]]]],
+				stats: Dict[str, int]) -> List[str]:
+	# 規則を前から当てはめ、どの規則も当てはまらなくなった命令列を返す
+	# 書き換えたら、その結果で当てはまるようになりうる少し前の命令まで戻って見直す
+	# どの規則も命令を1つ以上減らすので、書き換えが連鎖しても全体をなめ直さずに済む
+	# todo は未処理の行を逆順に積んだもの (末尾が次の行)、done は処理済みの行
+	todo: List[str] = lines[::-1]
+	done: List[str] = []
+	parsed: ParsedLines = ParsedLines()
+	while len(todo) != 0:
+		candidates = rules.get(parsed[todo[-1]][0])
+		if candidates is not None:
+			window: List[Instruction] = [parsed[line] for line in todo[:-rule_window - 1:-1]]
+			for name, rule in candidates:
+				match: Match = rule(window, 0)
+				if match is not None:
+					count, replacement = match
+					del todo[-count:]
+					todo.extend(reversed(replacement))
+					stats[name] += count - len(replacement)
+					back: int = min(len(done), rule_window - 1)
+					if back != 0:
+						todo.extend(reversed(done[-back:]))
+						del done[-back:]
+					break
+			else:
+				done.append(todo.pop())
+			continue
+		done.append(todo.pop())
+	return done
+
+
+def optimize(lines: List[str], disabled: FrozenSet[str] = frozenset()) -> Tuple[List[str], Dict[str, int]]:
+	# 命令の規則を当てはめてから命令列全体の規則をかけ、変化しなくなるまで繰り返す
+	# 規則ごとに取り除いた命令の数を返す
+	rules: Dict[str, List[Tuple[str, Callable[[List[Instruction], int], Match]]]] = {}
+	stats: Dict[str, int] = {}
+	for name, (op, rule) in peephole_rules.items():
+		if name not in disabled:
+			rules.setdefault(op, []).append((name, rule))
+			stats[name] = 0
+	changed: bool = True
+	while changed:
+		lines = apply_rules(lines, rules, stats)
+		changed = False
+		for name, rule in whole_rules.items():
+			if name not in disabled:
+				lines, count = rule(lines)
+				stats[name] = stats.get(name, 0) + count
+				changed = changed or count != 0
+	return lines, stats
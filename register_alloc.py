@@ -0,0 +1,37 @@
+from node_parser import NodeKind, Node, BinaryNode
+from typing import Dict, List, Tuple
+
+# 式の計算に使うレジスタ (呼び出し元保存のもの)
+# rax と rdx は除算や比較の作業用に空けておく
+scratch_registers: List[str] = ["rdi", "rsi", "rcx", "r8", "r9", "r10", "r11"]
+# ローカル変数を置くレジスタ (呼び出し先保存のもの)。関数の入口で退避し、出口で元に戻す
+variable_registers: List[str] = ["rbx", "r12", "r13", "r14", "r15"]
+
+
+def label_expression(root: Node) -> Tuple[Dict[int, int], Dict[int, bool]]:
+	# Sethi-Ullman の番号付け
+	# 部分木ごとに、退避せずに計算するのに必要なレジスタ数と、代入を含まないかを求める
+	# 深い式でも再帰しないように、明示的なスタックで後順に辿る
+	need: Dict[int, int] = {}
+	pure: Dict[int, bool] = {}
+	stack: List[Tuple[Node, bool]] = [(root, False)]
+	while len(stack) != 0:
+		node, visited = stack.pop()
+		if not isinstance(node, BinaryNode):
+			need[id(node)] = 1
+			pure[id(node)] = True
+			continue
+		if not visited:
+			stack.append((node, True))
+			stack.append((node.rhs, False))
+			stack.append((node.lhs, False))
+			continue
+		if node.kind == NodeKind.ASSIGN:
+			need[id(node)] = need[id(node.rhs)]
+			pure[id(node)] = False
+			continue
+		lhs: int = need[id(node.lhs)]
+		rhs: int = need[id(node.rhs)]
+		need[id(node)] = lhs + 1 if lhs == rhs else max(lhs, rhs)
+		pure[id(node)] = pure[id(node.lhs)] and pure[id(node.rhs)]
+	return need, pure
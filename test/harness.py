@@ -0,0 +1,71 @@
+import copy
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from main import compile_source
+from driver import assemble
+from options import CompileOptions
+from typing import List, Optional, Tuple
+
+# 1つの実行ファイルにまとめるプログラムの数
+BATCH_SIZE: int = 32
+WORKERS: int = os.cpu_count() or 1
+
+
+def dispatcher(names: List[str]) -> str:
+	# 第1引数の番号の関数に飛ぶ main。飛んだ先の関数の返り値がそのまま終了コードになる
+	lines: List[str] = [
+		".intel_syntax noprefix",
+		".text",
+		".global main",
+		"main:",
+		"  push rbp",
+		"  mov rdi, [rsi + 8]",
+		"  call atoi@PLT",
+		"  pop rbp",
+		"  cdqe",
+		"  lea rcx, [rip + .L.programs]",
+		"  jmp qword ptr [rcx + rax * 8]",
+		".data",
+		".L.programs:",
+	]
+	lines += [f"  .quad {name}" for name in names]
+	return "\n".join(lines) + "\n"
+
+
+def build(programs: List[Tuple[str, Optional[CompileOptions]]], output: str) -> None:
+	# プログラムをそれぞれ別の名前の関数としてコンパイルし、gcc を1回だけ呼んで1つの実行ファイルにする
+	parts: List[str] = []
+	names: List[str] = []
+	for i, (source, options) in enumerate(programs):
+		options = copy.copy(options) if options is not None else CompileOptions()
+		options.function_name = f"program_{i}"
+		parts.append(compile_source(source, options))
+		names.append(options.function_name)
+	assemble("\n".join(parts + [dispatcher(names)]), output)
+
+
+def exit_codes(programs: List[Tuple[str, Optional[CompileOptions]]], batch_size: int = BATCH_SIZE) -> List[int]:
+	# プログラムを実行した終了コードを、渡した順番で返す
+	# ビルドと実行はスレッドプールで並列に行い、実行ファイルは呼び出しごとの一時ディレクトリに作る
+	batches: List[List[Tuple[str, Optional[CompileOptions]]]] = [
+		programs[i:i + batch_size] for i in range(0, len(programs), batch_size)
+	]
+	with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(max_workers=WORKERS) as executor:
+		executables: List[str] = [os.path.join(directory, f"batch_{i}") for i in range(len(batches))]
+		list(executor.map(build, batches, executables))
+		runs: List[Tuple[str, int]] = [
+			(executable, i) for executable, batch in zip(executables, batches) for i in range(len(batch))
+		]
+		return list(executor.map(lambda run: subprocess.run([run[0], str(run[1])]).returncode, runs))
+
+
+def assert_exit_codes(cases: List[Tuple[str, int]], options: Optional[CompileOptions] = None) -> None:
+	# (ソース, 期待する終了コード) の組をまとめて実行し、違ったものをすべて報告する
+	results: List[int] = exit_codes([(source, options) for source, _ in cases])
+	failures: List[str] = [
+		f"{source!r}: expected {expected}, got {result}"
+		for (source, expected), result in zip(cases, results) if result != expected
+	]
+	assert len(failures) == 0, "\n".join(failures)
@@ -0,0 +1,56 @@
+import os
+import batch
+from batch import compile_batch, read_manifest, output_paths
+from main import compile_source
+
+
+def write_sources(directory):
+	paths = []
+	for name, source in [("a.c", "return 1;"), ("sub/a.c", "a = 2; return a * 3;"), ("bad.c", "return ;")]:
+		path = directory / name
+		path.parent.mkdir(exist_ok=True)
+		path.write_text(source)
+		paths.append(str(path))
+	return paths
+
+
+def test_output_paths(tmp_path):
+	# 同じ名前のファイルでも、ディレクトリ構成を写すのでぶつからない
+	sources = [str(tmp_path / "a.c"), str(tmp_path / "sub" / "a.c")]
+	assert output_paths(sources, "out") == [os.path.join("out", "a.s"), os.path.join("out", "sub", "a.s")]
+
+
+def test_compile_batch(tmp_path):
+	sources = write_sources(tmp_path / "src")
+	for jobs in (1, 2):
+		output_dir = tmp_path / f"out{jobs}"
+		results = compile_batch(sources, str(output_dir), jobs=jobs)
+		assert [result.source_path for result in results] == sources
+		assert [result.error is None for result in results] == [True, True, False]
+		assert (output_dir / "sub" / "a.s").read_text() == compile_source("a = 2; return a * 3;")
+		assert not (output_dir / "bad.s").exists()
+		assert all(result.seconds >= 0 for result in results)
+
+
+def test_compile_batch_unreadable(tmp_path, monkeypatch):
+	# 読めないファイルや内部エラーがあっても、ほかのファイルはコンパイルする
+	sources = write_sources(tmp_path / "src")
+	(tmp_path / "src" / "binary.c").write_bytes(b"return \xff\xfe;")
+	sources.append(str(tmp_path / "src" / "binary.c"))
+	for jobs in (1, 2):
+		results = compile_batch(sources, str(tmp_path / f"out{jobs}"), jobs=jobs)
+		assert [result.error is None for result in results] == [True, True, False, False]
+		assert "テキストとして読めません" in results[3].error
+
+	def broken(source, options, cache=None):
+		raise RecursionError("maximum recursion depth exceeded")
+
+	monkeypatch.setattr(batch, "compile_source", broken)
+	results = compile_batch(sources[:1], str(tmp_path / "broken"), jobs=1)
+	assert "内部エラー" in results[0].error and "RecursionError" in results[0].error
+
+
+def test_read_manifest(tmp_path):
+	manifest = tmp_path / "manifest.txt"
+	manifest.write_text("# sources\na.c\n\nsub/b.c\n")
+	assert read_manifest(str(manifest)) == [str(tmp_path / "a.c"), str(tmp_path / "sub" / "b.c")]
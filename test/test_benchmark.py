@@ -0,0 +1,41 @@
+import json
+from benchmark import generate_program, growth_exponents, superlinear_phases, run_benchmark, parse_size, PHASES
+from options import CompileOptions
+from harness import exit_codes
+
+
+def test_generate_program():
+	source = generate_program(2000, seed=1)
+	assert 2000 <= len(source) < 2500
+	assert source == generate_program(2000, seed=1)
+	# 生成したプログラムは終了し、どの生成方法でも同じ値を返す
+	programs = [generate_program(1500, depth=4, nesting=3, variables=5, seed=seed) for seed in range(4)]
+	options = [CompileOptions(), CompileOptions(use_ir=True), CompileOptions(stack_machine=True, fold_constants=False)]
+	results = exit_codes([(source, option) for source in programs for option in options])
+	assert all(len(set(results[i:i + len(options)])) == 1 for i in range(0, len(results), len(options)))
+
+
+def test_superlinear_phases():
+	assert [round(e, 6) for e in growth_exponents([(10, 0.01), (100, 0.1), (1000, 10.0)])] == [1.0, 2.0]
+	# 短すぎる計測は判定に使わない
+	assert growth_exponents([(10, 0.00001), (100, 0.01)]) == []
+	results = [
+		{"bytes": size, "total_seconds": 2 * seconds,
+		 "phases": {phase: {"seconds": seconds if phase != "parse" else seconds * size / 1000} for phase in PHASES}}
+		for size, seconds in [(1000, 0.01), (10000, 0.1)]
+	]
+	assert list(superlinear_phases(results)) == ["parse"]
+	# 大きさが10倍で時間が15.9倍 (1.2 乗) の伸びも超線形とみなす
+	results[1]["phases"]["codegen"]["seconds"] = 0.159
+	assert sorted(superlinear_phases(results)) == ["codegen", "parse"]
+
+
+def test_run_benchmark():
+	report = run_benchmark([500, 1000], repeat=1)
+	report = json.loads(json.dumps(report))
+	assert [result["size"] for result in report["results"]] == [500, 1000]
+	assert report["rounds"] >= 1
+	for result in report["results"]:
+		assert set(result["phases"]) == set(PHASES)
+		assert all(phase["seconds"] > 0 and phase["peak_bytes"] > 0 for phase in result["phases"].values())
+	assert parse_size("10K") == 10000 and parse_size("1.5M") == 1500000 and parse_size("123") == 123
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import compile_cache
+from compile_cache import CompileCache, cache_key, compiler_modules
+from main import compile_source
+from options import CompileOptions
+
+
+def test_cache_key():
+	source = "return 1;"
+	assert cache_key(source, CompileOptions()) == cache_key(source, CompileOptions())
+	assert cache_key(source, CompileOptions()) != cache_key("return 2;", CompileOptions())
+	assert cache_key(source, CompileOptions()) != cache_key(source, CompileOptions(use_ir=True))
+	# 集合の並び順によらない
+	assert cache_key(source, CompileOptions(disabled_peephole_rules=["push_pop", "self_move"])) \
+		== cache_key(source, CompileOptions(disabled_peephole_rules=["self_move", "push_pop"]))
+
+
+def test_compile_cache(tmp_path):
+	cache = CompileCache(str(tmp_path))
+	source = "a = 1; return a + 2;"
+	asm = compile_source(source, cache=cache)
+	assert compile_source(source, cache=cache) == asm == compile_source(source)
+	compile_source(source, CompileOptions(stack_machine=True), cache=cache)
+	assert cache.stats == {"hits": 1, "misses": 2, "evictions": 0}
+	# 書きかけの一時ファイルは残らない
+	assert sorted(name.endswith(".s") for name in os.listdir(tmp_path)) == [True, True]
+
+	stats = {}
+	compile_source(source, stats=stats, cache=cache)
+	assert stats["cache"]["hits"] == 2
+
+
+def test_evict(tmp_path):
+	sources = [f"return {i};" for i in range(3)]
+	size = len(compile_source(sources[0]))
+	cache = CompileCache(str(tmp_path), max_bytes=size * 2)
+	compile_source(sources[0], cache=cache)
+	compile_source(sources[1], cache=cache)
+	# 1 を最後に使ったのを昔にしておくと、0 を使い直した後は 1 が一番古い
+	path = cache.path(cache_key(sources[0], CompileOptions()))
+	os.utime(cache.path(cache_key(sources[1], CompileOptions())), (0, 0))
+	compile_source(sources[0], cache=cache)
+	compile_source(sources[2], cache=cache)
+	assert cache.stats["evictions"] == 1
+	assert os.path.exists(path)
+	assert not os.path.exists(cache.path(cache_key(sources[1], CompileOptions())))
+
+
+def test_compiler_modules():
+	# main が読み込むモジュールはすべてハッシュに含め、道具は含めない
+	directory = os.path.dirname(os.path.abspath(compile_cache.__file__))
+	script = (
+		"import os, sys, main\n"
+		"print(' '.join(name for name, module in sys.modules.items()"
+		" if os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '')) == sys.argv[1]))"
+	)
+	output = subprocess.run([sys.executable, "-c", script, directory], cwd=directory, stdout=subprocess.PIPE, check=True)
+	imported = set(output.stdout.decode().split())
+	assert "main" in imported
+	assert imported - {"compile_cache", "instrumentation"} <= set(compiler_modules)
+	assert "batch" not in compiler_modules and "compile_server" not in compiler_modules
+
+
+def test_oversized_entry(tmp_path):
+	# max_bytes より大きいアセンブリは保存しない
+	cache = CompileCache(str(tmp_path), max_bytes=10)
+	asm = compile_source("return 1;", cache=cache)
+	assert compile_source("return 1;", cache=cache) == asm
+	assert os.listdir(tmp_path) == []
+	assert cache.stats == {"hits": 0, "misses": 2, "evictions": 0}
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import socket
+import stat
+import pytest
+from compile_server import CompileServer
+from compile_client import CompileClient, run
+from compile_protocol import encode, decode
+from main import compile_source
+
+
+def test_protocol():
+	message = {"argv": ["return 1;"]}
+	assert decode(encode(message)[4:]) == message
+	assert encode(message)[:4] == len(encode(message)[4:]).to_bytes(4, "big")
+
+
+def test_compile_server(tmp_path):
+	socket_path = str(tmp_path / "server.sock")
+
+	def requests():
+		client = CompileClient(socket_path)
+		try:
+			# 1つの接続で続けて送れる
+			return [client.request(["a = 1; return a + 2;"]), client.request(["return ;"]), client.request([])]
+		finally:
+			client.close()
+
+	async def scenario():
+		server = CompileServer(socket_path, max_pending=2)
+		listening = await server.start()
+		try:
+			# 所有者だけがつなげる。動いているサーバーのソケットは奪わない
+			assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+			with pytest.raises(OSError, match="既にサーバーが動いています"):
+				await CompileServer(socket_path).start()
+			results = await asyncio.get_running_loop().run_in_executor(None, requests)
+		finally:
+			await server.close(listening)
+		return server, results
+
+	server, (compiled, error, usage) = asyncio.run(scenario())
+	assert compiled == (0, compile_source("a = 1; return a + 2;") + "\n", "")
+	assert error[0] == 1 and "不正な文です" in error[1]
+	assert usage[0] == 2 and "usage" in usage[2]
+	# 2つ目のサーバーが動いているか確かめた接続も数える
+	assert server.stats == {"connections": 2, "requests": 3, "errors": 0}
+	assert not os.path.exists(socket_path)
+
+
+def test_compile_server_max_pending(tmp_path):
+	# 同時の要求が max_pending を超えても、待たせてからすべてコンパイルする
+	# main と同じく、イベントループを動かす前にサーバーを作る
+	socket_path = str(tmp_path / "server.sock")
+	server = CompileServer(socket_path, workers=1, max_pending=1)
+	sources = [f"return {i};" for i in range(4)]
+
+	def request(source):
+		client = CompileClient(socket_path)
+		try:
+			return client.request([source])
+		finally:
+			client.close()
+
+	async def scenario():
+		listening = await server.start()
+		try:
+			# 枠を埋めておき、すべての要求が届いて待っている状態にしてから空ける
+			await server.pending.acquire()
+			loop = asyncio.get_running_loop()
+			results = asyncio.gather(*[loop.run_in_executor(None, request, source) for source in sources])
+			while server.stats["requests"] != len(sources):
+				await asyncio.sleep(0.01)
+			server.pending.release()
+			return await results
+		finally:
+			await server.close(listening)
+
+	# 別のイベントループでもう一度動かしても、前のループの待ち行列を使わない
+	for _ in range(2):
+		server.stats["requests"] = 0
+		assert asyncio.run(scenario()) == [(0, compile_source(source) + "\n", "") for source in sources]
+	assert server.stats == {"connections": 8, "requests": 4, "errors": 0}
+
+
+def test_stale_socket(tmp_path):
+	# 前に落ちたサーバーのソケットが残っていても、つながらなければ消して起動する
+	socket_path = str(tmp_path / "server.sock")
+	stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	stale.bind(socket_path)
+	stale.close()
+
+	async def scenario():
+		server = CompileServer(socket_path)
+		listening = await server.start()
+		try:
+			return await asyncio.get_running_loop().run_in_executor(None, run, ["return 1;"], socket_path)
+		finally:
+			await server.close(listening)
+
+	assert asyncio.run(scenario())[0] == 0
+
+
+def test_client_fallback(tmp_path):
+	# サーバーが動いていなければ、その場でコンパイルする
+	status, output, errors = run(["return 1;"], str(tmp_path / "missing.sock"))
+	assert (status, output) == (0, compile_source("return 1;") + "\n")
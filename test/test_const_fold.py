@@ -0,0 +1,40 @@
+from const_fold import fold_constants, eval_binary, wrap_int64
+from node_parser import *
+from token_parser import tokenize
+
+
+def folded(source: str):
+	function = node_parse(tokenize(source), source)
+	stats = fold_constants(function)
+	return function.nodes, stats
+
+
+def test_eval_binary():
+	assert eval_binary(NodeKind.DIV, 7, 2) == 3
+	assert eval_binary(NodeKind.DIV, -7, 2) == -3
+	assert eval_binary(NodeKind.DIV, 7, -2) == -3
+	assert eval_binary(NodeKind.DIV, 1, 0) is None
+	assert eval_binary(NodeKind.DIV, -(1 << 63), -1) is None
+	assert eval_binary(NodeKind.MUL, 1 << 62, 4) == 0
+	assert wrap_int64(1 << 63) == -(1 << 63)
+
+
+def test_fold_constants():
+	nodes, stats = folded("return 3+3*3;")
+	assert nodes[0].value == NumNode(12, Token(TokenKind.RESERVED, "+", 8))
+	assert stats == {"folded": 2, "simplified": 0}
+
+	nodes, stats = folded("return -3 + 4 < 2;")
+	assert nodes[0].value.val == 1
+
+	nodes, stats = folded("return 1 / 0;")
+	assert isinstance(nodes[0].value, BinaryNode)
+	assert stats["folded"] == 0
+
+	nodes, stats = folded("a = 1; return (a * 1 + 0) - (a - a) * 5;")
+	assert nodes[1].value == LocalVarNode(8, Token(TokenKind.IDENT, "a", 15))
+	assert stats == {"folded": 1, "simplified": 4}
+
+	# 代入を含む式は0倍でも消さない
+	nodes, stats = folded("return (a = 2) * 0;")
+	assert isinstance(nodes[0].value, BinaryNode)
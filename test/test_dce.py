@@ -0,0 +1,52 @@
+from dce import eliminate_dead_code
+from node_parser import *
+from token_parser import tokenize
+
+
+def eliminated(source: str):
+	function = node_parse(tokenize(source), source)
+	stats = eliminate_dead_code(function)
+	return function.nodes, stats
+
+
+def test_unreachable_statements():
+	nodes, stats = eliminated("a = 1; return a; a = 2; return 3;")
+	assert [node.kind for node in nodes] == [NodeKind.ASSIGN, NodeKind.RETURN]
+	assert stats == {"unreachable_statements": 2, "resolved_branches": 0, "removed_nodes": 5}
+
+	# 両方の枝が return する if や、条件のない for の後ろにも進まない
+	nodes, stats = eliminated("if (a) return 1; else { return 2; } a = 3; return a;")
+	assert [node.kind for node in nodes] == [NodeKind.IF]
+	nodes, stats = eliminated("for (;;) { a = 1; } return a;")
+	assert [node.kind for node in nodes] == [NodeKind.FOR]
+	nodes, stats = eliminated("if (a) return 1; a = 3; return a;")
+	assert len(nodes) == 3
+
+
+def test_resolved_branches():
+	nodes, stats = eliminated("if (1) a = 1; else a = 2; if (0) b = 1; return a;")
+	assert [node.kind for node in nodes] == [NodeKind.ASSIGN, NodeKind.RETURN]
+	assert nodes[0].rhs.val == 1
+	assert stats["resolved_branches"] == 2
+
+	nodes, stats = eliminated("while (0) a = 1; for (i = 0; 0; i = i + 1) a = 2; return 0;")
+	assert [node.kind for node in nodes] == [NodeKind.ASSIGN, NodeKind.RETURN]
+
+	# while (1) は比較のない for になり、その後ろは到達しない
+	nodes, stats = eliminated("i = 0; while (1) { if (i == 5) return i; i = i + 1; } return 9;")
+	assert isinstance(nodes[1], ForNode) and nodes[1].conditions is None
+	assert len(nodes) == 2
+
+	# 取り除いた文の代わりに空のブロックを置く
+	nodes, stats = eliminated("if (a) while (0) a = 1; return a;")
+	assert nodes[0].if_node == BlockNode(nodes[0].token, [])
+
+
+def test_resolved_dead_returns():
+	# 取り除いた return の後に作ったノードを、後ろへ進まない文と取り違えない
+	part = ("if (a) { if (0) return i; } { while (0) { return i; } b = 2; } "
+			"if (a) while (0) b = i; else return 7; if (a) for (;0;) b = 1; else return 9; ")
+	source = "a = 1; i = 0; " + part * 20 + "return 3;"
+	nodes, stats = eliminated(source)
+	assert stats["unreachable_statements"] == 0
+	assert nodes[-1].kind == NodeKind.RETURN and nodes[-1].value.val == 3
@@ -0,0 +1,41 @@
+import pytest
+from diagnostics import LineIndex, Diagnostics, CompileError
+from main import compile_source
+
+
+def test_line_index():
+	source = "a = 1;\nb = 2;\n\nreturn a;"
+	line_index = LineIndex(source)
+	assert line_index.position(0) == (0, 0)
+	assert line_index.position(5) == (0, 5)
+	assert line_index.position(7) == (1, 0)
+	assert line_index.position(14) == (2, 0)
+	assert line_index.position(22) == (3, 7)
+	assert line_index.position(len(source)) == (3, 9)
+	assert line_index.line(1) == "b = 2;"
+	assert line_index.line(2) == ""
+	assert line_index.line(3) == "return a;"
+
+
+def test_diagnostics():
+	source = "a = 1;\nb = 2 +;"
+	diagnostics = Diagnostics(source)
+	diagnostics.error(14, 1, "不正な文です。")
+	assert diagnostics.report() == "line 2 | b = 2 +;\n" + " " * 16 + "^\nError: 不正な文です。"
+	with pytest.raises(CompileError):
+		diagnostics.check()
+
+
+def test_compile_error_collects_all():
+	source = "a = 1 @ 2;\nb = 0x;\n{ c = ; d = 1; }\n1 = 2;\nreturn (a;"
+	with pytest.raises(CompileError) as e:
+		compile_source(source)
+	errors = e.value.diagnostics.errors
+	assert [(error.index, error.message) for error in sorted(errors, key=lambda error: error.index)] == [
+		(6, "解釈できません"),
+		(8, ";が行末にありません"),
+		(17, "無効な数値です。"),
+		(25, "不正な文です。"),
+		(36, "代入先が不正です。"),
+		(52, "括弧が閉じられていません。"),
+	]
@@ -0,0 +1,33 @@
+import subprocess
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from driver import compile_to_executable, assemble, ToolchainError
+from diagnostics import CompileError
+
+
+def test_compile_to_executable(tmp_path):
+	executable = str(tmp_path / "a.out")
+	compile_to_executable("a = 6; return a * 7;", executable)
+	assert subprocess.run([executable]).returncode == 42
+	# 作業ディレクトリには何も書かない
+	assert [path.name for path in tmp_path.iterdir()] == ["a.out"]
+
+
+def test_concurrent_builds(tmp_path):
+	# 同じディレクトリで並列にビルドしても、互いのファイルを壊さない
+	def build(i):
+		executable = str(tmp_path / f"a{i}")
+		compile_to_executable(f"return {i};", executable)
+		return subprocess.run([executable]).returncode
+
+	with ThreadPoolExecutor(max_workers=8) as executor:
+		assert list(executor.map(build, range(16))) == list(range(16))
+
+
+def test_errors(tmp_path):
+	with pytest.raises(CompileError):
+		compile_to_executable("return ;", str(tmp_path / "a.out"))
+	with pytest.raises(ToolchainError) as info:
+		assemble("  bogus_instruction\n", str(tmp_path / "a.out"))
+	assert info.value.status != 0
+	assert "bogus_instruction" in info.value.output
@@ -0,0 +1,29 @@
+import io
+from emitter import Emitter
+from main import compile_source
+from token_parser import tokenize
+from node_parser import node_parse
+from asm_gen import asm_gen
+
+
+def test_emitter():
+	emitter = Emitter()
+	assert emitter.getvalue() == ""
+	emitter.label("main")
+	emitter.emit("  ret")
+	assert emitter.lines == ["main:", "  ret"]
+	assert emitter.getvalue() == "main:\n  ret\n"
+
+	sink = io.StringIO()
+	emitter = Emitter(sink)
+	emitter.label("main")
+	emitter.emit("  ret")
+	assert emitter.lines == []
+	assert sink.getvalue() == "main:\n  ret\n"
+
+
+def test_asm_gen_sink():
+	source = "a = 0; while (a < 10) { a = a + 1; } if (a == 10) return a; else return 0;"
+	sink = io.StringIO()
+	assert asm_gen([node_parse(tokenize(source), source)], source, sink=sink) == ""
+	assert sink.getvalue() == compile_source(source)
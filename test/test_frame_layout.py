@@ -0,0 +1,62 @@
+from frame_layout import layout_frame, live_ranges
+from node_parser import node_parse
+from token_parser import tokenize
+
+
+def parse(source: str):
+	return node_parse(tokenize(source), source)
+
+
+def test_layout_frame():
+	function = parse("a = 1; b = a + 1; c = b * 2; d = c + 3; return d;")
+	layout = layout_frame(function, share_slots=False)
+	assert layout.offsets == {8: 8, 16: 16, 24: 24, 32: 32}
+	assert layout.size == 32
+
+	layout = layout_frame(function)
+	# 代入先に書き込むのは右辺を読んだ後なので、どの変数も直前の変数と同じスロットを使える
+	assert layout.offsets == {8: 8, 16: 8, 24: 8, 32: 8}
+	assert layout.size == 16
+
+	function = parse("a = 1; b = 2; c = a + b; d = a + c; return d;")
+	# a と b、a と c は同時に生きている
+	assert layout_frame(function).offsets == {8: 8, 16: 16, 24: 16, 32: 8}
+
+	function = parse("a = 1; b = 2; c = 3; return c;")
+	assert layout_frame(function).size == 16
+	assert layout_frame(function, share_slots=False).size == 32
+
+
+def test_live_ranges_loop():
+	# ループ内で使われる変数はループ全体で生きている
+	function = parse("s = 0; i = 0; while (i < 3) { t = i * 2; s = s + t; i = i + 1; } u = s; return u;")
+	ranges = live_ranges(function)
+	offsets = function.lvar_offsets
+	# while は前順で7番目、ループの最後のノードは26番目。代入先は右辺の後ろに数える
+	assert {name: ranges[offset] for name, offset in offsets.items()} == {
+		"s": (3, 28),
+		"i": (6, 26),
+		"t": (7, 26),
+		"u": (29, 31),
+	}
+	layout = layout_frame(function)
+	assert len({layout.offset(offsets[name]) for name in ["s", "i", "t"]}) == 3
+	assert layout.offset(offsets["u"]) in {layout.offset(offsets[name]) for name in ["s", "i", "t"]}
+
+
+def test_promote_locals():
+	function = parse("a = 1; b = 2; c = a + b; d = a + c; return d;")
+	layout = layout_frame(function, registers=["rbx", "r12", "r13"])
+	# 生存区間が重ならない変数は同じレジスタを使い回すので、スタックには何も置かない
+	assert layout.registers == {8: "rbx", 16: "r12", 24: "r12", 32: "r12"}
+	assert layout.offsets == {}
+	assert layout.saved_registers == ["rbx", "r12"]
+	assert layout.size == 16
+
+	# レジスタが足りなければ、一番遠くまで生きる変数をスタックに置く
+	function = parse("a = 1; b = 2; c = 3; d = a + b + c; return a + d;")
+	layout = layout_frame(function, registers=["rbx", "r12"])
+	offsets = function.lvar_offsets
+	assert offsets["a"] not in layout.registers
+	assert layout.offset(offsets["a"]) == 24
+	assert layout.size == 32
@@ -0,0 +1,50 @@
+import json
+from main import compile_source, run
+from options import CompileOptions
+from instrumentation import CompileStats
+from compile_cache import CompileCache
+
+
+def test_compile_stats():
+	source = "a = 1; for (i = 0; i < 3; i = i + 1) a = a * 2; return a;"
+	stats = CompileStats(memory=True)
+	asm = compile_source(source, instrumentation=stats)
+	# 計測しても生成するアセンブリは変わらない
+	assert asm == compile_source(source)
+	names = [phase.name for phase in stats.phases]
+	assert names[:3] == ["tokenize", "parse", "optimize"] and names[-1] == "codegen"
+	assert "fold_constants" in names
+	assert all(phase.wall >= 0 and phase.cpu >= 0 for phase in stats.phases)
+	assert all((phase.peak_bytes is not None) == (phase.depth == 0) for phase in stats.phases)
+	assert stats.tokens == 30
+	assert stats.nodes["FOR"] == 1 and stats.nodes["ASSIGN"] == 4 and stats.nodes["NUM"] == 5
+	assert stats.labels == len([line for line in asm.splitlines() if line.endswith(":")])
+	assert stats.instructions == len([line for line in asm.splitlines() if line.startswith("  ")])
+
+	stats = CompileStats()
+	compile_source(source, CompileOptions(use_ir=True), instrumentation=stats)
+	assert [phase.name for phase in stats.phases if phase.depth == 0] == \
+		["tokenize", "parse", "optimize", "lower", "optimize_ir", "codegen"]
+	assert all(phase.peak_bytes is None for phase in stats.phases)
+
+
+def test_cache_lookup(tmp_path):
+	cache = CompileCache(str(tmp_path))
+	compile_source("return 1;", cache=cache)
+	stats = CompileStats()
+	compile_source("return 1;", cache=cache, instrumentation=stats)
+	assert [phase.name for phase in stats.phases] == ["cache_lookup"]
+
+
+def test_chrome_trace(tmp_path):
+	path = tmp_path / "trace.json"
+	status, output, errors = run(["a = 2; return a * 3;", "--trace", str(path)])
+	assert status == 0 and errors == ""
+	trace = json.loads(path.read_text())
+	spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+	assert [event["name"] for event in spans if event["name"] in ("tokenize", "parse", "codegen")] == \
+		["tokenize", "parse", "codegen"]
+	assert all(event["dur"] >= 0 and "cpu_ms" in event["args"] for event in spans)
+	counters = {event["name"]: event["args"] for event in trace["traceEvents"] if event["ph"] == "C"}
+	assert counters["counts"]["tokens"] == 10
+	assert counters["nodes"]["MUL"] == 1
@@ -0,0 +1,71 @@
+from ir import IRInstruction, lower_function, remove_unreachable_blocks
+from ir_asm_gen import IRAssemblyGenerator
+from emitter import Emitter
+from diagnostics import Diagnostics
+from node_parser import node_parse
+from token_parser import tokenize
+
+
+def lowered(source: str):
+	function = node_parse(tokenize(source), source)
+	return lower_function(function, Diagnostics(source))
+
+
+def test_lower_function():
+	function = lowered("a = 1; return a + 2;")
+	assert len(function.blocks) == 1
+	assert function.blocks[0].instructions == [
+		IRInstruction("const", 0, [1]),
+		IRInstruction("store", None, [8, 0]),
+		IRInstruction("load", 1, [8]),
+		IRInstruction("const", 2, [2]),
+		IRInstruction("add", 3, [1, 2]),
+		IRInstruction("ret", None, [3]),
+	]
+	assert repr(function.blocks[0].instructions[4]) == "v3 = add v1, v2"
+
+	function = lowered("i = 0; while (i < 3) i = i + 1; return i;")
+	labels = [block.label for block in function.blocks]
+	assert len(labels) == 4
+	# 条件は本体の後ろに置く
+	assert function.blocks[0].successors() == [labels[2]]
+	assert function.blocks[1].successors() == [labels[2]]
+	assert function.blocks[2].instructions[-1] == IRInstruction("br", None, [6, labels[1], labels[3]])
+	# 仮想レジスタは一度だけ代入される
+	dsts = [instruction.dst for block in function.blocks for instruction in block.instructions
+			if instruction.dst is not None]
+	assert len(dsts) == len(set(dsts)) == function.vreg_count
+
+
+def test_remove_unreachable_blocks():
+	function = lowered("1; return 2; 3;")
+	assert len(function.blocks) == 2
+	assert remove_unreachable_blocks(function) == {"removed_blocks": 1}
+	assert len(function.blocks) == 1
+
+	function = lowered("if (1) return 1; else return 2;")
+	assert remove_unreachable_blocks(function) == {"removed_blocks": 1}
+
+
+def test_allocate_block():
+	# 同時に生きている値がレジスタより多いと、一番遠くまで使われる値をスタックに置く
+	leaf = "a"
+	for _ in range(9):
+		leaf = f"(a * 3 + {leaf})"
+	function = lowered(f"a = 1; return {leaf};")
+	generator = IRAssemblyGenerator(Emitter())
+	generator.spill_base = function.frame.size
+	generator.frame_offsets = function.frame.offsets
+	generator.allocate_block(function.blocks[0])
+	locations = generator.locations
+	assert generator.spill_count == 2
+	spilled = [vreg for vreg, location in locations.items() if vreg not in generator.inlined and location.startswith("qword ptr")]
+	assert len(spilled) == 2
+
+	# 結果は使い終わった左辺のレジスタを使い回す
+	function = lowered("a = 1; return a * a - 2;")
+	generator = IRAssemblyGenerator(Emitter())
+	generator.frame_offsets = function.frame.offsets
+	generator.allocate_block(function.blocks[0])
+	sub = function.blocks[0].instructions[-2]
+	assert generator.locations[sub.dst] == generator.locations[sub.args[0]]
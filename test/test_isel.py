@@ -0,0 +1,38 @@
+from isel import is_imm32, log2_exact, magic_signed, multiply_by_constant, divide_by_constant
+
+
+def test_is_imm32():
+	assert is_imm32(2147483647)
+	assert is_imm32(-2147483648)
+	assert not is_imm32(2147483648)
+
+
+def test_log2_exact():
+	assert log2_exact(1) == 0
+	assert log2_exact(8) == 3
+	assert log2_exact(6) is None
+	assert log2_exact(0) is None
+	assert log2_exact(-4) is None
+
+
+def test_magic_signed():
+	assert magic_signed(7) == (0x4924924924924925, 1)
+	assert magic_signed(3) == (0x5555555555555556, 0)
+	assert magic_signed(-7) == (-0x4924924924924925, 1)
+
+
+def test_multiply_by_constant():
+	assert multiply_by_constant("rdi", 8) == ["  shl rdi, 3"]
+	assert multiply_by_constant("rdi", 1) == []
+	assert multiply_by_constant("rdi", 10) == ["  imul rdi, rdi, 10"]
+	assert multiply_by_constant("rdi", 1 << 40 | 1) is None
+
+
+def test_divide_by_constant():
+	# 0除算と INT64_MIN / -1 は idiv に任せる
+	assert divide_by_constant("rdi", 0) is None
+	assert divide_by_constant("rdi", -1) is None
+	assert divide_by_constant("rdi", 1) == []
+	assert "  sar rax, 2" in divide_by_constant("rdi", 4)
+	assert divide_by_constant("rdi", -4)[-1] == "  neg rdi"
+	assert "  idiv rdi" not in divide_by_constant("rdi", 7)
@@ -0,0 +1,60 @@
+from loop_opt import optimize_loops
+from node_parser import *
+from token_parser import tokenize
+
+
+def optimized(source: str):
+	function = node_parse(tokenize(source), source)
+	stats = optimize_loops(function)
+	return function, stats
+
+
+def test_hoist_invariants():
+	function, stats = optimized("n = 5; s = 0; for (i = 0; i < n * 2; i = i + 1) s = s + n * 2 + i; return s;")
+	assert stats == {"loops": 1, "hoisted": 2, "strength_reduced": 0}
+	block = function.nodes[2]
+	assert isinstance(block, BlockNode)
+	# 初期化式の後に、同じ式を一度だけ求める
+	init, hoisted, loop = block.nodes
+	assert init.lhs.offset == function.lvar_offsets["i"]
+	temp = function.lvar_offsets[".licm3"]
+	assert hoisted.lhs.offset == temp and hoisted.rhs.kind == NodeKind.MUL
+	assert loop.init is None
+	assert loop.conditions.rhs.offset == temp
+	assert loop.loop_node.rhs.lhs.rhs.offset == temp
+
+	# ループ内で代入される変数を使う式や、0除算になりうる除算は移動しない
+	function, stats = optimized("while (a < 10) { a = a + b * c; d = e / f; g = e / 2; }")
+	assert stats["hoisted"] == 2
+
+
+def test_reduce_strength():
+	function, stats = optimized("s = 0; for (i = 10; i > 0; i = i - 2) s = s + i * 3 + i * k; return s;")
+	assert stats == {"loops": 1, "strength_reduced": 2, "hoisted": 1}
+	init, ivk, iv3, step, loop = function.nodes[1].nodes
+	assert ivk.rhs.rhs.offset == function.lvar_offsets["k"] and iv3.rhs.rhs.val == 3
+	# k * (-2) はループの前で求める
+	assert step.rhs.rhs.val == -2
+	inc, updatek, update3 = loop.inc.nodes
+	assert update3.rhs.rhs.val == -6
+	assert updatek.rhs.rhs.offset == step.lhs.offset
+
+	# 本体で代入される変数は誘導変数として扱わない
+	function, stats = optimized("for (i = 0; i < 10; i = i + 1) { s = s + i * 3; i = i + 1; }")
+	assert stats["strength_reduced"] == 0
+
+
+def test_nested_loops():
+	# 内側のループの前に移動した式は、外側のループでも値が変わらなければさらに外へ移動する
+	function, stats = optimized("while (a < 10) { a = a + 1; while (b < 10) b = b + c * d; }")
+	assert stats == {"loops": 2, "hoisted": 2, "strength_reduced": 0}
+	hoisted, loop = function.nodes[0].nodes
+	assert hoisted.rhs.kind == NodeKind.MUL
+	inner_hoisted, inner_loop = loop.loop_node.nodes[1].nodes
+	assert inner_hoisted.rhs.offset == hoisted.lhs.offset
+
+	# 内側のループを辿り直さないので、深い入れ子でもループの数に比例した時間で終わる
+	depth = 2000
+	function, stats = optimized("i = 0; " + "while (i < 1) " * depth + "i = i + n * 2; return i;")
+	# n * 2 はループごとに1つ外の前へ移る
+	assert stats == {"loops": depth, "hoisted": depth, "strength_reduced": 0}
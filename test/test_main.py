@@ -1,93 +1,74 @@
-import subprocess
 from main import compile_source
+from options import CompileOptions
+from harness import assert_exit_codes, exit_codes
 from functools import reduce
-import os
-
-
-def executed_exit_code(source: str):
-	asm: str = compile_source(source)
-	with open("./tmp.s", "w") as f:
-		f.write(asm)
-	if os.name == "nt":
-		proc = subprocess.run("ubuntu run \"gcc ./tmp.s -o ./tmp && ./tmp; echo $?\"", shell=True, stdout=subprocess.PIPE)
-	elif os.name == "posix":
-		proc = subprocess.run("gcc ./tmp.s -o ./tmp && ./tmp; echo $?", shell=True, stdout=subprocess.PIPE)
-	else:
-		raise EnvironmentError("This OS don't support.")
-	result: int = int(proc.stdout.decode())
-	os.remove("./tmp")
-	os.remove("./tmp.s")
-	return result
-
-
-def assert_asm(source: str, result: int):
-	assert executed_exit_code(source) == result
 
 
 def test_main():
-	assert_asm("return 1 + 2;", 3)
-	assert_asm("return 1 + 2;", 3)
-	assert_asm("return 0;", 0)
+	result = sum([i for i in range(0, 11)]) + reduce(lambda a, b: a * b, [i for i in range(0, 11)])
+	assert_exit_codes([
+		("return 1 + 2;", 3),
+		("return 1 + 2;", 3),
+		("return 0;", 0),
 
-	assert_asm("return 42;", 42)
-	assert_asm("return 5+20-4;", 21)
-	assert_asm("return 12 + 34 - 5 ;", 41)
+		("return 42;", 42),
+		("return 5+20-4;", 21),
+		("return 12 + 34 - 5 ;", 41),
 
-	assert_asm("return 3+3*3;", 12)
-	assert_asm("return (3+3)*3;", 18)
+		("return 3+3*3;", 12),
+		("return (3+3)*3;", 18),
 
-	assert_asm("return -3+4;", 1)
-	assert_asm("return 12 + (-2 * 3);", 6)
+		("return -3+4;", 1),
+		("return 12 + (-2 * 3);", 6),
 
-	assert_asm("return 1 == 1;", 1)
-	assert_asm("return 1 == 0;", 0)
-	assert_asm("return 1 != 1;", 0)
-	assert_asm("return 1 != 0;", 1)
+		("return 1 == 1;", 1),
+		("return 1 == 0;", 0),
+		("return 1 != 1;", 0),
+		("return 1 != 0;", 1),
 
-	assert_asm("return 1 < 2;", 1)
-	assert_asm("return 2 < 1;", 0)
-	assert_asm("return 1 < 1;", 0)
+		("return 1 < 2;", 1),
+		("return 2 < 1;", 0),
+		("return 1 < 1;", 0),
 
-	assert_asm("return 1 > 2;", 0)
-	assert_asm("return 2 > 1;", 1)
-	assert_asm("return 1 > 1;", 0)
+		("return 1 > 2;", 0),
+		("return 2 > 1;", 1),
+		("return 1 > 1;", 0),
 
-	assert_asm("return 1 <= 2;", 1)
-	assert_asm("return 2 <= 1;", 0)
-	assert_asm("return 1 <= 1;", 1)
+		("return 1 <= 2;", 1),
+		("return 2 <= 1;", 0),
+		("return 1 <= 1;", 1),
 
-	assert_asm("return 1 >= 2;", 0)
-	assert_asm("return 2 >= 1;", 1)
-	assert_asm("return 1 >= 1;", 1)
+		("return 1 >= 2;", 0),
+		("return 2 >= 1;", 1),
+		("return 1 >= 1;", 1),
 
-	assert_asm("return (1+2*3) - 6 == 1 < 1 - -1;", 1)
-	assert_asm("return 1 > 2 == 2 < 1;", 1)
+		("return (1+2*3) - 6 == 1 < 1 - -1;", 1),
+		("return 1 > 2 == 2 < 1;", 1),
 
-	assert_asm("a = 1; return a;", 1)
-	assert_asm("z = 1; return z;", 1)
-	assert_asm("a = 1; b = a + 1; return a + b;", 3)
+		("a = 1; return a;", 1),
+		("z = 1; return z;", 1),
+		("a = 1; b = a + 1; return a + b;", 3),
 
-	assert_asm("foo = 1; return foo;", 1)
-	assert_asm("foo = 1; bar = foo + 1; return bar;", 2)
-	assert_asm("hoge = 1; fuga = 2; return hoge + fuga;", 3)
-	assert_asm("_azAZ09_ = 1; return _azAZ09_;", 1)
+		("foo = 1; return foo;", 1),
+		("foo = 1; bar = foo + 1; return bar;", 2),
+		("hoge = 1; fuga = 2; return hoge + fuga;", 3),
+		("_azAZ09_ = 1; return _azAZ09_;", 1),
 
-	assert_asm("foo = 0xef; return foo + 16;", 255)
-	assert_asm("1; return 2; 3;", 2)
+		("foo = 0xef; return foo + 16;", 255),
+		("1; return 2; 3;", 2),
 
-	assert_asm("if (1 == 1) return 2; return 1;", 2)
-	assert_asm("if (1 != 1) return 2; return 1;", 1)
-	assert_asm("if (1 == 1) foo = 1; else foo = 2; return foo;", 1)
-	assert_asm("if (1 != 1) foo = 1; else foo = 2; return foo;", 2)
+		("if (1 == 1) return 2; return 1;", 2),
+		("if (1 != 1) return 2; return 1;", 1),
+		("if (1 == 1) foo = 1; else foo = 2; return foo;", 1),
+		("if (1 != 1) foo = 1; else foo = 2; return foo;", 2),
 
-	assert_asm("foo = 0; while (foo < 5) foo = foo + 1; return foo;", 5)
-	assert_asm("foo = 10; while (foo > 0) foo = foo - 1; return foo;", 0)
-	assert_asm("foo = 0; while (0) foo = 1; return foo;", 0)
+		("foo = 0; while (foo < 5) foo = foo + 1; return foo;", 5),
+		("foo = 10; while (foo > 0) foo = foo - 1; return foo;", 0),
+		("foo = 0; while (0) foo = 1; return foo;", 0),
 
-	assert_asm("sum = 0; for (i = 1; i <= 10; i = i + 1) sum = sum + i; return sum;", 55)
+		("sum = 0; for (i = 1; i <= 10; i = i + 1) sum = sum + i; return sum;", 55),
 
-	result = sum([i for i in range(0, 11)]) + reduce(lambda a, b: a * b, [i for i in range(0, 11)])
-	assert_asm("""
+		("""
 	sum = 0;
 	smul = 0;
 	for (i = 0; i <= 10; i = i + 1) {
@@ -95,9 +76,141 @@ def test_main():
 		smul = smul * i;
 	}
 	return sum + smul;
-	""", result)
-	assert_asm("a = 0;{} return a;", 0)
-	assert_asm("i = 0; for (;;) {if (i >= 5) return i; i = i + 1;} return 0;", 5)
-
-
-
+	""", result),
+		("a = 0;{} return a;", 0),
+		("i = 0; for (;;) {if (i >= 5) return i; i = i + 1;} return 0;", 5),
+
+
+	])
+
+
+def test_stack_machine():
+	assert_exit_codes([
+		("return (3+3)*3 - 12 / 4;", 15),
+		("sum = 0; for (i = 1; i <= 10; i = i + 1) sum = sum + i; return sum;", 55),
+		("a = b = 3; return a + b;", 6),
+	], CompileOptions(stack_machine=True))
+
+
+def test_register_spill():
+	# レジスタが足りなくなる深さの式
+	leaf = "(a - 1)"
+	for _ in range(9):
+		leaf = f"({leaf} + {leaf})"
+	assert_exit_codes([
+		(f"a = 2; return {leaf} / 4;", 128),
+		("a = 7; b = 0 - 3; return (a / b) * (0 - 1) + (0 - a) / 2 * (0 - 1);", 5),
+		("a = b = 3; return a + b;", 6),
+	])
+
+
+def test_shared_stack_slots():
+	assert_exit_codes([
+		("a = 1; b = a + 1; c = b * 2; d = c + 3; return a + d;", 8),
+		("a = 1; b = a + 1; c = b * 2; d = c + 3; return d;", 7),
+		("s = 0; for (i = 0; i < 5; i = i + 1) { t = i * 2; s = s + t; } u = s + 1; return u;", 21),
+		("t = 5; s = 0; i = 0; while (i < 4) { if (i == 2) t = 10; s = s + t; t = 1; i = i + 1; } return s;", 17),
+	])
+
+
+def test_ir():
+	leaf = "(a - 1)"
+	for _ in range(9):
+		leaf = f"({leaf} + {leaf})"
+	assert_exit_codes([
+		("return (3+3)*3 - 12 / 4;", 15),
+		("1; return 2; 3;", 2),
+		("if (1 != 1) foo = 1; else foo = 2; return foo;", 2),
+		("foo = 10; while (foo > 0) foo = foo - 1; return foo;", 0),
+		("i = 0; for (;;) {if (i >= 5) return i; i = i + 1;} return 0;", 5),
+		("a = 7; b = 0 - 3; return (a / b) * (0 - 1) + (0 - a) / 2 * (0 - 1);", 5),
+		(f"a = 2; return {leaf} / 4;", 128),
+	], CompileOptions(use_ir=True))
+
+
+def test_dead_code():
+	source = "i = 0; while (1) { if (i >= 5) return i; i = i + 1; } return 9;"
+	assert exit_codes([
+		(source, None),
+		("if (0) a = 1; else a = 2; for (i = 0; 0; i = i + 1) a = 3; return a;", None),
+		(source, CompileOptions(use_ir=True)),
+	]) == [5, 2, 5]
+
+
+def test_optimize_loops():
+	source = "n = 4; s = 0; for (i = 0; i < n * 2; i = i + 1) for (j = 5; j > 0; j = j - 1) s = s + i * n + j * 3; return s;"
+	options = [CompileOptions(), CompileOptions(use_ir=True), CompileOptions(optimize_loops=False)]
+	assert exit_codes([(source, option) for option in options]) == [152] * 3
+
+
+def test_compare_and_branch():
+	for options in (CompileOptions(), CompileOptions(use_ir=True)):
+		asm = compile_source("i = 0; while (i < 10) i = i + 1; return i;", options)
+		# 比較はフラグで直接分岐し、条件はループの末尾に置く
+		assert "setl" not in asm
+		assert asm.count("  jl ") == 1
+		assert_exit_codes([
+			("i = 0; s = 0; while (i <= 10) { if (i != 3) s = s + i; i = i + 1; } return s;", 52),
+			("s = 0; for (i = 9; i > 0; i = i - 1) if (i == 4) s = s + 100; else if (i >= 7) s = s + 1; return s;", 103),
+			("a = 3; b = 0; while (a) { a = a - 1; b = b + 2; } return b;", 6),
+		], options)
+
+
+def test_constant_operands():
+	for options in (CompileOptions(), CompileOptions(use_ir=True)):
+		assert_exit_codes([
+			# 定数での除算はシフトや乗算になるが、0方向への切り捨ては idiv と同じ
+			("a = 0 - 9; return (a / 4) * (0 - 1) + a / (0 - 2) * 10;", 42),
+			("a = 100; b = 0 - 100; return a / 7 + b / 7 * (0 - 1) + a / (0 - 3) + 200 / a + 10;", 7),
+			("a = 5; return a * 8 + 3 * a + a * 1 + a / 1;", 65),
+			("a = 3; b = 4; return (1 < a) + (a < b) * 2 + (10 <= b) * 4 + (b - 1 == a) * 8;", 11),
+		], options)
+
+
+def test_promote_locals():
+	asm = compile_source("s = 0; for (i = 0; i < 10; i = i + 1) s = s + i; return s;")
+	# 変数はレジスタに置き、使った呼び出し先保存のレジスタは元に戻す
+	assert "rbp - " not in asm.replace("lea rsp, [rbp - ", "")
+	assert asm.count("push rbx") == asm.count("pop rbx") == 1
+	# 変数がレジスタより多いとスタックにも置く
+	names = "abcdefgh"
+	source = " ".join(f"{name} = {i + 1};" for i, name in enumerate(names))
+	source += " for (i = 0; i < 3; i = i + 1) { " + " ".join(f"{name} = {name} * 2 - i;" for name in names) + " }"
+	assert_exit_codes([
+		("s = 0; for (i = 0; i < 10; i = i + 1) s = s + i; return s;", 45),
+		# 各変数は x * 8 - 4 になる
+		(source + " return " + " + ".join(names) + " - 250;", 36 * 8 - 4 * 8 - 250),
+		# ループの中でも、return や条件に使う代入式は値を求める
+		("i = 0; while (i < 3) { return x = 7; } return 1;", 7),
+		("i = 0; s = 0; while (i < 3) { if (d = i) s = s + 10; i = i + 1; } return s;", 20),
+	])
+
+
+def test_number_values():
+	source = "a = 3; b = 4; c = (a + b) * (b + a); a = 1; return c - (a + b) * 2 + (a + b);"
+	options = [CompileOptions(), CompileOptions(use_ir=True), CompileOptions(stack_machine=True)]
+	assert exit_codes([(source, option) for option in options]) == [44] * 3
+
+
+def test_batched_programs():
+	# 1つの実行ファイルにまとめても、ラベルや関数名はぶつからない
+	sources = [f"i = 0; while (i < {n}) i = i + 1; if (i == 3) return 100; return i;" for n in range(40)]
+	for options in (None, CompileOptions(use_ir=True), CompileOptions(stack_machine=True)):
+		assert exit_codes([(source, options) for source in sources]) == [100 if n == 3 else n for n in range(40)]
+
+
+def test_deep_nesting():
+	# 再帰の上限 (1000) より深い入れ子でも、構文解析からコード生成まで通る
+	depth = 1500
+	cases = [
+		("a = 1; " + "{" * depth + "a = a + 1;" + "}" * depth + " return a;", 2),
+		("a = 1; return " + "(a + " * depth + "1" + ")" * depth + " - 1500;", 1),
+		("a = 1; return " + "a - " * depth + "0 + 1600;", 102),
+		("a = 1; " + "if (a) " * depth + "a = 7; return a;", 7),
+		("a = 3; return " + "-(" * depth + "a" + ")" * depth + ";", 3),
+		("return " + "a = " * depth + "5;", 5),
+		("b = 1; return " + " = ".join(f"v{i}" for i in range(depth)) + " = b + 1;", 2),
+	]
+	options = [CompileOptions(), CompileOptions(use_ir=True), CompileOptions(stack_machine=True)]
+	assert exit_codes([(source, option) for source, _ in cases for option in options]) == \
+		[expected for _, expected in cases for _ in options]
@@ -1,5 +1,5 @@
 from node_parser import *
-from token_parser import tokenize
+from token_parser import tokenize, iter_tokens
 
 
 def test_node_parser():
@@ -55,3 +55,48 @@ def test_node_parser():
 		LocalVarNode(8, Token(TokenKind.IDENT, "a", 7))
 	]
 	assert node_parse(testing, source).nodes == result
+
+
+def test_node_parser_stream():
+	source = "a = 0; while (a < 10) { a = a + 1; } return a * 2;"
+	assert node_parse(iter_tokens(source), source).nodes == node_parse(tokenize(source), source).nodes
+
+
+def shape(node):
+	# 比べやすいように、木を (種類, 左, 右) の入れ子にする
+	if isinstance(node, BinaryNode):
+		return node.kind.name, shape(node.lhs), shape(node.rhs)
+	if isinstance(node, NumNode):
+		return node.val
+	return f"v{node.offset // 8}"
+
+
+def test_precedence():
+	cases = [
+		("1 - 2 - 3;", ("SUB", ("SUB", 1, 2), 3)),
+		("1 + 2 * 3 / 4;", ("ADD", 1, ("DIV", ("MUL", 2, 3), 4))),
+		("a = b = 1 + 2;", ("ASSIGN", "v1", ("ASSIGN", "v2", ("ADD", 1, 2)))),
+		# a > b は b < a になる
+		("a > 1 >= 2;", ("LE", 2, ("LT", 1, "v1"))),
+		("1 < 2 == 3 <= 4 != 5;", ("NE", ("EQ", ("LT", 1, 2), ("LE", 3, 4)), 5)),
+		("a == 1 = 2;", ("ASSIGN", ("EQ", "v1", 1), 2)),
+		("-a * (1 + +2);", ("MUL", ("SUB", 0, "v1"), ("ADD", 1, 2))),
+	]
+	for source, expected in cases:
+		assert shape(node_parse(tokenize(source), source).nodes[0]) == expected
+	# 各優先順位の中では左結合、代入だけ右結合
+	assert binding_powers[reserved_operator_codes["+"]].right == binding_powers[reserved_operator_codes["-"]].left + 1
+	assert binding_powers[reserved_operator_codes["="]].right == binding_powers[reserved_operator_codes["="]].left
+
+
+def test_deep_nesting():
+	# 入れ子が深くても再帰の上限に当たらない
+	depth = 20000
+	source = "a = 1; " + "{ " * depth + "if (a) while (a) return " + "-(" * depth + "a" + ")" * depth + "; " + "} " * depth
+	nodes = node_parse(tokenize(source), source).nodes
+	node = nodes[1]
+	for _ in range(depth):
+		assert isinstance(node, BlockNode)
+		node = node.nodes[0]
+	assert isinstance(node, IfNode) and isinstance(node.if_node, WhileNode)
+	assert shape(node_parse(tokenize("(((1)));"), "(((1)));").nodes[0]) == 1
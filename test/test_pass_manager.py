@@ -0,0 +1,25 @@
+from pass_manager import PassManager
+
+
+def test_pass_manager():
+	calls = []
+
+	def double(unit):
+		calls.append("double")
+		unit[0] *= 2
+		return {"changed": 1}
+
+	def check(unit):
+		calls.append("check")
+
+	passes = PassManager()
+	passes.add("double", double)
+	passes.add("check", check)
+	unit = [3]
+	passes.run(unit)
+	passes.run(unit)
+	assert unit == [12]
+	assert calls == ["double", "check", "double", "check"]
+	assert passes.stats == {"double": {"changed": 2}}
+	assert set(passes.timings) == {"double", "check"}
+	assert all(timing >= 0 for timing in passes.timings.values())
@@ -0,0 +1,98 @@
+from peephole import optimize, effects, parse
+
+
+def test_effects():
+	assert effects(parse("  mov rax, [rbp - 8]")) == ({"rbp"}, {"rax"})
+	assert effects(parse("  mov [rax], rdi")) == ({"rax", "rdi"}, set())
+	assert effects(parse("  add rdi, rsi")) == ({"rdi", "rsi"}, {"rdi"})
+	assert effects(parse("  movzb rdi, al")) == ({"rax"}, {"rdi"})
+	assert effects(parse("  idiv rsi")) == ({"rax", "rdx", "rsi"}, {"rax", "rdx"})
+	assert effects(parse("  jmp .L.end")) is None
+	assert effects(parse(".L.end:")) is None
+
+
+def test_optimize():
+	lines = [
+		"  lea rax, [rbp - 8]",
+		"  mov rax, [rax]",
+		"  push rax",
+		"  mov rax, 2",
+		"  push rax",
+		"  pop rdi",
+		"  pop rax",
+		"  add rax, rdi",
+		"  push rax",
+		"  pop rax",
+		"  mov rax, rax",
+		"  jmp .L.end",
+		".L.end:",
+	]
+	result, stats = optimize(lines)
+	assert result == [
+		"  mov rax, [rbp - 8]",
+		"  push rax",
+		"  mov rdi, 2",
+		"  pop rax",
+		"  add rax, rdi",
+	]
+	assert stats == {
+		"push_pop": 2,
+		"push_pop_move": 1,
+		"lea_load": 1,
+		"self_move": 1,
+		"store_load": 0,
+		"forward_move": 1,
+		"dead_move": 0,
+		"jump_to_next": 1,
+		"unused_label": 1,
+	}
+
+
+def test_optimize_dead_move():
+	lines = [
+		"  mov rdi, 1",
+		"  mov [rbp - 8], rdi",
+		"  mov rax, rdi",
+		"  mov rdi, [rbp - 8]",
+		"  mov rax, rdi",
+		"  mov rdi, rax",
+		"  cmp rdi, 0",
+	]
+	result, stats = optimize(lines, frozenset(["forward_move"]))
+	# 1つ目の mov rax, rdi を消すと、保存した値の読み直しも不要になる
+	assert result == [
+		"  mov rdi, 1",
+		"  mov [rbp - 8], rdi",
+		"  mov rax, rdi",
+		"  mov rdi, rax",
+		"  cmp rdi, 0",
+	]
+	assert "forward_move" not in stats
+	assert stats["dead_move"] == 1
+	assert stats["store_load"] == 1
+
+
+def test_optimize_cascade():
+	# 書き換えると前の命令に規則が当てはまるようになる連鎖も、1回なめるだけで消える
+	depth = 5000
+	lines = ["  mov rax, 1"] + ["  push rax"] * depth + ["  pop rax"] * depth + ["  mov rdi, rax", "  mov rax, 2"]
+	result, stats = optimize(lines)
+	assert result == ["  mov rdi, 1", "  mov rax, 2"]
+	assert stats["push_pop"] == depth * 2 and stats["forward_move"] == 1
+
+
+def test_unused_label():
+	lines = [
+		"main:",
+		".L.begin__1:",
+		"  cmp rax, 0",
+		"  je .L.end__2",
+		".L.else__3:",
+		"  jmp .L.begin__1",
+		".L.end__2:",
+	]
+	result, stats = optimize(lines)
+	assert result == lines[:4] + lines[5:]
+	assert stats["unused_label"] == 1
+	result, stats = optimize(lines, frozenset(["unused_label"]))
+	assert result == lines
@@ -0,0 +1,19 @@
+from register_alloc import label_expression
+from node_parser import node_parse
+from token_parser import tokenize
+
+
+def labels(source: str):
+	node = node_parse(tokenize(source), source).nodes[0]
+	need, pure = label_expression(node)
+	return need[id(node)], pure[id(node)]
+
+
+def test_label_expression():
+	assert labels("1;") == (1, True)
+	assert labels("1 + 2;") == (2, True)
+	assert labels("(1 + 2) * 3;") == (2, True)
+	assert labels("(1 + 2) * (3 + 4);") == (3, True)
+	assert labels("((1 + 2) * (3 + 4)) - 5;") == (3, True)
+	assert labels("a = (1 + 2) * (3 + 4);") == (3, False)
+	assert labels("1 + (a = 2);") == (2, False)
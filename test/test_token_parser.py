@@ -44,3 +44,32 @@ def test_parser():
 		Token(TokenKind.EOF, "", 9)
 	]
 	assert tokenize(testing) == result
+
+
+def test_reserved_word_and_number():
+	testing = "if (x) return 0x1f; else format = 0b101 + 0o17;"
+	result = [
+		Token(TokenKind.IF, "if", 0),
+		Token(TokenKind.RESERVED, "(", 3),
+		Token(TokenKind.IDENT, "x", 4),
+		Token(TokenKind.RESERVED, ")", 5),
+		Token(TokenKind.RETURN, "return", 7),
+		Token(TokenKind.NUM, "31", 14),
+		Token(TokenKind.RESERVED, ";", 18),
+		Token(TokenKind.ELSE, "else", 20),
+		Token(TokenKind.IDENT, "format", 25),
+		Token(TokenKind.RESERVED, "=", 32),
+		Token(TokenKind.NUM, "5", 34),
+		Token(TokenKind.RESERVED, "+", 40),
+		Token(TokenKind.NUM, "15", 42),
+		Token(TokenKind.RESERVED, ";", 46),
+		Token(TokenKind.EOF, "", 47)
+	]
+	assert tokenize(testing) == result
+
+
+def test_operator_codes():
+	tokens = tokenize("foo = 0x10; return foo >= 2;")
+	assert tokens[2].string == "16"
+	assert [token.op for token in tokens[:2]] == [OperatorCode.NONE, OperatorCode.ASSIGN]
+	assert tokens[6].op == OperatorCode.GE
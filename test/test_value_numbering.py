@@ -0,0 +1,46 @@
+from value_numbering import number_values, number_ir_values
+from ir import IRInstruction, lower_function
+from diagnostics import Diagnostics
+from node_parser import *
+from token_parser import tokenize
+
+
+def parse(source: str):
+	return node_parse(tokenize(source), source)
+
+
+def test_number_values():
+	function = parse("a = 1; b = 2; c = (a + b) * (b + a); return c;")
+	stats = number_values(function)
+	assert stats == {"reused_values": 1}
+	# 最初の a + b を一時変数に代入し、2回目はその変数を読む
+	mul = function.nodes[2].rhs
+	temp = function.lvar_offsets[".cse3"]
+	assert mul.lhs.kind == NodeKind.ASSIGN and mul.lhs.lhs.offset == temp
+	assert isinstance(mul.rhs, LocalVarNode) and mul.rhs.offset == temp
+
+	# 続く文でも使えるが、変数に代入した後は別の値になる
+	function = parse("c = a * 2 + 1; d = a * 2; a = 3; e = a * 2; return c + d + e;")
+	assert number_values(function) == {"reused_values": 1}
+
+	# 分岐やループの中へは持ち越さない
+	function = parse("c = a * 2; if (a * 2) d = a * 2; while (c) c = a * 2; return a * 2;")
+	assert number_values(function) == {"reused_values": 1}
+
+
+def test_number_ir_values():
+	source = "a = 1; b = a + 2; c = a + 2; return b + c;"
+	function = lower_function(parse(source), Diagnostics(source))
+	stats = number_ir_values(function)
+	assert stats == {"reused_values": 1, "forwarded_loads": 4}
+	# 代入した値をそのまま使い、load と2回目の add がなくなる
+	assert function.blocks[0].instructions == [
+		IRInstruction("const", 0, [1]),
+		IRInstruction("store", None, [8, 0]),
+		IRInstruction("const", 2, [2]),
+		IRInstruction("add", 3, [0, 2]),
+		IRInstruction("store", None, [16, 3]),
+		IRInstruction("store", None, [24, 3]),
+		IRInstruction("add", 9, [3, 3]),
+		IRInstruction("ret", None, [9]),
+	]
@@ -1,5 +1,7 @@
 import enum
-from typing import List, Optional
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+from diagnostics import Diagnostics
 
 # 長い記号から順に
 reserved_operator = [
@@ -46,25 +48,83 @@ class TokenKind(enum.Enum):
 	FOR = enum.auto()
 
 
+# 構文解析で文字列比較をしないように、記号には整数のコードを振る
+class OperatorCode(enum.IntEnum):
+	NONE = 0  # 記号ではない
+	EQ = enum.auto()  # ==
+	NE = enum.auto()  # !=
+	LE = enum.auto()  # <=
+	GE = enum.auto()  # >=
+	LT = enum.auto()  # <
+	GT = enum.auto()  # >
+	ADD = enum.auto()  # +
+	SUB = enum.auto()  # -
+	MUL = enum.auto()  # *
+	DIV = enum.auto()  # /
+	ASSIGN = enum.auto()  # =
+	LPAREN = enum.auto()  # (
+	RPAREN = enum.auto()  # )
+	SEMICOLON = enum.auto()  # ;
+	LBRACE = enum.auto()  # {
+	RBRACE = enum.auto()  # }
+
+
+reserved_operator_codes: Dict[str, OperatorCode] = {
+	"==": OperatorCode.EQ,
+	"!=": OperatorCode.NE,
+	"<=": OperatorCode.LE,
+	">=": OperatorCode.GE,
+	"<": OperatorCode.LT,
+	">": OperatorCode.GT,
+	"+": OperatorCode.ADD,
+	"-": OperatorCode.SUB,
+	"*": OperatorCode.MUL,
+	"/": OperatorCode.DIV,
+	"=": OperatorCode.ASSIGN,
+	"(": OperatorCode.LPAREN,
+	")": OperatorCode.RPAREN,
+	";": OperatorCode.SEMICOLON,
+	"{": OperatorCode.LBRACE,
+	"}": OperatorCode.RBRACE,
+}
+
+reserved_word_kinds: Dict[str, TokenKind] = {
+	"return": TokenKind.RETURN,
+	"if": TokenKind.IF,
+	"else": TokenKind.ELSE,
+	"while": TokenKind.WHILE,
+	"for": TokenKind.FOR,
+}
+
+
 def reserved_word_to_kind(word: str) -> Optional[TokenKind]:
-	if word == "return":
-		return TokenKind.RETURN
-	if word == "if":
-		return TokenKind.IF
-	if word == "else":
-		return TokenKind.ELSE
-	if word == "while":
-		return TokenKind.WHILE
-	if word == "for":
-		return TokenKind.FOR
-	return None
+	return reserved_word_kinds.get(word)
+
+
+# 1回の走査で全トークンを切り出すための正規表現
+# 記号は長いものから並んでいるので、選択の順番がそのまま最長一致になる
+token_pattern = re.compile(
+	"(?P<PADDING>[" + "".join(map(re.escape, padding)) + "]+)"
+	+ "|(?P<RESERVED>" + "|".join(map(re.escape, reserved_operator)) + ")"
+	+ "|(?P<NUM>0x[0-9a-f]*|0b[01]*|0o[0-7]*|[0-9]+)"
+	+ "|(?P<IDENT>[A-Za-z_][A-Za-z0-9_]*)"
+	+ "|(?P<INVALID>.)",
+	re.DOTALL
+)
+
+num_prefix_bases: Dict[str, int] = {"0x": 16, "0b": 2, "0o": 8}
 
 
 class Token:
-	def __init__(self, kind: TokenKind, string: str, index: int) -> None:
+	__slots__ = ("kind", "string", "index", "op")
+
+	def __init__(self, kind: TokenKind, string: str, index: int, op: Optional[int] = None) -> None:
+		if op is None:
+			op = reserved_operator_codes.get(string, OperatorCode.NONE) if kind == TokenKind.RESERVED else OperatorCode.NONE
 		self.kind: TokenKind = kind
 		self.string: str = string
 		self.index: int = index
+		self.op: int = op
 
 	def __str__(self) -> str:
 		kind: str = str(self.kind).split(".")[1]
@@ -74,128 +134,69 @@ class Token:
 		return self.__str__()
 
 	def __eq__(self, other: "Token") -> bool:
-		return self.__dict__ == other.__dict__
-
-
-def error_token(token: Token, source: str, message: str) -> None:
-	error_with_place(token.index, len(token.string), source, message)
-
-
-def error_with_place(index: int, length: int, source: str, message: str) -> None:
-	column: int = 0
-	row: int = 0
-	for i, si in enumerate(source):
-		if i == index:
-			break
-		row += 1
-		if si == "\n":
-			column += 1
-			row = 0
-	info: str = f"line {column + 1} | "
-	print(info + source.split("\n")[column])
-	padding_length: int = len(info) + row
-	print(" " * padding_length + "^" + "~" * (length - 1))
-	print(f"Error: {message}")
-	exit(1)
-
-
-def match_with_words(cmp: str, search_words: List) -> Optional[str]:
-	for word in search_words:
-		if cmp[:len(word)] == word:
-			return word
-	return None
-
-
-def is_allowed_var_char(char: str):
-	# A-Z a-z 0-9 _
-	return (
-			"A" <= char <= "Z"
-			or "a" <= char <= "z"
-			or "0" <= char <= "9"
-			or char == "_"
-	)
-
-
-def is_allowed_first_var_char(char: str):
-	# A-Z a-z 0-9 _
-	return (
-			"A" <= char <= "Z"
-			or "a" <= char <= "z"
-			or char == "_"
-	)
-
-
-def tokenize(source: str) -> List[Token]:
-	tokens: List[Token] = []
-
-	i: int = 0
-	while i < len(source):
-
-		match_padding = match_with_words(source[i:], padding)
-		if match_padding is not None:
-			i += 1
+		return (
+				isinstance(other, Token)
+				and self.kind == other.kind
+				and self.string == other.string
+				and self.index == other.index
+				and self.op == other.op
+		)
+
+
+def scan(source: str, diagnostics: Optional[Diagnostics] = None) -> Iterator[Tuple[TokenKind, int, int, int]]:
+	# (種類, 記号のコード, 開始位置, 終了位置) を順に返す
+	# diagnosticsが渡されなければ、最後にまとめてCompileErrorを投げる
+	check: bool = diagnostics is None
+	if diagnostics is None:
+		diagnostics = Diagnostics(source)
+
+	for match in token_pattern.finditer(source):
+		group: str = match.lastgroup
+		if group == "PADDING":
 			continue
 
-		match_operator = match_with_words(source[i:], reserved_operator)
-		if match_operator is not None:
-			kind = TokenKind.RESERVED
-			token_str = match_operator
-			tokens.append(Token(kind, token_str, i))
-			i += len(match_operator)
-			continue
+		start: int = match.start()
+		end: int = match.end()
 
-		if source[i].isdigit():
-			kind = TokenKind.NUM
-			token_str = ""
-			allowed_num_string = "0123456789"
-			base = 10
-			match_base = match_with_words(source[i:], ["0x", "0b", "0o"])
-			token_index: int = i
-			if match_base is not None:
-				i += 2
-				if match_base == "0x":
-					allowed_num_string = "0123456789abcdef"
-					base = 16
-				elif match_base == "0b":
-					allowed_num_string = "01"
-					base = 2
-				elif match_base == "0o":
-					allowed_num_string = "01234567"
-					base = 8
-			while i < len(source) and source[i] in allowed_num_string:
-				token_str += source[i]
-				i += 1
-			if token_str == "":
-				error_with_place(i, 1, source, "無効な数値です。")
-			token_str = str(int(token_str, base))
-			tokens.append(Token(kind, token_str, token_index))
+		if group == "RESERVED":
+			yield TokenKind.RESERVED, reserved_operator_codes[match.group()], start, end
 			continue
 
-		match_word = match_with_words(source[i:], reserved_word)
-		if match_word is not None:
-			kind = reserved_word_to_kind(match_word)
-			if kind is None:
-				error_with_place(i, len(match_word), source, "予約語が実装されていません。")
-				raise Exception()
-			token_str = match_word
-			tokens.append(Token(kind, token_str, i))
-			i += len(token_str)
+		if group == "NUM":
+			if end - start == 2 and source[start + 1] in "xbo":
+				diagnostics.error(end, 1, "無効な数値です。")
+			yield TokenKind.NUM, OperatorCode.NONE, start, end
 			continue
 
-		if is_allowed_first_var_char(source[i]):
-			kind = TokenKind.IDENT
-			token_str = ""
-			token_index: int = i
-			while i < len(source) and is_allowed_var_char(source[i]):
-				token_str += source[i]
-				i += 1
-			tokens.append(Token(kind, token_str, token_index))
+		if group == "IDENT":
+			# 識別子を最後まで読んでから予約語かどうかを調べる
+			kind: TokenKind = reserved_word_kinds.get(match.group(), TokenKind.IDENT)
+			yield kind, OperatorCode.NONE, start, end
 			continue
 
-		error_with_place(i, 1, source, "解釈できません")
+		diagnostics.error(start, 1, "解釈できません")
+
+	if check:
+		diagnostics.check()
+	yield TokenKind.EOF, OperatorCode.NONE, len(source), len(source)
+
+
+def token_text(source: str, kind: TokenKind, start: int, end: int) -> str:
+	text: str = source[start:end]
+	if kind == TokenKind.NUM:
+		# 数値は10進数の文字列に揃える
+		base: int = num_prefix_bases.get(text[:2], 10)
+		# 数字のない "0x" などはエラーとして報告済みなので0として扱う
+		text = str(int((text if base == 10 else text[2:]) or "0", base))
+	return text
+
+
+def iter_tokens(source: str, diagnostics: Optional[Diagnostics] = None) -> Iterator[Token]:
+	# トークン列を作らずに、1つずつ切り出して返す
+	for kind, op, start, end in scan(source, diagnostics):
+		yield Token(kind, token_text(source, kind, start, end), start, op)
+
 
-	kind = TokenKind.EOF
-	token_str = ""
-	tokens.append(Token(kind, token_str, i))
+def tokenize(source: str, diagnostics: Optional[Diagnostics] = None) -> List[Token]:
+	return list(iter_tokens(source, diagnostics))
 
-	return tokens
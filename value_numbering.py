@@ -0,0 +1,161 @@
+from node_parser import NodeKind, Node, NumNode, BinaryNode, LocalVarNode, Function, ReturnNode, IfNode, WhileNode, \
+	ForNode, BlockNode, transform
+from loop_opt import assign
+from ir import IRFunction, IRInstruction, binary_ops
+from typing import Dict, List, Optional, Tuple, Union
+
+# 左右を入れ替えても値が変わらない演算
+commutative_kinds = {NodeKind.ADD, NodeKind.MUL, NodeKind.EQ, NodeKind.NE}
+commutative_ops = {"add", "mul", "eq", "ne"}
+# 値の表を捨てる位置の印 (分岐やループの境目)
+RESET = None
+
+
+class ValueNumbering:
+	# 続けて実行される式の中で、同じ値になる部分式を見つける
+	# 最初に計算したところで一時変数に代入し、2回目以降はその変数を読む
+	def __init__(self, function: Function) -> None:
+		self.function: Function = function
+		self.stats: Dict[str, int] = {"reused_values": 0}
+		# 代入のたびに増える、変数ごとの版番号。版が変われば同じ式でも別の値になる
+		self.versions: Dict[int, int] = {}
+		# 式の形 (種類と、オペランドの値番号) -> 値番号。キーが木の深さに比例して入れ子にならないようにする
+		self.table: Dict[tuple, int] = {}
+		# 値番号 -> 最初に計算したノード
+		self.values: Dict[int, Node] = {}
+		# 一時変数に代入するノードと、一時変数で置き換えるノード
+		self.saved: Dict[int, int] = {}
+		self.reused: Dict[int, int] = {}
+
+	def value_number(self, key: tuple) -> int:
+		number: Optional[int] = self.table.get(key)
+		if number is None:
+			number = self.table[key] = len(self.table)
+		return number
+
+	def keys(self, root: Node) -> Dict[int, int]:
+		# 左から後順 (実行される順) に辿り、代入を含まない部分式の値番号を求める
+		keys: Dict[int, int] = {}
+		pure: Dict[int, bool] = {}
+		stack: List[Tuple[Node, bool]] = [(root, False)]
+		while len(stack) != 0:
+			node, visited = stack.pop()
+			if isinstance(node, NumNode):
+				keys[id(node)] = self.value_number((NodeKind.NUM, node.val))
+				pure[id(node)] = True
+			elif isinstance(node, LocalVarNode):
+				keys[id(node)] = self.value_number((NodeKind.LVAR, node.offset, self.versions.get(node.offset, 0)))
+				pure[id(node)] = True
+			elif not isinstance(node, BinaryNode):
+				pure[id(node)] = False
+			elif not visited:
+				stack.append((node, True))
+				stack.append((node.rhs, False))
+				if node.kind != NodeKind.ASSIGN:
+					stack.append((node.lhs, False))
+			elif node.kind == NodeKind.ASSIGN:
+				pure[id(node)] = False
+				if isinstance(node.lhs, LocalVarNode):
+					self.versions[node.lhs.offset] = self.versions.get(node.lhs.offset, 0) + 1
+			else:
+				pure[id(node)] = pure[id(node.lhs)] and pure[id(node.rhs)]
+				if pure[id(node)]:
+					operands: List[int] = [keys[id(node.lhs)], keys[id(node.rhs)]]
+					if node.kind in commutative_kinds:
+						operands.sort()
+					keys[id(node)] = self.value_number((node.kind, *operands))
+		return keys
+
+	def number(self, root: Node) -> None:
+		# 前順に辿り、前に計算した値と同じ部分式を見つける。置き換えた式の中には入らない
+		keys: Dict[int, int] = self.keys(root)
+		stack: List[Node] = [root]
+		while len(stack) != 0:
+			node: Node = stack.pop()
+			key: Optional[int] = keys.get(id(node))
+			if isinstance(node, BinaryNode) and key is not None:
+				first: Optional[Node] = self.values.get(key)
+				if first is not None:
+					if id(first) not in self.saved:
+						self.saved[id(first)] = self.function.add_local("cse")
+					self.reused[id(node)] = self.saved[id(first)]
+					self.stats["reused_values"] += 1
+					continue
+				self.values[key] = node
+			if isinstance(node, BinaryNode):
+				stack.append(node.rhs)
+				if node.kind != NodeKind.ASSIGN:
+					stack.append(node.lhs)
+
+	def statements(self, nodes: List[Node]) -> None:
+		# 文を実行される順に辿る。分岐やループの境目では、それまでの値が使えるとは限らないので表を捨てる
+		stack: List[Optional[Node]] = list(reversed(nodes))
+		while len(stack) != 0:
+			node: Optional[Node] = stack.pop()
+			if node is RESET:
+				self.values = {}
+			elif isinstance(node, (NumNode, LocalVarNode, BinaryNode)):
+				self.number(node)
+			elif isinstance(node, ReturnNode):
+				self.number(node.value)
+			elif isinstance(node, BlockNode):
+				stack.extend(reversed(node.nodes))
+			elif isinstance(node, IfNode):
+				stack.extend([RESET, node.else_node, RESET, node.if_node, RESET])
+				self.number(node.conditions)
+			elif isinstance(node, WhileNode):
+				stack.extend([RESET, node.loop_node, RESET, node.conditions, RESET])
+			elif isinstance(node, ForNode):
+				stack.extend([RESET, node.inc, RESET, node.loop_node, RESET, node.conditions, RESET, node.init])
+
+	def replace(self, node: Node) -> Node:
+		if id(node) in self.reused:
+			return LocalVarNode(self.reused[id(node)], node.token)
+		if id(node) in self.saved:
+			return assign(self.saved[id(node)], node, node.token)
+		return node
+
+
+def number_values(function: Function) -> Dict[str, int]:
+	# 木の上で局所的な値番号付けをして、同じ式の再計算を取り除く。木はその場で書き換える
+	numbering: ValueNumbering = ValueNumbering(function)
+	numbering.statements(function.nodes)
+	if len(numbering.reused) != 0:
+		function.nodes = [transform(node, numbering.replace) for node in function.nodes]
+	return numbering.stats
+
+
+def number_ir_values(function: IRFunction) -> Dict[str, int]:
+	# 基本ブロックごとに値番号付けをして、同じ計算と、値の分かっている変数の load を取り除く
+	stats: Dict[str, int] = {"reused_values": 0, "forwarded_loads": 0}
+	for block in function.blocks:
+		values: Dict[tuple, int] = {}
+		# ローカル変数 -> 今入っている値の仮想レジスタ
+		contents: Dict[int, int] = {}
+		renamed: Dict[int, int] = {}
+		instructions: List[IRInstruction] = []
+		for instruction in block.instructions:
+			instruction = instruction.renamed(renamed)
+			args: List[Union[int, str]] = instruction.args
+			if instruction.op == "load":
+				if args[0] in contents:
+					renamed[instruction.dst] = contents[args[0]]
+					stats["forwarded_loads"] += 1
+					continue
+				contents[args[0]] = instruction.dst
+			elif instruction.op == "store":
+				contents[args[0]] = args[1]
+			elif instruction.op == "const" or instruction.op in binary_ops.values():
+				operands: List[Union[int, str]] = args[:]
+				if instruction.op in commutative_ops:
+					operands.sort()
+				key: tuple = (instruction.op, *operands)
+				if key in values:
+					renamed[instruction.dst] = values[key]
+					if instruction.op != "const":
+						stats["reused_values"] += 1
+					continue
+				values[key] = instruction.dst
+			instructions.append(instruction)
+		block.instructions = instructions
+	return stats